@@ -1,15 +1,23 @@
-import os, json, argparse, math, datetime, statistics
+import os, sys, json, argparse, math, datetime, sqlite3
 from pathlib import Path
+
+# price_daily / covariance / the compiled policy are the repo's (one copy, not vendored into
+# this snapshot): when the snapshot sits inside the repo, its root goes first on sys.path
+REPO = Path(__file__).resolve().parents[4]
+if (REPO / "libs" / "covariance.py").exists() and str(REPO) not in sys.path:
+    sys.path.insert(0, str(REPO))
+
+from apps.rebalancer.policy import get_policy
 from libs.db import get_conn
+from libs.price_daily import daily_closes
+from libs.covariance import CovarianceCache
 from libs.logger import get_logger
 
 log = get_logger("rebalancer")
 BASE = Path(__file__).resolve().parents[2]
 CFG_PATH = BASE / "configs" / "policy.rebalancer.json"
-
-def load_cfg():
-    with open(CFG_PATH, "r", encoding="utf-8") as f:
-        return json.load(f)
+COV_STATE = BASE / "data" / "cov.band_dynamic.json"
+DB_PATH = os.getenv("LEDGER_DB_PATH", str(BASE / "data" / "ledger.db"))
 
 def latest_price(conn, instr):
     r = conn.execute("SELECT px FROM price WHERE instrument_id=? ORDER BY ts DESC LIMIT 1",(instr,)).fetchone()
@@ -26,21 +34,10 @@ def round_step(qty, step):
 # ---- helpers for daily series, lookback returns, and vol ----
 
 def _daily_series(conn, symbol, max_days):
-    # Build per-day latest close from price table (robust to multiple ticks per day)
-    rows = conn.execute("SELECT ts, px FROM price WHERE instrument_id=? ORDER BY ts DESC LIMIT 50000",(symbol,)).fetchall()
-    by_day = {}
-    for r in rows:
-        d = r["ts"][:10]
-        if d not in by_day:
-            by_day[d] = r["px"]   # first seen is the latest that day (DESC)
-        if len(by_day) >= max_days + 3:
-            # enough coverage; keep scanning in case of gaps, but this is fast anyway
-            pass
-    days = sorted(by_day.keys())
-    if len(days) < 2: return []
-    # return last max_days+1 points ascending
-    days = days[-(max_days+1):]
-    return [(d, by_day[d]) for d in days]
+    # Per-day latest close: a short index range scan on price_daily when the writers have
+    # built it, otherwise the same grouping over raw ticks (read-only either way)
+    ser = daily_closes(conn, symbol, max_days+1)
+    return ser if len(ser) >= 2 else []
 
 def lookback_return(conn, symbol, look):
     ser = _daily_series(conn, symbol, look)
@@ -50,76 +47,57 @@ def lookback_return(conn, symbol, look):
         return end_px / start_px - 1.0
     return None
 
-def symbol_ann_vol(conn, symbol, look):
-    ser = _daily_series(conn, symbol, look)
-    if len(ser) < 3: return None
-    pxs = [v for _,v in ser]
-    rets = []
-    for i in range(1,len(pxs)):
-        if pxs[i-1] and pxs[i-1] > 0:
-            rets.append(pxs[i]/pxs[i-1] - 1.0)
-    if len(rets) < 2: return None
-    sd = statistics.stdev(rets)
-    return sd * math.sqrt(365.0)
-
-def portfolio_ann_vol(conn, symbols, weights, look):
-    # diagonal-only proxy: sqrt(sum (w_i^2 * vol_i^2))
-    var = 0.0; any_vol=False
-    for s in symbols:
-        vol = symbol_ann_vol(conn, s, look)
-        if vol is not None:
-            any_vol=True
-            var += (weights.get(s,0.0)**2) * (vol**2)
-    return math.sqrt(var) if any_vol else None
+def portfolio_ann_vol(conn, symbols, weights, look, method="rolling"):
+    # sqrt(w' S w) with the full covariance of daily returns over `look` days (or EWMA),
+    # updated incrementally from the daily closes and persisted between runs
+    cov = CovarianceCache(COV_STATE, symbols, method=method, window=look).refresh(conn)
+    return cov.portfolio_vol(weights)
 
 def compute_actions(account="trading", override_prices=None):
-    cfg = load_cfg()
-    # base policy targets as { "BTC": 0.40, ... }
-    base_targets = cfg.get("targets_trading", {})
+    # validated, typed and shared by every caller; re-parsed only when the file changes
+    pol = get_policy(CFG_PATH)
     # working targets dict keyed by base symbols (BTC/ETH/...)
-    targets = { k.upper(): float(v) for k,v in base_targets.items() if k.upper() != "USD" }
-
-    band_cfg = cfg.get("band_dynamic", {})
-    band = float(cfg.get("bands_pct", 0.05))  # legacy base band (used if dynamic disabled)
-    min_usd = float(cfg.get("min_trade_usd", 1000))
-    move_fraction = float(cfg.get("move_fraction", 0.5))
-    daily_cap = float(cfg.get("daily_turnover_cap_usd", 1e15))
-    per_asset_caps = { (k.upper()+"-USD"): float(v) for k, v in cfg.get("per_asset_cap_usd", {}).items() }
-    fee_bps = float(cfg.get("taker_fee_bps", 0.0))
-    slip_bps = float(cfg.get("slippage_bps", 0.0))
-    qty_step = { (k.upper()+"-USD"): float(v) for k, v in cfg.get("qty_step", {}).items() }
-    max_trade_count = int(cfg.get("max_trade_count", 99))
-    ensure_cash = bool(cfg.get("ensure_cash", True))
+    targets = dict(pol.targets)
+
+    band = pol.bands_pct  # legacy base band (used if dynamic disabled)
+    min_usd = pol.min_trade_usd
+    move_fraction = pol.move_fraction
+    daily_cap = pol.daily_turnover_cap_usd
+    per_asset_caps = dict(pol.per_asset_cap_usd)
+    fee_bps = pol.taker_fee_bps
+    slip_bps = pol.slippage_bps
+    qty_step = dict(pol.qty_step)
+    max_trade_count = pol.max_trade_count
+    ensure_cash = pol.ensure_cash
 
     # optional features
-    mom = cfg.get("momentum", {})
-    mom_en = bool(mom.get("enabled", False))
-    mom_look = int(mom.get("lookback_days",60))
-    mom_tilt_max = float(mom.get("tilt_max_pct",0.05))
-    mom_strength = float(mom.get("tilt_strength",1.0))
-
-    gate = cfg.get("satellite_gate", {})
-    gate_en = bool(gate.get("enabled", False))
-    gate_syms = [s.upper() for s in gate.get("symbols", [])]
-    gate_look = int(gate.get("lookback_days", 60))
-    gate_thr = float(gate.get("threshold_ret", 0.0))
-    gate_maxw = { k.upper(): float(v) for k,v in gate.get("max_weight_pct", {}).items() }
-
-    cash_cfg = cfg.get("cash", {})
-    cash_floor = float(cash_cfg.get("floor_usd", 0.0))
-    cash_deploy = float(cash_cfg.get("auto_deploy_usd_per_day", 0.0))
-    cash_prorata = bool(cash_cfg.get("pro_rata_underweights", True))
-
-    dyn_en   = bool(band_cfg.get("enabled", False))
-    dyn_base = float(band_cfg.get("base", band))
-    dyn_look = int(band_cfg.get("lookback_days", 30))
-    dyn_tgtv = float(band_cfg.get("target_ann_vol", 0.35))
-    dyn_min  = float(band_cfg.get("min", 0.02))
-    dyn_max  = float(band_cfg.get("max", 0.08))
+    mom_en = pol.momentum.enabled
+    mom_look = pol.momentum.lookback_days
+    mom_tilt_max = pol.momentum.tilt_max_pct
+    mom_strength = pol.momentum.tilt_strength
+
+    gate_en = pol.satellite_gate.enabled
+    gate_syms = list(pol.satellite_gate.symbols)
+    gate_look = pol.satellite_gate.lookback_days
+    gate_thr = pol.satellite_gate.threshold_ret
+    gate_maxw = pol.satellite_gate.max_weight_pct
+
+    cash_floor = pol.cash.floor_usd
+    cash_deploy = pol.cash.auto_deploy_usd_per_day
+    cash_prorata = pol.cash.pro_rata_underweights
+
+    dyn_en   = pol.band_dynamic.enabled
+    dyn_base = pol.band_dynamic.base
+    dyn_look = pol.band_dynamic.lookback_days
+    dyn_tgtv = pol.band_dynamic.target_ann_vol
+    dyn_min  = pol.band_dynamic.min
+    dyn_max  = pol.band_dynamic.max
+    dyn_cov  = str((pol.raw.get("band_dynamic") or {}).get("cov_method", "rolling"))  # rolling | ewma
 
     # instrument symbols ("BTC-USD", ...)
     symbols = sorted([f"{k.upper()}-USD" for k in targets.keys() if k.upper() != "USD"])
-    conn = get_conn()
+    conn = get_conn(DB_PATH)
+    conn.row_factory = sqlite3.Row
 
     # Gather prices/balances
     px = {}; qty = {}
@@ -136,68 +114,10 @@ def compute_actions(account="trading", override_prices=None):
     # sanity: missing prices?
     missing = [s for s in symbols if not px[s]]
     if missing:
-    # === Strict cash-deploy cap (post-processing) ===
-    try:
-        cash_cfg = cfg.get("cash", {})
-        cash_floor = float(cash_cfg.get("floor_usd", 0.0))
-        cash_auto  = float(cash_cfg.get("auto_deploy_usd_per_day", 0.0))
-
-        buys  = [a for a in actions if a["usd"] > 0]
-        sells = [a for a in actions if a["usd"] < 0]
-        buy_total  = sum(a["usd"]   for a in buys)
-        sell_total = sum(-a["usd"]  for a in sells)
-
-        cash_headroom = max(0.0, usd - cash_floor)
-        cash_budget   = min(cash_auto, cash_headroom)
-
-        # Net new cash required (buys beyond proceeds)
-        net_cash_needed = max(0.0, buy_total - sell_total)
-
-        if net_cash_needed > cash_budget and buy_total > 0:
-            target_buys = sell_total + cash_budget
-            scale = target_buys / buy_total
-            for a in buys:
-                a["qty"] = float(a["qty"] * scale)
-                a["usd"] = float(a["usd"] * scale)
-                a["note"] = "cash_deploy"
-            # Drop tiny legs after scaling
-            actions = [a for a in actions if abs(a["usd"]) >= min_usd]
-    except Exception:
-        pass
-
         return {"error": f"Missing prices for: {', '.join(missing)}"}
 
     crypto_val = sum((qty[s] or 0.0) * px[s] for s in symbols)
     if crypto_val <= 0:
-    # === Strict cash-deploy cap (post-processing) ===
-    try:
-        cash_cfg = cfg.get("cash", {})
-        cash_floor = float(cash_cfg.get("floor_usd", 0.0))
-        cash_auto  = float(cash_cfg.get("auto_deploy_usd_per_day", 0.0))
-
-        buys  = [a for a in actions if a["usd"] > 0]
-        sells = [a for a in actions if a["usd"] < 0]
-        buy_total  = sum(a["usd"]   for a in buys)
-        sell_total = sum(-a["usd"]  for a in sells)
-
-        cash_headroom = max(0.0, usd - cash_floor)
-        cash_budget   = min(cash_auto, cash_headroom)
-
-        # Net new cash required (buys beyond proceeds)
-        net_cash_needed = max(0.0, buy_total - sell_total)
-
-        if net_cash_needed > cash_budget and buy_total > 0:
-            target_buys = sell_total + cash_budget
-            scale = target_buys / buy_total
-            for a in buys:
-                a["qty"] = float(a["qty"] * scale)
-                a["usd"] = float(a["usd"] * scale)
-                a["note"] = "cash_deploy"
-            # Drop tiny legs after scaling
-            actions = [a for a in actions if abs(a["usd"]) >= min_usd]
-    except Exception:
-        pass
-
         return {"error": "No crypto balances; set balances first."}
 
     # ===== Momentum tilt on targets (if enabled) =====
@@ -245,7 +165,7 @@ def compute_actions(account="trading", override_prices=None):
 
     # ===== Dynamic bands (A3) =====
     if dyn_en:
-        port_vol = portfolio_ann_vol(conn, symbols, weights, dyn_look)
+        port_vol = portfolio_ann_vol(conn, symbols, weights, dyn_look, dyn_cov)
         if port_vol is not None and dyn_tgtv > 0:
             dyn_band = dyn_base * (port_vol / dyn_tgtv)
             band = max(dyn_min, min(dyn_max, dyn_band))
@@ -357,9 +277,7 @@ def compute_actions(account="trading", override_prices=None):
     actions = sorted(actions, key=lambda x: abs(x["usd"]), reverse=True)[:max_trade_count]
     # === Strict cash-deploy cap (post-processing) ===
     try:
-        cash_cfg = cfg.get("cash", {})
-        cash_floor = float(cash_cfg.get("floor_usd", 0.0))
-        cash_auto  = float(cash_cfg.get("auto_deploy_usd_per_day", 0.0))
+        cash_auto = cash_deploy
 
         buys  = [a for a in actions if a["usd"] > 0]
         sells = [a for a in actions if a["usd"] < 0]
@@ -404,10 +322,10 @@ def compute_actions(account="trading", override_prices=None):
             "qty_step": qty_step,
             "max_trade_count": max_trade_count,
             "ensure_cash": ensure_cash,
-            "momentum": mom,
-            "satellite_gate": gate,
-            "band_dynamic": band_cfg,
-            "cash": cash_cfg
+            "momentum": pol.raw.get("momentum", {}),
+            "satellite_gate": pol.raw.get("satellite_gate", {}),
+            "band_dynamic": pol.raw.get("band_dynamic", {}),
+            "cash": pol.raw.get("cash", {})
         }
     }
 
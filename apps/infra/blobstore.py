@@ -0,0 +1,450 @@
+# apps/infra/blobstore.py
+"""
+Small object-store layer used by the state helpers.
+
+Both backends expose the same primitives with GCS semantics:
+  - every object has a generation; writes can be made conditional on it
+  - create() is create-only (if_generation_match=0); put() overwrites, optionally
+    conditional on the current generation (compare-and-swap)
+  - compose() concatenates up to 32 sources server-side into a destination
+
+GCSBlobStore wraps a google.cloud.storage bucket; gcs_client() is the one authenticated,
+connection-pooled client the process shares. LocalBlobStore keeps objects under a directory
+so the same code runs offline (tests, dev boxes); MemoryBlobStore keeps them in a dict.
+"""
+import os, json, time, threading
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence
+
+COMPOSE_MAX_SOURCES = 32
+
+
+class BlobNotFound(KeyError):
+    """Object (or the requested generation of it) does not exist."""
+
+
+class PreconditionFailed(RuntimeError):
+    """A generation precondition did not hold; someone else wrote first."""
+
+
+@dataclass(frozen=True)
+class BlobStat:
+    name: str
+    generation: int
+    size: int
+    metadata: Dict[str, str] = field(default_factory=dict)
+
+
+# ---------- GCS ----------
+
+GCS_BATCH_MAX = 100  # sub-requests per JSON batch call
+
+_CLIENTS: Dict[Optional[str], object] = {}
+_CLIENTS_LOCK = threading.Lock()
+
+
+def gcs_client(project: Optional[str] = None):
+    """
+    Process-wide storage.Client (one per project). Credentials are discovered once and the
+    HTTP session keeps up to GCS_POOL_SIZE connections alive (default: GCS_IO_THREADS, 32), so
+    concurrent calls from the I/O pool reuse TLS connections instead of dialing new ones.
+    """
+    with _CLIENTS_LOCK:
+        client = _CLIENTS.get(project)
+        if client is None:
+            import google.auth  # lazy imports
+            from google.auth.transport.requests import AuthorizedSession
+            from google.cloud import storage
+            from requests.adapters import HTTPAdapter
+            creds, default_project = google.auth.default(
+                scopes=("https://www.googleapis.com/auth/devstorage.full_control",))
+            pool = int(os.getenv("GCS_POOL_SIZE") or os.getenv("GCS_IO_THREADS") or "32")
+            session = AuthorizedSession(creds)
+            session.mount("https://", HTTPAdapter(pool_connections=pool, pool_maxsize=pool))
+            client = _CLIENTS[project] = storage.Client(project=project or default_project,
+                                                        credentials=creds, _http=session)
+    return client
+
+
+class GCSBlobStore:
+    def __init__(self, bucket):
+        self.bucket = bucket
+
+    @staticmethod
+    def _stat(blob) -> BlobStat:
+        return BlobStat(blob.name, int(blob.generation or 0), int(blob.size or 0), dict(blob.metadata or {}))
+
+    def stat(self, name: str) -> Optional[BlobStat]:
+        blob = self.bucket.get_blob(name)
+        return self._stat(blob) if blob is not None else None
+
+    def read(self, name: str, start: int = 0, generation: Optional[int] = None) -> bytes:
+        from google.api_core.exceptions import NotFound
+        blob = self.bucket.blob(name, generation=generation)
+        try:
+            return blob.download_as_bytes(start=start or None)
+        except NotFound:
+            raise BlobNotFound(name)
+
+    def create(self, name: str, data: bytes, content_type: str = "application/octet-stream") -> int:
+        from google.api_core.exceptions import PreconditionFailed as _GcsPrecondition
+        blob = self.bucket.blob(name)
+        blob.cache_control = "no-store"
+        try:
+            blob.upload_from_string(data, content_type=content_type, if_generation_match=0)
+        except _GcsPrecondition:
+            raise PreconditionFailed(name)
+        return int(blob.generation or 0)
+
+    def put(
+        self,
+        name: str,
+        data: bytes,
+        if_generation_match: Optional[int] = None,
+        metadata: Optional[Dict[str, str]] = None,
+        content_type: str = "application/octet-stream",
+    ) -> int:
+        """Overwrite `name`; with if_generation_match it only lands if nobody wrote since."""
+        from google.api_core.exceptions import PreconditionFailed as _GcsPrecondition
+        blob = self.bucket.blob(name)
+        blob.cache_control = "no-store"
+        blob.metadata = metadata or {}
+        try:
+            blob.upload_from_string(data, content_type=content_type, if_generation_match=if_generation_match)
+        except _GcsPrecondition:
+            raise PreconditionFailed(name)
+        return int(blob.generation or 0)
+
+    def put_file(self, name: str, path, metadata: Optional[Dict[str, str]] = None) -> int:
+        blob = self.bucket.blob(name)
+        blob.cache_control = "no-store"
+        blob.metadata = metadata or {}
+        blob.upload_from_filename(str(path))
+        return int(blob.generation or 0)
+
+    def read_to_file(self, name: str, path, generation: Optional[int] = None) -> None:
+        from google.api_core.exceptions import NotFound
+        try:
+            self.bucket.blob(name, generation=generation).download_to_filename(str(path))
+        except NotFound:
+            raise BlobNotFound(name)
+
+    def list(self, prefix: str) -> List[BlobStat]:
+        blobs = self.bucket.client.list_blobs(self.bucket, prefix=prefix)
+        return sorted((self._stat(b) for b in blobs), key=lambda s: s.name)
+
+    def compose(
+        self,
+        dest: str,
+        sources: Sequence[str],
+        if_generation_match: int,
+        metadata: Optional[Dict[str, str]] = None,
+        content_type: str = "application/octet-stream",
+    ) -> int:
+        from google.api_core.exceptions import NotFound, PreconditionFailed as _GcsPrecondition
+        if not sources or len(sources) > COMPOSE_MAX_SOURCES:
+            raise ValueError(f"compose needs 1..{COMPOSE_MAX_SOURCES} sources, got {len(sources)}")
+        blob = self.bucket.blob(dest)
+        blob.content_type = content_type
+        blob.cache_control = "no-store"
+        blob.metadata = metadata or {}
+        try:
+            blob.compose([self.bucket.blob(s) for s in sources], if_generation_match=if_generation_match)
+        except _GcsPrecondition:
+            raise PreconditionFailed(dest)
+        except NotFound as e:
+            raise BlobNotFound(str(e))
+        return int(blob.generation or 0)
+
+    def delete(self, name: str) -> None:
+        from google.api_core.exceptions import NotFound
+        try:
+            self.bucket.blob(name).delete()
+        except NotFound:
+            pass
+
+    def delete_many(self, names: Sequence[str]) -> None:
+        """Delete in JSON batch calls (one round trip per GCS_BATCH_MAX names); missing names are ignored."""
+        for i in range(0, len(names), GCS_BATCH_MAX):
+            with self.bucket.client.batch(raise_exception=False):
+                for n in names[i:i + GCS_BATCH_MAX]:
+                    self.bucket.blob(n).delete()
+
+
+# ---------- local directory ----------
+
+class LocalBlobStore:
+    """
+    Directory-backed store. Object bytes live at <root>/<name>; generation and metadata in
+    <root>/.meta/<name>.json. Conditional writes are serialized by a lock file so several
+    processes can share one root.
+    """
+
+    _META = ".meta"
+    _LOCK = ".lock"
+
+    def __init__(self, root, lock_timeout: float = 10.0):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.lock_timeout = lock_timeout
+        self._tlock = threading.Lock()
+
+    # -- paths / locking
+
+    def _path(self, name: str) -> Path:
+        return self.root / name
+
+    def _meta_path(self, name: str) -> Path:
+        return self.root / self._META / (name + ".json")
+
+    def _acquire(self) -> None:
+        self._tlock.acquire()
+        lock = self.root / self._LOCK
+        deadline = time.monotonic() + self.lock_timeout
+        while True:
+            try:
+                fd = os.open(lock, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+                os.close(fd)
+                return
+            except FileExistsError:
+                if time.monotonic() > deadline:
+                    # stale lock from a crashed writer
+                    try:
+                        os.remove(lock)
+                    except FileNotFoundError:
+                        pass
+                    deadline = time.monotonic() + self.lock_timeout
+                time.sleep(0.001)
+
+    def _release(self) -> None:
+        try:
+            os.remove(self.root / self._LOCK)
+        finally:
+            self._tlock.release()
+
+    def _load_meta(self, name: str) -> Optional[dict]:
+        try:
+            return json.loads(self._meta_path(name).read_text(encoding="utf-8"))
+        except FileNotFoundError:
+            return None
+
+    def _write(self, name: str, data: bytes, metadata: Dict[str, str], content_type: str) -> int:
+        gen = time.time_ns()
+        prev = self._load_meta(name)
+        if prev and int(prev["generation"]) >= gen:
+            gen = int(prev["generation"]) + 1
+        p = self._path(name); mp = self._meta_path(name)
+        p.parent.mkdir(parents=True, exist_ok=True)
+        mp.parent.mkdir(parents=True, exist_ok=True)
+        tmp = p.with_name(p.name + f".tmp{os.getpid()}")
+        tmp.write_bytes(data)
+        os.replace(tmp, p)
+        mtmp = mp.with_name(mp.name + f".tmp{os.getpid()}")
+        mtmp.write_text(json.dumps({"generation": gen, "metadata": metadata, "content_type": content_type}), encoding="utf-8")
+        os.replace(mtmp, mp)
+        return gen
+
+    # -- primitives
+
+    def stat(self, name: str) -> Optional[BlobStat]:
+        meta = self._load_meta(name)
+        if meta is None:
+            return None
+        try:
+            size = self._path(name).stat().st_size
+        except FileNotFoundError:
+            return None
+        return BlobStat(name, int(meta["generation"]), size, dict(meta.get("metadata") or {}))
+
+    def read(self, name: str, start: int = 0, generation: Optional[int] = None) -> bytes:
+        self._acquire()
+        try:
+            meta = self._load_meta(name)
+            if meta is None or (generation is not None and int(meta["generation"]) != int(generation)):
+                raise BlobNotFound(name)
+            try:
+                with open(self._path(name), "rb") as f:
+                    f.seek(start)
+                    return f.read()
+            except FileNotFoundError:
+                raise BlobNotFound(name)
+        finally:
+            self._release()
+
+    def create(self, name: str, data: bytes, content_type: str = "application/octet-stream") -> int:
+        self._acquire()
+        try:
+            if self._load_meta(name) is not None:
+                raise PreconditionFailed(name)
+            return self._write(name, data, {}, content_type)
+        finally:
+            self._release()
+
+    def put(
+        self,
+        name: str,
+        data: bytes,
+        if_generation_match: Optional[int] = None,
+        metadata: Optional[Dict[str, str]] = None,
+        content_type: str = "application/octet-stream",
+    ) -> int:
+        self._acquire()
+        try:
+            if if_generation_match is not None:
+                cur = self._load_meta(name)
+                if (int(cur["generation"]) if cur else 0) != int(if_generation_match):
+                    raise PreconditionFailed(name)
+            return self._write(name, data, dict(metadata or {}), content_type)
+        finally:
+            self._release()
+
+    def put_file(self, name: str, path, metadata: Optional[Dict[str, str]] = None) -> int:
+        return self.put(name, Path(path).read_bytes(), metadata=metadata)
+
+    def read_to_file(self, name: str, path, generation: Optional[int] = None) -> None:
+        Path(path).write_bytes(self.read(name, generation=generation))
+
+    def list(self, prefix: str) -> List[BlobStat]:
+        meta_root = self.root / self._META
+        out: List[BlobStat] = []
+        if not meta_root.exists():
+            return out
+        for mp in meta_root.rglob("*.json"):
+            name = mp.relative_to(meta_root).as_posix()[: -len(".json")]
+            if name.startswith(prefix):
+                st = self.stat(name)
+                if st is not None:
+                    out.append(st)
+        return sorted(out, key=lambda s: s.name)
+
+    def compose(
+        self,
+        dest: str,
+        sources: Sequence[str],
+        if_generation_match: int,
+        metadata: Optional[Dict[str, str]] = None,
+        content_type: str = "application/octet-stream",
+    ) -> int:
+        if not sources or len(sources) > COMPOSE_MAX_SOURCES:
+            raise ValueError(f"compose needs 1..{COMPOSE_MAX_SOURCES} sources, got {len(sources)}")
+        self._acquire()
+        try:
+            cur = self._load_meta(dest)
+            cur_gen = int(cur["generation"]) if cur else 0
+            if cur_gen != int(if_generation_match):
+                raise PreconditionFailed(dest)
+            chunks = []
+            for s in sources:
+                try:
+                    chunks.append(self._path(s).read_bytes())
+                except FileNotFoundError:
+                    raise BlobNotFound(s)
+            return self._write(dest, b"".join(chunks), dict(metadata or {}), content_type)
+        finally:
+            self._release()
+
+    def delete(self, name: str) -> None:
+        self._acquire()
+        try:
+            for p in (self._meta_path(name), self._path(name)):
+                try:
+                    os.remove(p)
+                except FileNotFoundError:
+                    pass
+        finally:
+            self._release()
+
+    def delete_many(self, names: Sequence[str]) -> None:
+        for n in names:
+            self.delete(n)
+
+
+# ---------- memory ----------
+
+class MemoryBlobStore:
+    """Dict-backed store for tests: same semantics as the others, nothing touches disk."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._objs: Dict[str, tuple] = {}  # name -> (data, generation, metadata, content_type)
+        self._gen = 0
+
+    def _write(self, name: str, data: bytes, metadata: Dict[str, str], content_type: str) -> int:
+        self._gen += 1
+        self._objs[name] = (bytes(data), self._gen, dict(metadata), content_type)
+        return self._gen
+
+    def _current(self, name: str) -> int:
+        o = self._objs.get(name)
+        return o[1] if o else 0
+
+    def stat(self, name: str) -> Optional[BlobStat]:
+        with self._lock:
+            o = self._objs.get(name)
+        return BlobStat(name, o[1], len(o[0]), dict(o[2])) if o else None
+
+    def read(self, name: str, start: int = 0, generation: Optional[int] = None) -> bytes:
+        with self._lock:
+            o = self._objs.get(name)
+        if o is None or (generation is not None and o[1] != int(generation)):
+            raise BlobNotFound(name)
+        return o[0][start:]
+
+    def create(self, name: str, data: bytes, content_type: str = "application/octet-stream") -> int:
+        with self._lock:
+            if name in self._objs:
+                raise PreconditionFailed(name)
+            return self._write(name, data, {}, content_type)
+
+    def put(
+        self,
+        name: str,
+        data: bytes,
+        if_generation_match: Optional[int] = None,
+        metadata: Optional[Dict[str, str]] = None,
+        content_type: str = "application/octet-stream",
+    ) -> int:
+        with self._lock:
+            if if_generation_match is not None and self._current(name) != int(if_generation_match):
+                raise PreconditionFailed(name)
+            return self._write(name, data, dict(metadata or {}), content_type)
+
+    def put_file(self, name: str, path, metadata: Optional[Dict[str, str]] = None) -> int:
+        return self.put(name, Path(path).read_bytes(), metadata=metadata)
+
+    def read_to_file(self, name: str, path, generation: Optional[int] = None) -> None:
+        Path(path).write_bytes(self.read(name, generation=generation))
+
+    def list(self, prefix: str) -> List[BlobStat]:
+        with self._lock:
+            items = [(n, o) for n, o in self._objs.items() if n.startswith(prefix)]
+        return [BlobStat(n, o[1], len(o[0]), dict(o[2])) for n, o in sorted(items)]
+
+    def compose(
+        self,
+        dest: str,
+        sources: Sequence[str],
+        if_generation_match: int,
+        metadata: Optional[Dict[str, str]] = None,
+        content_type: str = "application/octet-stream",
+    ) -> int:
+        if not sources or len(sources) > COMPOSE_MAX_SOURCES:
+            raise ValueError(f"compose needs 1..{COMPOSE_MAX_SOURCES} sources, got {len(sources)}")
+        with self._lock:
+            if self._current(dest) != int(if_generation_match):
+                raise PreconditionFailed(dest)
+            missing = [s for s in sources if s not in self._objs]
+            if missing:
+                raise BlobNotFound(missing[0])
+            data = b"".join(self._objs[s][0] for s in sources)
+            return self._write(dest, data, dict(metadata or {}), content_type)
+
+    def delete(self, name: str) -> None:
+        with self._lock:
+            self._objs.pop(name, None)
+
+    def delete_many(self, names: Sequence[str]) -> None:
+        with self._lock:
+            for n in names:
+                self._objs.pop(n, None)
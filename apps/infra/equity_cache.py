@@ -0,0 +1,106 @@
+# apps/infra/equity_cache.py
+"""
+In-process cache of the NAV series behind /equity_curve and /metrics.
+
+The cache holds a cursor into the snapshots log (apps.infra.ndjson_log). A refresh costs two
+metadata calls when nothing changed, and otherwise only reads the records appended since the
+last refresh. Points live in two parallel arrays sorted by ts, so a days= window is a bisect.
+A PerfStats over the whole series is carried along, so /metrics over a window that covers
+all history costs nothing beyond the refresh.
+"""
+import threading, time
+from array import array
+from bisect import bisect_left, bisect_right
+from typing import Any, Callable, Dict, List, Optional
+
+from .ndjson_log import LogCursor, SegmentedLog
+from .perfstats import PerfStats
+
+
+def _point(rec: Dict[str, Any]):
+    try:
+        ts = int(rec.get("ts", 0))
+        nav = rec.get("nav")
+        if nav is None:
+            nav = rec.get("nav_after", 0.0)
+        return ts, float(nav)
+    except Exception:
+        return None
+
+
+class EquitySeries:
+    """(ts, nav) points kept sorted by ts in array('q') / array('d')."""
+
+    def __init__(self):
+        self.ts = array("q")
+        self.nav = array("d")
+
+    def __len__(self) -> int:
+        return len(self.ts)
+
+    def add(self, ts: int, nav: float) -> bool:
+        """Insert a point; returns True if it landed at the end (the usual case)."""
+        # Appends are almost always in time order; equal ts keep arrival order.
+        if not self.ts or ts >= self.ts[-1]:
+            self.ts.append(ts); self.nav.append(nav)
+            return True
+        i = bisect_right(self.ts, ts)
+        self.ts.insert(i, ts); self.nav.insert(i, nav)
+        return False
+
+    def window_start(self, since_ts: int) -> int:
+        return bisect_left(self.ts, since_ts)
+
+    def points(self, since_ts: int) -> List[Dict[str, float]]:
+        i = self.window_start(since_ts)
+        return [{"ts": t, "nav": v} for t, v in zip(self.ts[i:], self.nav[i:])]
+
+    def stats(self, start: int = 0) -> PerfStats:
+        st = PerfStats()
+        for t, v in zip(self.ts[start:], self.nav[start:]):
+            st.push(v, t)
+        return st
+
+
+class EquityCache:
+    def __init__(self, log_factory: Callable[[], SegmentedLog]):
+        self._log_factory = log_factory
+        self._lock = threading.Lock()
+        self._cursor: Optional[LogCursor] = None
+        self.series = EquitySeries()
+        self._stats: Optional[PerfStats] = PerfStats()
+
+    def refresh(self) -> EquitySeries:
+        with self._lock:
+            recs, cursor, reset = self._log_factory().tail(self._cursor)
+            series = EquitySeries() if reset else self.series
+            stats = PerfStats() if reset else self._stats
+            for r in recs:
+                p = _point(r)
+                if p is None:
+                    continue
+                if series.add(*p):
+                    if stats is not None:
+                        stats.push(p[1], p[0])
+                else:
+                    stats = None  # out-of-order point: rebuild on demand
+            self.series, self._stats, self._cursor = series, stats, cursor
+            return series
+
+    def window(self, days: int, now: Optional[int] = None) -> List[Dict[str, float]]:
+        series = self.refresh()
+        return series.points(self._cutoff(days, now))
+
+    def window_stats(self, days: int, now: Optional[int] = None) -> PerfStats:
+        series = self.refresh()
+        start = series.window_start(self._cutoff(days, now))
+        if start > 0:
+            return series.stats(start)
+        with self._lock:
+            if self._stats is None and self.series is series:
+                self._stats = series.stats()
+            return (self._stats or series.stats()).copy()
+
+    @staticmethod
+    def _cutoff(days: int, now: Optional[int]) -> int:
+        return int(now if now is not None else time.time()) - days * 86400
@@ -0,0 +1,389 @@
+# apps/infra/ledger_sync.py
+"""
+Incremental sync of the SQLite ledger with a blob store (apps.infra.blobstore; GCS in prod).
+
+Layout for a ledger at <name> (e.g. db/ledger.db):
+  <name>.ckpt/<epoch>            full checkpoint of an epoch, a plain SQLite file
+  <name>.deltas/<epoch>/<seq>    zlib'd changed pages on top of that checkpoint, create-only
+  <name>.manifest.json           {"epoch", "base", "base_generation", "seq", "page_size",
+                                  "pages", "delta_bytes", "digest"}
+  <name>                         copy of the current checkpoint (what gsutil cp sees)
+
+push() folds the WAL into the main file, hashes its pages and uploads only the pages that
+differ from the last synced state; the manifest is then swapped in under an
+if_generation_match precondition, so two writers can never both claim the same seq. After
+`max_deltas` pushes, or once the deltas add up to `checkpoint_ratio` of the file, a full
+checkpoint starts a new epoch and the old deltas are deleted. A checkpoint is uploaded under
+its own epoch name and only copied over <name> once the manifest swap has succeeded, so a
+manifest never points at an object another writer can overwrite.
+
+pull() stats the manifest first, so an unchanged ledger costs one metadata request. When the
+local file is exactly the last synced state it fetches only the missing deltas, patches a
+copy and swaps it in through the ConnectionManager; anything else (first run, new epoch,
+local edits that were never pushed, digest mismatch) downloads the checkpoint. Transfer
+therefore follows the amount of change, not the DB size.
+
+Readers that fetch <name> directly (gsutil, older jobs) see the last checkpoint, at most
+`max_deltas` pushes behind.
+"""
+import hashlib, json, os, shutil, struct, threading, uuid, zlib
+from dataclasses import dataclass, replace
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from libs.db import _connect, get_manager
+
+from .blobstore import BlobNotFound, PreconditionFailed
+
+MANIFEST_SUFFIX = ".manifest.json"
+DELTA_SUFFIX = ".deltas/"
+CKPT_SUFFIX = ".ckpt/"
+HASH_SIZE = 8
+_MAGIC = b"LDG1"
+_HDR = struct.Struct(">4sIII")   # magic, page size, pages in file, pages in this delta
+_PNO = struct.Struct(">I")
+_RETRIES = 5
+
+
+# ---------- pages ----------
+
+def page_size_of(path) -> int:
+    with open(path, "rb") as f:
+        hdr = f.read(100)
+    if len(hdr) < 100 or not hdr.startswith(b"SQLite format 3\x00"):
+        raise ValueError(f"not a SQLite database: {path}")
+    ps = struct.unpack(">H", hdr[16:18])[0]
+    return 65536 if ps == 1 else ps
+
+
+def page_hashes(path, page_size: int) -> bytes:
+    """HASH_SIZE bytes per page, concatenated."""
+    out = bytearray()
+    with open(path, "rb") as f:
+        while True:
+            page = f.read(page_size)
+            if not page:
+                break
+            out += hashlib.blake2b(page, digest_size=HASH_SIZE).digest()
+    return bytes(out)
+
+
+def _digest(hashes: bytes) -> str:
+    return hashlib.blake2b(hashes, digest_size=16).hexdigest()
+
+
+def encode_delta(page_size: int, n_pages: int, pages: Dict[int, bytes]) -> bytes:
+    body = bytearray(_HDR.pack(_MAGIC, page_size, n_pages, len(pages)))
+    for i in sorted(pages):
+        body += _PNO.pack(i) + pages[i]
+    return zlib.compress(bytes(body), 6)
+
+
+def decode_delta(data: bytes) -> Tuple[int, int, Dict[int, bytes]]:
+    raw = zlib.decompress(data)
+    magic, page_size, n_pages, count = _HDR.unpack_from(raw)
+    if magic != _MAGIC:
+        raise ValueError("not a ledger delta")
+    pages: Dict[int, bytes] = {}
+    off = _HDR.size
+    for _ in range(count):
+        (i,) = _PNO.unpack_from(raw, off)
+        off += _PNO.size
+        pages[i] = raw[off:off + page_size]
+        off += page_size
+    return page_size, n_pages, pages
+
+
+def _patch(path: Path, hashes: bytearray, deltas: List[bytes], page_size: int) -> None:
+    """Apply deltas in order to the file at `path`, keeping `hashes` in step."""
+    with open(path, "r+b") as f:
+        for data in deltas:
+            ps, n_pages, pages = decode_delta(data)
+            if ps != page_size:
+                raise ValueError("page size changed inside an epoch")
+            if len(hashes) < n_pages * HASH_SIZE:
+                hashes.extend(bytes(n_pages * HASH_SIZE - len(hashes)))
+            for i, page in pages.items():
+                f.seek(i * ps)
+                f.write(page)
+                hashes[i * HASH_SIZE:(i + 1) * HASH_SIZE] = hashlib.blake2b(page, digest_size=HASH_SIZE).digest()
+            f.truncate(n_pages * ps)
+            del hashes[n_pages * HASH_SIZE:]
+        f.flush()
+        os.fsync(f.fileno())
+
+
+# ---------- local state ----------
+
+@dataclass(frozen=True)
+class SyncState:
+    """What the local file was right after the last pull/push (kept beside the DB)."""
+    epoch: str = ""
+    seq: int = 0
+    manifest_generation: int = 0
+    base_generation: int = 0
+    page_size: int = 0
+    file: Tuple[int, int] = (0, 0)   # (size, mtime_ns) of the .db
+    hashes: bytes = b""
+
+
+class LedgerSync:
+    def __init__(self, store, name: str, local_path, manager=None,
+                 max_deltas: int = 64, checkpoint_ratio: float = 0.5):
+        self.store = store
+        self.name = name
+        self.local = Path(local_path)
+        self.manager = manager or get_manager(self.local)
+        self.max_deltas = max_deltas
+        self.checkpoint_ratio = checkpoint_ratio
+        self.manifest_name = name + MANIFEST_SUFFIX
+        self._state_path = self.local.with_name(self.local.name + ".sync.json")
+        self._pages_path = self.local.with_name(self.local.name + ".sync.pages")
+        self._lock = threading.Lock()
+
+    def _delta_name(self, epoch: str, seq: int) -> str:
+        return f"{self.name}{DELTA_SUFFIX}{epoch}/{seq:08d}"
+
+    # -- state file
+
+    def _load_state(self) -> SyncState:
+        try:
+            meta = json.loads(self._state_path.read_text(encoding="utf-8"))
+            hashes = self._pages_path.read_bytes()
+        except (FileNotFoundError, ValueError):
+            return SyncState()
+        if _digest(hashes) != meta.get("digest"):
+            return SyncState()
+        return SyncState(meta["epoch"], int(meta["seq"]), int(meta["manifest_generation"]),
+                         int(meta["base_generation"]), int(meta["page_size"]),
+                         tuple(meta["file"]), hashes)
+
+    def _save_state(self, st: SyncState) -> None:
+        f = os.stat(self.local)
+        st = replace(st, file=(f.st_size, f.st_mtime_ns))
+        self._pages_path.write_bytes(st.hashes)
+        meta = {"epoch": st.epoch, "seq": st.seq, "manifest_generation": st.manifest_generation,
+                "base_generation": st.base_generation, "page_size": st.page_size,
+                "file": list(st.file), "digest": _digest(st.hashes)}
+        tmp = self._state_path.with_name(self._state_path.name + ".tmp")
+        tmp.write_text(json.dumps(meta), encoding="utf-8")
+        os.replace(tmp, self._state_path)
+
+    def _local_clean(self, st: SyncState) -> bool:
+        """Local file is byte-for-byte the synced state (no WAL frames, no folded-in edits)."""
+        try:
+            f = os.stat(self.local)
+        except FileNotFoundError:
+            return False
+        if not st.hashes or (f.st_size, f.st_mtime_ns) != tuple(st.file):
+            return False
+        try:
+            return os.stat(self.local.as_posix() + "-wal").st_size == 0
+        except FileNotFoundError:
+            return True
+
+    def _manifest(self) -> Tuple[int, Optional[Dict[str, Any]]]:
+        for _ in range(_RETRIES):
+            st = self.store.stat(self.manifest_name)
+            if st is None:
+                return 0, None
+            try:
+                return st.generation, json.loads(self.store.read(self.manifest_name, generation=st.generation))
+            except BlobNotFound:
+                continue  # rewritten between stat and read
+        raise RuntimeError(f"{self.manifest_name} keeps changing")
+
+    # -- pull
+
+    def pull(self, full: bool = False) -> Dict[str, Any]:
+        """Bring the local DB up to the remote state; returns what it did and bytes fetched."""
+        with self._lock:
+            for _ in range(_RETRIES):
+                state = self._load_state()
+                st = self.store.stat(self.manifest_name)
+                try:
+                    if st is None:
+                        return self._pull_plain(state, full)
+                    if not full and st.generation == state.manifest_generation and self._local_clean(state):
+                        return {"action": "noop", "epoch": state.epoch, "seq": state.seq, "bytes": 0}
+                    man = json.loads(self.store.read(self.manifest_name, generation=st.generation))
+                    if (not full and man["epoch"] == state.epoch and state.seq <= man["seq"]
+                            and man["page_size"] == state.page_size and self._local_clean(state)):
+                        res = self._pull_deltas(man, st.generation, state)
+                        if res is not None:
+                            return res
+                    return self._pull_checkpoint(man, st.generation)
+                except BlobNotFound:
+                    continue  # a checkpoint replaced what we were reading; start over
+            raise RuntimeError(f"ledger {self.name} kept changing during pull")
+
+    def _fetch_deltas(self, epoch: str, first: int, last: int) -> List[bytes]:
+        return [self.store.read(self._delta_name(epoch, s)) for s in range(first, last + 1)]
+
+    def _pull_deltas(self, man: Dict[str, Any], gen: int, state: SyncState) -> Optional[Dict[str, Any]]:
+        deltas = self._fetch_deltas(man["epoch"], state.seq + 1, man["seq"])
+        tmp = Path(self.local.as_posix() + ".download")
+        shutil.copyfile(self.local, tmp)
+        hashes = bytearray(state.hashes)
+        _patch(tmp, hashes, deltas, man["page_size"])
+        if _digest(bytes(hashes)) != man["digest"]:
+            os.remove(tmp)
+            return None  # caller falls back to the checkpoint
+        self.manager.replace_file(tmp)
+        self._save_state(replace(state, seq=man["seq"], manifest_generation=gen, hashes=bytes(hashes)))
+        return {"action": "delta", "epoch": man["epoch"], "seq": man["seq"],
+                "bytes": sum(len(d) for d in deltas)}
+
+    def _pull_checkpoint(self, man: Dict[str, Any], gen: int) -> Dict[str, Any]:
+        tmp = Path(self.local.as_posix() + ".download")
+        tmp.parent.mkdir(parents=True, exist_ok=True)
+        # manifests written before epoch checkpoints name no base: it was <name> itself
+        self.store.read_to_file(man.get("base") or self.name, tmp, generation=int(man["base_generation"]))
+        fetched = tmp.stat().st_size
+        ps = man["page_size"]
+        hashes = bytearray(page_hashes(tmp, ps))
+        deltas = self._fetch_deltas(man["epoch"], 1, man["seq"])
+        if deltas:
+            _patch(tmp, hashes, deltas, ps)
+        if _digest(bytes(hashes)) != man["digest"]:
+            os.remove(tmp)
+            raise RuntimeError(f"ledger {self.name}: digest mismatch after epoch {man['epoch']} seq {man['seq']}")
+        self.manager.replace_file(tmp)
+        self._save_state(SyncState(man["epoch"], man["seq"], gen, int(man["base_generation"]), ps,
+                                   hashes=bytes(hashes)))
+        return {"action": "checkpoint", "epoch": man["epoch"], "seq": man["seq"],
+                "bytes": fetched + sum(len(d) for d in deltas)}
+
+    def _pull_plain(self, state: SyncState, full: bool) -> Dict[str, Any]:
+        # no manifest yet: a ledger uploaded as a single file
+        st = self.store.stat(self.name)
+        if st is None:
+            return {"action": "missing", "bytes": 0}
+        if not full and st.generation == state.base_generation and self._local_clean(state):
+            return {"action": "noop", "epoch": "", "seq": 0, "bytes": 0}
+        tmp = Path(self.local.as_posix() + ".download")
+        tmp.parent.mkdir(parents=True, exist_ok=True)
+        self.store.read_to_file(self.name, tmp, generation=st.generation)
+        # open once so a rollback-journal file is switched to WAL before it is hashed
+        _connect(tmp).close()
+        ps = page_size_of(tmp)
+        hashes = page_hashes(tmp, ps)
+        self.manager.replace_file(tmp)
+        self._save_state(SyncState("", 0, 0, st.generation, ps, hashes=hashes))
+        return {"action": "checkpoint", "epoch": "", "seq": 0, "bytes": st.size}
+
+    # -- push
+
+    def push(self) -> Dict[str, Any]:
+        """Upload local changes since the last sync (a delta, or a new checkpoint)."""
+        with self._lock, self.manager.writer() as conn:
+            # the writer lock keeps this process from writing while pages are scanned
+            busy = conn.execute("PRAGMA wal_checkpoint(TRUNCATE);").fetchone()[0]
+            if busy:
+                raise RuntimeError("WAL checkpoint blocked by a reader; retry the push")
+            ps = page_size_of(self.local)
+            hashes = page_hashes(self.local, ps)
+            size = len(hashes) // HASH_SIZE * ps
+            state = self._load_state()
+            gen, man = self._manifest()
+
+            # someone else pushed since our last sync: the checkpoint below overwrites it
+            conflict = man is not None and (man["epoch"], man["seq"]) != (state.epoch, state.seq)
+            if not conflict and man is not None and state.hashes and man["page_size"] == ps == state.page_size:
+                old = state.hashes
+                changed = [i for i in range(len(hashes) // HASH_SIZE)
+                           if hashes[i * HASH_SIZE:(i + 1) * HASH_SIZE] != old[i * HASH_SIZE:(i + 1) * HASH_SIZE]]
+                if not changed and len(hashes) == len(old):
+                    self._save_state(replace(state, manifest_generation=gen))
+                    return {"action": "noop", "epoch": state.epoch, "seq": state.seq, "bytes": 0, "pages": 0}
+                pages: Dict[int, bytes] = {}
+                with open(self.local, "rb") as f:
+                    for i in changed:
+                        f.seek(i * ps)
+                        pages[i] = f.read(ps)
+                delta = encode_delta(ps, len(hashes) // HASH_SIZE, pages)
+                seq = man["seq"] + 1
+                delta_bytes = int(man.get("delta_bytes", 0)) + len(delta)
+                if seq <= self.max_deltas and delta_bytes <= self.checkpoint_ratio * size:
+                    res = self._push_delta(man, gen, state, seq, delta, delta_bytes, hashes, len(pages))
+                    if res is not None:
+                        return res
+                    gen, man = self._manifest()  # lost the race: last writer wins, as before
+                    conflict = True
+            return self._push_checkpoint(gen, ps, hashes, conflict)
+
+    def _push_delta(self, man: Dict[str, Any], gen: int, state: SyncState, seq: int, delta: bytes,
+                    delta_bytes: int, hashes: bytes, n_pages: int) -> Optional[Dict[str, Any]]:
+        name = self._delta_name(man["epoch"], seq)
+        try:
+            self.store.create(name, delta)
+        except PreconditionFailed:
+            return None
+        new = dict(man, seq=seq, pages=len(hashes) // HASH_SIZE, delta_bytes=delta_bytes, digest=_digest(hashes))
+        try:
+            new_gen = self.store.put(self.manifest_name, json.dumps(new).encode("utf-8"),
+                                     if_generation_match=gen, content_type="application/json")
+        except PreconditionFailed:
+            self.store.delete(name)
+            return None
+        self._save_state(replace(state, seq=seq, manifest_generation=new_gen, hashes=hashes))
+        return {"action": "delta", "epoch": man["epoch"], "seq": seq, "bytes": len(delta), "pages": n_pages}
+
+    def _push_checkpoint(self, gen: int, ps: int, hashes: bytes, conflict: bool = False) -> Dict[str, Any]:
+        epoch = uuid.uuid4().hex[:12]
+        base = f"{self.name}{CKPT_SUFFIX}{epoch}"
+        base_gen = self.store.put_file(base, self.local, metadata={"ledger_epoch": epoch})
+        new = {"epoch": epoch, "base": base, "base_generation": base_gen, "seq": 0, "page_size": ps,
+               "pages": len(hashes) // HASH_SIZE, "delta_bytes": 0, "digest": _digest(hashes)}
+        for _ in range(_RETRIES):
+            try:
+                new_gen = self.store.put(self.manifest_name, json.dumps(new).encode("utf-8"),
+                                         if_generation_match=gen, content_type="application/json")
+                break
+            except PreconditionFailed:
+                # another writer swapped the manifest in between: last writer wins, as before;
+                # our checkpoint is under its own name, so it is still valid to point at
+                gen, _ = self._manifest()
+                conflict = True
+        else:
+            self.store.delete(base)
+            raise RuntimeError(f"ledger {self.name}: manifest kept changing during push")
+        self._save_state(SyncState(epoch, 0, new_gen, base_gen, ps, hashes=hashes))
+        self._promote(base, epoch)
+        self.store.delete_many(
+            [b.name for b in self.store.list(self.name + DELTA_SUFFIX)
+             if not b.name.startswith(f"{self.name}{DELTA_SUFFIX}{epoch}/")]
+            + [b.name for b in self.store.list(self.name + CKPT_SUFFIX) if b.name != base])
+        out = {"action": "checkpoint", "epoch": epoch, "seq": 0, "bytes": os.path.getsize(self.local),
+               "pages": len(hashes) // HASH_SIZE}
+        if conflict:
+            out["conflict"] = True
+        return out
+
+    def _promote(self, base: str, epoch: str) -> None:
+        """Copy the checkpoint over <name> for plain readers (best effort; pull never reads it)."""
+        cur = self.store.stat(self.name)
+        try:
+            self.store.compose(self.name, [base], if_generation_match=cur.generation if cur else 0,
+                               metadata={"ledger_epoch": epoch})
+        except (PreconditionFailed, BlobNotFound):
+            pass  # a newer checkpoint replaced it already, or is being promoted
+
+
+_SYNCS: Dict[Tuple[str, str], LedgerSync] = {}
+_SYNCS_LOCK = threading.Lock()
+
+
+def ledger_sync_for(gcs_uri: str, local_path: str) -> Optional[LedgerSync]:
+    """Process-wide LedgerSync for gs://bucket/path <-> local_path; None for non-GCS URIs."""
+    if not gcs_uri or not local_path or not gcs_uri.startswith("gs://"):
+        return None
+    key = (gcs_uri, os.path.abspath(local_path))
+    with _SYNCS_LOCK:
+        sync = _SYNCS.get(key)
+        if sync is None:
+            from .blobstore import GCSBlobStore, gcs_client
+            bucket_name, blob_name = gcs_uri[5:].split("/", 1)
+            sync = _SYNCS[key] = LedgerSync(GCSBlobStore(gcs_client().bucket(bucket_name)),
+                                            blob_name, key[1])
+    return sync
@@ -1,7 +1,17 @@
 # apps/infra/metrics.py
-import json, math, statistics, datetime as dt
+import datetime as dt
 from typing import Dict, List
-from .state_gcs import read_text, read_json, write_json, append_jsonl
+from .blobstore import PreconditionFailed
+from .ndjson_log import encode_lines, parse_lines
+from .state_gcs import generation, ndjson_log, read_json, read_ndjson, write_json
+from .perfstats import PerfStats
+
+# Running PerfStats for the strategy and HODL series, extended by record_daily(). The state
+# also records how many bytes of nav_daily.jsonl it covers ("log_size"); when that disagrees
+# with the log (a lost update, an append from elsewhere) the stats are replayed from the log.
+STATE_PATH = "metrics/perf_state.json"
+NAV_LOG = "metrics/nav_daily.jsonl"
+_CAS_RETRIES = 5
 
 def _utc_date_str(): return dt.datetime.utcnow().strftime("%Y-%m-%d")
 
@@ -16,15 +26,7 @@ def _nav(bal, prices):
     return usd+crypto, crypto, qty
 
 def _read_jsonl(path):
-    t = read_text(path)
-    if not t: return []
-    out=[]
-    for line in t.splitlines():
-        line=line.strip()
-        if not line: continue
-        try: out.append(json.loads(line))
-        except: pass
-    return out
+    return read_ndjson(path)
 
 def record_daily(prices, balances, code_commit, config_hash):
     day = _utc_date_str()
@@ -33,16 +35,54 @@ def record_daily(prices, balances, code_commit, config_hash):
     base = read_json("metrics/base.json")
     if base is None:
         base = {"date": day, "usd": float(balances.get("USD",0.0)), "qty": qty}
-        write_json("metrics/base.json", base)
+        try:
+            write_json("metrics/base.json", base, if_generation_match=0)
+        except PreconditionFailed:
+            base = read_json("metrics/base.json")  # another writer set it first; theirs stands
 
     rec = {
         "date": day, "nav": nav, "usd": float(balances.get("USD",0.0)),
         "crypto_val": crypto, "prices": {k: float(prices.get(k,0.0)) for k in sorted(prices.keys())},
         "qty": qty, "code_commit": code_commit, "config_hash": config_hash
     }
-    append_jsonl("metrics/nav_daily.jsonl", rec)
+    log = ndjson_log(NAV_LOG)
+    before = log.size()
+    log.append(rec)
+    _update_state(nav, _hodl_nav(prices, base), base, before, before + len(encode_lines([rec])))
     return rec
 
+def _replay(base):
+    """Running stats rebuilt from the whole NAV log, plus the log size they cover."""
+    data = ndjson_log(NAV_LOG).read_bytes() or b""
+    rows = sorted(parse_lines(data), key=lambda r: r.get("date",""))
+    strat = PerfStats.from_series(_series_nav(rows))
+    hodl = PerfStats.from_series(_hodl_nav(r.get("prices",{}), base) for r in rows)
+    return strat, hodl, len(data)
+
+def _update_state(nav, hodl_nav, base, log_before, log_after):
+    """
+    Extend the persisted stats by today's record (log bytes log_before..log_after) under a
+    generation precondition; if the state doesn't cover exactly the log before this append,
+    replay the log instead. A lost race re-reads and tries again.
+    """
+    for _ in range(_CAS_RETRIES):
+        gen = generation(STATE_PATH)
+        st = read_json(STATE_PATH) if gen else None
+        if st and st.get("log_size") == log_before and st.get("strategy") and st.get("hodl"):
+            strat = PerfStats.restore(st["strategy"]); hodl = PerfStats.restore(st["hodl"])
+            strat.push(nav); hodl.push(hodl_nav)
+            size = log_after
+        else:
+            strat, hodl, size = _replay(base)
+        state = {"records": strat.n, "log_size": size, "strategy": strat.snapshot(), "hodl": hodl.snapshot()}
+        try:
+            write_json(STATE_PATH, state, if_generation_match=gen)
+            return state
+        except PreconditionFailed:
+            continue
+    # every attempt lost to another writer, whose state compute_summary checks against the log
+    return None
+
 def _series_nav(rows): return [float(r["nav"]) for r in rows]
 
 def _hodl_nav(prices, base):
@@ -51,32 +91,24 @@ def _hodl_nav(prices, base):
     crypto = sum(qty.get(s,0.0)*float(prices.get(s,0.0)) for s in qty.keys())
     return usd + crypto
 
-def _rets(nav):
-    if len(nav)<2: return []
-    out=[]; prev=nav[0]
-    for x in nav[1:]:
-        if prev>0: out.append(x/prev - 1.0)
-        prev=x
-    return out
+def _stats_dict(st: PerfStats):
+    if st.n_ret == 0: return {"n_days":0}
+    return {"n_days":st.n_ret,"nav_start":st.first_nav,"nav_end":st.last_nav,"cagr":st.cagr(),
+            "vol_ann":st.vol_ann(),"sharpe_ann":st.sharpe(),"sortino_ann":st.sortino(),
+            "max_drawdown":st.max_dd}
 
 def _stats(nav):
-    rets = _rets(nav); n=len(rets)
-    if n==0: return {"n_days":0}
-    mu = sum(rets)/n
-    sig = statistics.stdev(rets) if n>1 else 0.0
-    ann = math.sqrt(365.0)
-    sharpe = (mu/sig)*ann if sig>0 else None
-    vol = sig*ann
-    cagr = (nav[-1]/nav[0])**(365.0/max(n,1)) - 1.0 if nav[0]>0 else None
-    peak=nav[0]; max_dd=0.0
-    for x in nav:
-        peak=max(peak,x)
-        dd=(x/peak - 1.0) if peak>0 else 0.0
-        max_dd=min(max_dd, dd)
-    return {"n_days":n,"nav_start":nav[0],"nav_end":nav[-1],"cagr":cagr,"vol_ann":vol,"sharpe_ann":sharpe,"max_drawdown":max_dd}
+    return _stats_dict(PerfStats.from_series(nav))
 
 def compute_summary(window_days=365):
-    rows = _read_jsonl("metrics/nav_daily.jsonl")
+    st = read_json(STATE_PATH)
+    if (st and st.get("records") and (not window_days or st["records"] <= window_days)
+            and st.get("log_size") == ndjson_log(NAV_LOG).size()):
+        # window covers all history and the stats cover the whole log: serve them as they are
+        return {"window_days":window_days,"records":st["records"],
+                "strategy":_stats_dict(PerfStats.restore(st["strategy"])),
+                "hodl":_stats_dict(PerfStats.restore(st["hodl"]))}
+    rows = _read_jsonl(NAV_LOG)
     if not rows: return {"note":"no daily records yet"}
     rows.sort(key=lambda r: r.get("date",""))
     rows = rows[-window_days:] if window_days and len(rows)>window_days else rows
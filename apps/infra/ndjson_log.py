@@ -0,0 +1,200 @@
+# apps/infra/ndjson_log.py
+"""
+Append-only NDJSON log on top of a blob store (apps.infra.blobstore).
+
+Layout for a log at <path> (e.g. snapshots/daily.jsonl):
+  <path>                      compacted base object (what BigQuery / gsutil cat see)
+  <path>.segments/<ns>-<id>   one immutable object per append, created with if_generation_match=0
+
+append() is a single create-only upload, so its cost does not depend on history size and
+concurrent appenders can never overwrite each other. Once enough segments pile up, compact()
+composes base + segments into a new base under an if_generation_match precondition on the
+base; losing that race just means another writer already compacted. The new base records
+which segments it absorbed (name + byte length) in its metadata so readers can skip segments
+that are already in the base while the compactor is still deleting them. Those same sizes
+let tail() turn a compaction into a byte-range read of just the new part of the base.
+"""
+import json, time, uuid
+from dataclasses import dataclass, field
+from typing import Any, Dict, FrozenSet, List, Optional, Tuple
+
+from .blobstore import COMPOSE_MAX_SOURCES, BlobNotFound, BlobStat, PreconditionFailed
+
+CONTENT_TYPE = "application/x-ndjson"
+SEGMENT_SUFFIX = ".segments/"
+_META_KEY = "compacted"
+_READ_RETRIES = 5
+
+
+def _compacted(st: Optional[BlobStat]) -> List[Tuple[str, int]]:
+    if st is None:
+        return []
+    try:
+        return [(str(n), int(sz)) for n, sz in json.loads(st.metadata.get(_META_KEY) or "[]")]
+    except Exception:
+        return []
+
+
+def encode_lines(objs: List[Dict[str, Any]]) -> bytes:
+    """NDJSON bytes for `objs`, exactly as append_many() writes them."""
+    return "".join(json.dumps(o, separators=(",", ":")) + "\n" for o in objs).encode("utf-8")
+
+
+def parse_lines(data: bytes) -> List[Dict[str, Any]]:
+    """Parse NDJSON bytes, skipping blank or malformed lines (same tolerance as read_ndjson)."""
+    out: List[Dict[str, Any]] = []
+    for ln in data.decode("utf-8", errors="replace").splitlines():
+        ln = ln.strip()
+        if not ln:
+            continue
+        try:
+            obj = json.loads(ln)
+        except Exception:
+            continue
+        if isinstance(obj, dict):
+            out.append(obj)
+    return out
+
+
+@dataclass(frozen=True)
+class LogCursor:
+    """Position of an incremental reader: base generation/size plus live segments already consumed."""
+    generation: int = 0
+    size: int = 0
+    segments: FrozenSet[str] = field(default_factory=frozenset)
+
+
+class SegmentedLog:
+    def __init__(self, store, path: str, compact_threshold: int = 8):
+        self.store = store
+        self.path = path
+        self.prefix = path + SEGMENT_SUFFIX
+        self.compact_threshold = max(1, int(compact_threshold))
+
+    # ---------- write path ----------
+
+    def append(self, obj: Dict[str, Any]) -> str:
+        return self.append_many([obj])
+
+    def append_many(self, objs: List[Dict[str, Any]]) -> str:
+        """Write all records as one segment (one round trip), then compact if due."""
+        payload = encode_lines(objs)
+        name = f"{self.prefix}{time.time_ns():020d}-{uuid.uuid4().hex[:12]}"
+        self.store.create(name, payload, content_type=CONTENT_TYPE)
+        try:
+            self.compact(min_segments=self.compact_threshold)
+        except Exception:
+            # compaction is an optimisation; the record is already durable in its segment
+            pass
+        return name
+
+    def compact(self, min_segments: int = 1) -> bool:
+        """
+        Fold the oldest segments into the base object. Returns True if this call committed
+        a new base, False if there was nothing to do or another writer won the race.
+        """
+        base = self.store.stat(self.path)
+        absorbed = {n for n, _ in _compacted(base)}
+        segs = self.store.list(self.prefix)
+
+        # Segments absorbed by the previous compaction whose delete never happened.
+        stale = [s.name for s in segs if s.name in absorbed]
+        if stale:
+            self.store.delete_many(stale)
+        segs = [s for s in segs if s.name not in absorbed]
+        if not segs or len(segs) < min_segments:
+            return False
+
+        batch = segs[: COMPOSE_MAX_SOURCES - (1 if base else 0)]
+        sources = ([self.path] if base else []) + [s.name for s in batch]
+        meta = {_META_KEY: json.dumps([[s.name, s.size] for s in batch], separators=(",", ":"))}
+        try:
+            self.store.compose(
+                self.path, sources,
+                if_generation_match=base.generation if base else 0,
+                metadata=meta, content_type=CONTENT_TYPE,
+            )
+        except (PreconditionFailed, BlobNotFound):
+            return False
+        self.store.delete_many([s.name for s in batch])
+        return True
+
+    # ---------- read path ----------
+
+    def read_bytes(self) -> Optional[bytes]:
+        """Whole log as NDJSON bytes (base followed by live segments), or None if it doesn't exist."""
+        for _ in range(_READ_RETRIES):
+            # List before stat'ing the base: a segment compacted in between is then either
+            # named in the base metadata (skipped) or already deleted (retry).
+            segs = self.store.list(self.prefix)
+            base = self.store.stat(self.path)
+            absorbed = {n for n, _ in _compacted(base)}
+            try:
+                parts = [self.store.read(self.path, generation=base.generation)] if base else []
+                parts += [self.store.read(s.name) for s in segs if s.name not in absorbed]
+            except BlobNotFound:
+                continue
+            if base is None and not segs:
+                return None
+            return b"".join(parts)
+        raise RuntimeError(f"log {self.path} kept changing while reading")
+
+    def size(self) -> int:
+        """Length in bytes of the whole log, from metadata only (0 if it doesn't exist).
+        Compaction moves bytes from segments into the base, so it never changes this."""
+        segs = self.store.list(self.prefix)
+        base = self.store.stat(self.path)
+        absorbed = {n for n, _ in _compacted(base)}
+        return (base.size if base else 0) + sum(s.size for s in segs if s.name not in absorbed)
+
+    def read(self) -> List[Dict[str, Any]]:
+        data = self.read_bytes()
+        return parse_lines(data) if data else []
+
+    def tail(self, cursor: Optional[LogCursor] = None) -> Tuple[List[Dict[str, Any]], LogCursor, bool]:
+        """
+        Records appended since `cursor`. Returns (records, new_cursor, reset); when reset is True
+        the records are the full log and the caller should drop what it had.
+        """
+        cursor = cursor or LogCursor()
+        for _ in range(_READ_RETRIES):
+            segs = self.store.list(self.prefix)
+            base = self.store.stat(self.path)
+            absorbed = _compacted(base)
+            absorbed_names = {n for n, _ in absorbed}
+            try:
+                out, reset = self._tail_base(cursor, base, absorbed)
+                live = [s for s in segs if s.name not in absorbed_names]
+                known = cursor.segments if not reset else frozenset()
+                for s in live:
+                    if s.name not in known:
+                        out.extend(parse_lines(self.store.read(s.name)))
+            except BlobNotFound:
+                continue
+            new = LogCursor(
+                generation=base.generation if base else 0,
+                size=base.size if base else 0,
+                segments=frozenset(s.name for s in live),
+            )
+            return out, new, reset
+        raise RuntimeError(f"log {self.path} kept changing while reading")
+
+    def _tail_base(self, cursor: LogCursor, base: Optional[BlobStat], absorbed: List[Tuple[str, int]]):
+        if base is None:
+            return [], bool(cursor.generation)
+        if base.generation == cursor.generation:
+            return [], False
+        grown = base.size - cursor.size
+        if cursor.generation and grown >= 0 and grown == sum(sz for _, sz in absorbed):
+            # New base = old base + absorbed segments, in order; only read the new bytes and
+            # skip the segments this reader already consumed while they were live.
+            data = self.store.read(self.path, start=cursor.size, generation=base.generation)
+            out: List[Dict[str, Any]] = []
+            off = 0
+            for name, sz in absorbed:
+                if name not in cursor.segments:
+                    out.extend(parse_lines(data[off: off + sz]))
+                off += sz
+            return out, False
+        # Unknown history (first read, several compactions, or a rewrite): start over.
+        return parse_lines(self.store.read(self.path, generation=base.generation)), True
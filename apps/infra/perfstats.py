@@ -0,0 +1,165 @@
+# apps/infra/perfstats.py
+"""
+Streaming performance statistics over a NAV series.
+
+PerfStats.push(nav) is O(1): Welford mean/variance of period returns, downside sum of
+squares (Sortino), running peak with drawdown depth and duration. snapshot()/restore()
+round-trip the state through plain JSON so a series can be extended later without
+re-reading it.
+
+Conventions shared by every caller (service /metrics, apps.infra.metrics, research tools):
+  - a return is only taken when the previous NAV is > 0
+  - volatility uses the sample stdev (ddof=1), annualised with sqrt(periods_per_year)
+  - CAGR uses elapsed calendar days when timestamps are pushed, else the number of periods
+  - drawdown is measured against the running peak; duration counts periods below the peak
+"""
+import math
+from typing import Any, Dict, Iterable, Optional
+
+SECONDS_PER_DAY = 86400
+
+
+class PerfStats:
+    __slots__ = (
+        "periods_per_year", "n", "first_nav", "first_ts", "last_nav", "last_ts",
+        "n_ret", "mean", "m2", "down_sq", "peak", "max_dd", "dd_len", "max_dd_len",
+    )
+
+    def __init__(self, periods_per_year: float = 365.0):
+        self.periods_per_year = float(periods_per_year)
+        self.n = 0
+        self.first_nav: Optional[float] = None
+        self.first_ts: Optional[int] = None
+        self.last_nav: Optional[float] = None
+        self.last_ts: Optional[int] = None
+        self.n_ret = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.down_sq = 0.0
+        self.peak: Optional[float] = None
+        self.max_dd = 0.0
+        self.dd_len = 0
+        self.max_dd_len = 0
+
+    @classmethod
+    def from_series(cls, navs: Iterable[float], periods_per_year: float = 365.0) -> "PerfStats":
+        st = cls(periods_per_year)
+        for v in navs:
+            st.push(v)
+        return st
+
+    # ---------- update ----------
+
+    def push(self, nav: float, ts: Optional[int] = None) -> None:
+        nav = float(nav)
+        prev = self.last_nav
+        if self.n == 0:
+            self.first_nav, self.first_ts = nav, ts
+        self.n += 1
+        self.last_nav, self.last_ts = nav, ts
+
+        if prev is not None and prev > 0:
+            r = nav / prev - 1.0
+            self.n_ret += 1
+            d = r - self.mean
+            self.mean += d / self.n_ret
+            self.m2 += d * (r - self.mean)
+            if r < 0:
+                self.down_sq += r * r
+
+        if self.peak is None or nav > self.peak:
+            self.peak = nav
+        if self.peak > 0:
+            dd = nav / self.peak - 1.0
+            if dd < self.max_dd:
+                self.max_dd = dd
+            if dd < 0:
+                self.dd_len += 1
+                self.max_dd_len = max(self.max_dd_len, self.dd_len)
+            else:
+                self.dd_len = 0
+
+    # ---------- derived ----------
+
+    @property
+    def drawdown(self) -> float:
+        if self.peak is None or self.peak <= 0 or self.last_nav is None:
+            return 0.0
+        return self.last_nav / self.peak - 1.0
+
+    @property
+    def days(self) -> Optional[int]:
+        """Elapsed days between first and last point (timestamps), else number of periods."""
+        if self.n < 2:
+            return None
+        if self.first_ts is not None and self.last_ts is not None:
+            return max(1, round((self.last_ts - self.first_ts) / SECONDS_PER_DAY))
+        return max(1, self.n - 1)
+
+    def stdev(self) -> float:
+        return math.sqrt(self.m2 / (self.n_ret - 1)) if self.n_ret > 1 else 0.0
+
+    def vol_ann(self) -> float:
+        return self.stdev() * math.sqrt(self.periods_per_year)
+
+    def total_return(self) -> Optional[float]:
+        if self.n < 1 or not self.first_nav or self.first_nav <= 0:
+            return None
+        return self.last_nav / self.first_nav - 1.0
+
+    def cagr(self) -> Optional[float]:
+        days = self.days
+        if days is None or not self.first_nav or self.first_nav <= 0:
+            return None
+        return (self.last_nav / self.first_nav) ** (365.0 / days) - 1.0
+
+    def sharpe(self, rf_annual: float = 0.0) -> Optional[float]:
+        sd = self.stdev()
+        if self.n_ret < 2 or sd <= 0:
+            return None
+        return (self.mean - rf_annual / self.periods_per_year) / sd * math.sqrt(self.periods_per_year)
+
+    def sortino(self, rf_annual: float = 0.0) -> Optional[float]:
+        if self.n_ret < 2 or self.down_sq <= 0:
+            return None
+        dd = math.sqrt(self.down_sq / self.n_ret)
+        return (self.mean - rf_annual / self.periods_per_year) / dd * math.sqrt(self.periods_per_year)
+
+    def calmar(self) -> Optional[float]:
+        c = self.cagr()
+        if c is None or self.max_dd >= 0:
+            return None
+        return c / abs(self.max_dd)
+
+    def summary(self, rf_annual: float = 0.0) -> Dict[str, Any]:
+        return {
+            "points": self.n,
+            "n_returns": self.n_ret,
+            "first_nav": self.first_nav,
+            "last_nav": self.last_nav,
+            "total_return": self.total_return(),
+            "cagr": self.cagr(),
+            "vol_ann": self.vol_ann(),
+            "sharpe": self.sharpe(rf_annual),
+            "sortino": self.sortino(rf_annual),
+            "calmar": self.calmar(),
+            "max_drawdown": self.max_dd,
+            "drawdown": self.drawdown,
+            "max_drawdown_periods": self.max_dd_len,
+        }
+
+    # ---------- persistence ----------
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {k: getattr(self, k) for k in self.__slots__}
+
+    @classmethod
+    def restore(cls, state: Dict[str, Any]) -> "PerfStats":
+        st = cls(float(state.get("periods_per_year", 365.0)))
+        for k in cls.__slots__:
+            if k in state:
+                setattr(st, k, state[k])
+        return st
+
+    def copy(self) -> "PerfStats":
+        return PerfStats.restore(self.snapshot())
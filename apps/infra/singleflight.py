@@ -0,0 +1,79 @@
+# apps/infra/singleflight.py
+"""
+Request coalescing for expensive, idempotent computations (the planner).
+
+SingleFlight.do(key, fn) runs fn() once per key no matter how many callers ask at the same
+time: the first caller starts it, later callers await the same task. The result is then
+remembered for that key (small LRU), so repeats cost nothing until the key changes. Keys are
+meant to carry the version of every input (DB token, object generation, config hash), which
+makes invalidation implicit: a new input is a new key.
+
+Failures are handed to every caller that was waiting on that run and are never remembered.
+A caller that is cancelled does not cancel the shared run. Safe across threads and loops.
+"""
+import asyncio, threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+
+
+class SingleFlight:
+    # In-flight runs are concurrent.futures.Future objects, so callers on any event loop (or
+    # thread) can join a run; the run itself executes on the loop of the caller that started it.
+
+    def __init__(self, size: int = 32):
+        self.size = size
+        self._lock = threading.Lock()
+        self._memo: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self._inflight: Dict[Hashable, Future] = {}
+        self.runs = 0
+        self.hits = 0
+        self.shared = 0
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        with self._lock:
+            if key in self._memo:
+                self._memo.move_to_end(key)
+                self.hits += 1
+                return self._memo[key]
+            fut = self._inflight.get(key)
+            owner = fut is None
+            if owner:
+                fut = self._inflight[key] = Future()
+                fut.set_running_or_notify_cancel()  # waiters can no longer cancel it
+                self.runs += 1
+            else:
+                self.shared += 1
+        if owner:
+            asyncio.ensure_future(self._run(key, fn, fut))
+        return await asyncio.shield(asyncio.wrap_future(fut))
+
+    async def _run(self, key: Hashable, fn: Callable[[], Awaitable[Any]], fut: Future) -> None:
+        try:
+            value = await fn()
+        except BaseException as e:
+            with self._lock:
+                self._inflight.pop(key, None)
+            fut.set_exception(e)
+            if not isinstance(e, Exception):
+                raise
+            return
+        with self._lock:
+            self._memo[key] = value
+            self._memo.move_to_end(key)
+            while len(self._memo) > self.size:
+                self._memo.popitem(last=False)
+            self._inflight.pop(key, None)
+        fut.set_result(value)
+
+    def forget(self, key: Optional[Hashable] = None) -> None:
+        with self._lock:
+            if key is None:
+                self._memo.clear()
+            else:
+                self._memo.pop(key, None)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"runs": self.runs, "hits": self.hits, "shared": self.shared,
+                    "inflight": len(self._inflight), "memo": len(self._memo)}
@@ -1,79 +1,369 @@
-import os, json
-from typing import List, Dict, Any, Optional
-from google.cloud import storage
-from google.api_core.exceptions import NotFound
+import os, re, copy, json, time, asyncio, hashlib, functools, tempfile, threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import List, Dict, Any, Optional, Sequence, Tuple
+
+from .blobstore import BlobNotFound, GCSBlobStore, LocalBlobStore, gcs_client
+from .ndjson_log import SegmentedLog, parse_lines
 
 _BUCKET  = os.getenv("STATE_BUCKET")
 _PROJECT = os.getenv("GOOGLE_CLOUD_PROJECT") or os.getenv("GCLOUD_PROJECT")
 
 def _client():
-    return storage.Client(project=_PROJECT) if _PROJECT else storage.Client()
+    return gcs_client(_PROJECT)
 
 def _bucket():
     if not _BUCKET:
         raise RuntimeError("STATE_BUCKET env var not set")
     return _client().bucket(_BUCKET)
 
-def read_text(path: str) -> Optional[str]:
-    b = _bucket()
-    blob = b.blob(path)
-    try:
-        return blob.download_as_text()
-    except NotFound:
-        return None
+# ---- backend ---------------------------------------------------------------------------
+# Every helper below goes through one process-wide StateBackend: a blob store (GCS bucket on
+# the shared client, or a LocalBlobStore when STATE_DIR is set) plus per-operation latency
+# counters, and a StateCache for JSON under state/ and metrics/ (STATE_CACHE=0 disables it,
+# STATE_CACHE_DIR moves the disk tier off /tmp; each bucket / STATE_DIR gets its own
+# subdirectory). Tests swap it with set_backend(StateBackend(MemoryBlobStore())).
 
-def read_json(path: str, default=None):
-    t = read_text(path)
-    if t is None:
+class StateCache:
+    """
+    Parsed JSON objects by (path, generation), in memory and under `root` on local disk, so a
+    restarted worker starts warm. An entry is only served for the generation it was read or
+    written at; the caller supplies the current generation (one metadata request).
+    """
+
+    def __init__(self, root=None, prefixes: Sequence[str] = ("state/", "metrics/")):
+        self.root = Path(root) if root else None
+        self.prefixes = tuple(prefixes)
+        self._lock = threading.Lock()
+        self._mem: Dict[str, Tuple[int, Any]] = {}
+        self.hits = self.disk_hits = self.misses = 0
+
+    def covers(self, path: str) -> bool:
+        return path.startswith(self.prefixes)
+
+    def get(self, path: str, gen: int) -> Tuple[bool, Any]:
+        with self._lock:
+            e = self._mem.get(path)
+            if e is not None and e[0] == gen:
+                self.hits += 1
+                return True, e[1]
+        if self.root is not None:
+            try:
+                d = json.loads((self.root / path).read_text(encoding="utf-8"))
+                if int(d["generation"]) == gen:
+                    with self._lock:
+                        self._mem[path] = (gen, d["obj"])
+                        self.disk_hits += 1
+                    return True, d["obj"]
+            except (OSError, ValueError, KeyError, TypeError):
+                pass
+        with self._lock:
+            self.misses += 1
+        return False, None
+
+    def put(self, path: str, gen: int, obj: Any) -> None:
+        with self._lock:
+            cur = self._mem.get(path)
+            if cur is not None and cur[0] > gen:
+                return  # a newer generation is already cached
+            self._mem[path] = (gen, obj)
+        if self.root is not None:
+            try:
+                f = self.root / path
+                f.parent.mkdir(parents=True, exist_ok=True)
+                tmp = f.with_name(f"{f.name}.tmp{os.getpid()}.{threading.get_ident()}")
+                tmp.write_text(json.dumps({"generation": gen, "obj": obj}, separators=(",",":")), encoding="utf-8")
+                os.replace(tmp, f)
+            except OSError:
+                pass  # disk tier is best effort
+
+    def drop(self, path: str) -> None:
+        with self._lock:
+            self._mem.pop(path, None)
+        if self.root is not None:
+            try:
+                os.remove(self.root / path)
+            except OSError:
+                pass
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"hits": self.hits, "disk_hits": self.disk_hits, "misses": self.misses, "entries": len(self._mem)}
+
+
+class StateBackend:
+    def __init__(self, store, name: str = "", cache: Optional[StateCache] = None):
+        self.store = store
+        self.name = name or type(store).__name__
+        self.cache = cache
+        self._lock = threading.Lock()
+        self._stats: Dict[str, List[float]] = {}  # op -> [calls, errors, total_s, max_s]
+
+    def _timed(self, op: str, fn, *args, **kw):
+        t0 = time.perf_counter()
+        ok = False
+        try:
+            out = fn(*args, **kw)
+            ok = True
+            return out
+        except BlobNotFound:
+            ok = True  # a miss is an answer, not an I/O error
+            raise
+        finally:
+            dt = time.perf_counter() - t0
+            with self._lock:
+                st = self._stats.setdefault(op, [0, 0, 0.0, 0.0])
+                st[0] += 1
+                st[1] += 0 if ok else 1
+                st[2] += dt
+                st[3] = max(st[3], dt)
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            return {op: {"calls": int(c), "errors": int(e), "total_ms": round(t * 1e3, 3),
+                         "avg_ms": round(t * 1e3 / c, 3) if c else 0.0, "max_ms": round(m * 1e3, 3)}
+                    for op, (c, e, t, m) in sorted(self._stats.items())}
+
+    def reset_stats(self) -> None:
+        with self._lock:
+            self._stats.clear()
+
+    # -- single objects
+
+    def read_text(self, path: str) -> Optional[str]:
+        try:
+            return self._timed("read", self.store.read, path).decode("utf-8")
+        except BlobNotFound:
+            return None
+
+    def write_text(self, path: str, text: str, content_type: str = "application/json",
+                   if_generation_match: Optional[int] = None) -> int:
+        return self._timed("write", self.store.put, path, text.encode("utf-8"),
+                           if_generation_match=if_generation_match, content_type=content_type)
+
+    def generation(self, path: str) -> int:
+        st = self._timed("stat", self.store.stat, path)
+        return st.generation if st else 0
+
+    # -- JSON objects (through the cache when it covers the path)
+
+    def read_json(self, path: str, default=None):
+        c = self.cache
+        if c is None or not c.covers(path):
+            return _parse(self.read_text(path), default)
+        for _ in range(3):
+            gen = self.generation(path)
+            if gen == 0:
+                c.drop(path)
+                return default
+            hit, obj = c.get(path, gen)
+            if not hit:
+                try:
+                    data = self._timed("read", self.store.read, path, generation=gen)
+                except BlobNotFound:
+                    continue  # replaced between the stat and the download
+                obj = _parse(data.decode("utf-8"), _INVALID)
+                if obj is _INVALID:
+                    return default
+                c.put(path, gen, obj)
+            return copy.deepcopy(obj)  # callers may mutate what they get
+        return _parse(self.read_text(path), default)
+
+    def write_json(self, path: str, obj: Any, if_generation_match: Optional[int] = None) -> int:
+        """Upload `obj`; with if_generation_match (0 = must not exist) raises PreconditionFailed
+        if someone wrote since that generation."""
+        gen = self.write_text(path, json.dumps(obj, separators=(",",":")), content_type="application/json",
+                              if_generation_match=if_generation_match)
+        if self.cache is not None and self.cache.covers(path):
+            # write-through: the next read only has to confirm the generation
+            self.cache.put(path, int(gen or 0), copy.deepcopy(obj))
+        return gen
+
+    def log(self, path: str) -> SegmentedLog:
+        return SegmentedLog(self.store, path)
+
+    # -- several objects (fanned out on the I/O pool, which shares the client's connections;
+    #    sync callers only: from a handler use the a* variants, which gather on the pool)
+
+    def read_many(self, paths: Sequence[str]) -> Dict[str, Optional[str]]:
+        return dict(zip(paths, _IO_POOL.map(self.read_text, paths)))
+
+    def read_json_many(self, paths: Sequence[str], default=None) -> Dict[str, Any]:
+        return dict(zip(paths, _IO_POOL.map(lambda p: self.read_json(p, default), paths)))
+
+    def write_json_many(self, objs: Dict[str, Any]) -> Dict[str, int]:
+        paths = list(objs)
+        return dict(zip(paths, _IO_POOL.map(lambda p: self.write_json(p, objs[p]), paths)))
+
+    def delete_many(self, paths: Sequence[str]) -> None:
+        if paths:
+            self._timed("delete_many", self.store.delete_many, list(paths))
+
+
+_INVALID = object()
+
+def _parse(text: Optional[str], default):
+    if text is None:
         return default
     try:
-        return json.loads(t)
+        return json.loads(text)
     except Exception:
         return default
 
+def _cache_namespace(name: str) -> str:
+    """Directory name for one backend's disk tier: readable prefix + hash of the full name."""
+    slug = re.sub(r"[^A-Za-z0-9._-]+", "_", name).strip("_")[-48:]
+    return f"{slug}-{hashlib.sha1(name.encode('utf-8')).hexdigest()[:12]}"
+
+def _default_cache(name: str) -> Optional[StateCache]:
+    # one subdirectory per backend (bucket or STATE_DIR): generations are only unique within
+    # a store, so two backends must never serve each other's entries
+    if os.getenv("STATE_CACHE", "1") == "0":
+        return None
+    root = os.getenv("STATE_CACHE_DIR") or os.path.join(tempfile.gettempdir(), "crypto-ops-state")
+    return StateCache(os.path.join(root, _cache_namespace(name)))
+
+
+_BACKEND: Optional[StateBackend] = None
+_BACKEND_LOCK = threading.Lock()
+
+def backend() -> StateBackend:
+    """The process-wide backend, built on first use from STATE_DIR / STATE_BUCKET."""
+    global _BACKEND
+    if _BACKEND is None:
+        with _BACKEND_LOCK:
+            if _BACKEND is None:
+                root = os.getenv("STATE_DIR")
+                if root:
+                    name = f"local:{os.path.abspath(root)}"
+                    _BACKEND = StateBackend(LocalBlobStore(root), name, _default_cache(name))
+                else:
+                    name = f"gs://{_BUCKET}"
+                    _BACKEND = StateBackend(GCSBlobStore(_bucket()), name, _default_cache(name))
+    return _BACKEND
+
+def set_backend(b: Optional[StateBackend]) -> Optional[StateBackend]:
+    """Swap the backend (None: rebuild from env on next use); returns the previous one."""
+    global _BACKEND
+    with _BACKEND_LOCK:
+        prev, _BACKEND = _BACKEND, b
+    return prev
+
+def io_stats() -> Dict[str, Any]:
+    b = _BACKEND
+    if b is None:
+        return {"backend": None, "ops": {}, "cache": None}
+    return {"backend": b.name, "ops": b.stats(), "cache": b.cache.stats() if b.cache else None}
+
+# ---- sync helpers ------------------------------------------------------------------------
+
+def read_text(path: str) -> Optional[str]:
+    return backend().read_text(path)
+
+def generation(path: str) -> int:
+    """Current generation of the object (0 if absent): one metadata request, no download."""
+    return backend().generation(path)
+
+def read_json(path: str, default=None):
+    """
+    Parsed object at `path`, or `default`. Objects under state/ and metrics/ are served from
+    the local cache while their generation is unchanged (a metadata request, no download).
+    """
+    return backend().read_json(path, default)
+
+def read_json_many(paths: Sequence[str], default=None) -> Dict[str, Any]:
+    """read_json for several objects at once (concurrent requests)."""
+    return backend().read_json_many(paths, default)
+
+def _log(path: str) -> SegmentedLog:
+    return backend().log(path)
+
+def ndjson_log(path: str) -> SegmentedLog:
+    """Handle on an append log, for incremental readers (SegmentedLog.tail)."""
+    return _log(path)
+
 def read_ndjson(path: str) -> List[Dict[str, Any]]:
-    """Return list of dicts from NDJSON (one JSON object per line)."""
-    txt = read_text(path)
-    if not txt:
-        return []
-    out: List[Dict[str, Any]] = []
-    for ln in txt.splitlines():
-        ln = ln.strip()
-        if not ln:
-            continue
-        try:
-            obj = json.loads(ln)
-            if isinstance(obj, dict):
-                out.append(obj)
-        except Exception:
-            pass
-    return out
+    """Return list of dicts from an append log (compacted base + pending segments)."""
+    data = _log(path).read_bytes()
+    return parse_lines(data) if data else []
 
 def write_text(path: str, text: str, content_type: str = "application/json"):
-    b = _bucket()
-    blob = b.blob(path)
-    blob.cache_control = "no-store"
-    # IMPORTANT: pass content_type here so HTTP header == metadata Content-Type
-    blob.upload_from_string(text, content_type=content_type)
+    # cache_control no-store and the Content-Type header are set by the store's put()
+    backend().write_text(path, text, content_type)
+
+def write_json(path: str, obj: Any, if_generation_match: Optional[int] = None) -> int:
+    return backend().write_json(path, obj, if_generation_match)
 
-def write_json(path: str, obj: Any):
-    write_text(path, json.dumps(obj, separators=(",",":")), content_type="application/json")
+def write_json_many(objs: Dict[str, Any]):
+    """write_json for several objects at once (concurrent uploads)."""
+    backend().write_json_many(objs)
 
 def append_jsonl(path: str, obj: Dict[str, Any]):
-    """Append a JSON line; set a clear content-type for NDJSON."""
-    line = json.dumps(obj, separators=(",",":")) + "\n"
-    cur = read_text(path)
-    payload = line if cur is None else (cur + line)
-    write_text(path, payload, content_type="application/x-ndjson")
+    """
+    Append a JSON line as its own immutable segment (see apps.infra.ndjson_log).
+    Cost is one create-only upload regardless of file size; concurrent appends never collide.
+    Segments are periodically composed back into `path`, so readers of the plain object lag
+    by at most a few records.
+    """
+    _log(path).append(obj)
+
+def append_jsonl_many(path: str, objs: List[Dict[str, Any]]):
+    """Append several records in a single segment."""
+    if objs:
+        _log(path).append_many(objs)
+
+def compact_jsonl(path: str) -> bool:
+    """Fold any pending segments of `path` into the base object now."""
+    return _log(path).compact()
+
+# ---- async variants (service handlers) -------------------------------------------------
+# The storage client is blocking, so these run the calls above on a pool of their own, sized
+# for I/O waits and kept apart from FastAPI's threadpool; a handler awaits instead of holding
+# a worker, and independent reads/writes can be awaited together (gather_io).
+
+_IO_POOL = ThreadPoolExecutor(max_workers=int(os.getenv("GCS_IO_THREADS", "32")), thread_name_prefix="gcs-io")
+
+async def run_io(fn, *args, **kw):
+    """Run a blocking state call on the I/O pool."""
+    return await asyncio.get_running_loop().run_in_executor(_IO_POOL, functools.partial(fn, *args, **kw))
+
+async def aread_json(path: str, default=None):
+    return await run_io(read_json, path, default)
+
+async def aread_json_many(paths: Sequence[str], default=None) -> Dict[str, Any]:
+    res = await gather_io(*(run_io(read_json, p, default) for p in paths))
+    return dict(zip(paths, res))
+
+async def ageneration(path: str) -> int:
+    return await run_io(generation, path)
+
+async def awrite_json(path: str, obj: Any):
+    return await run_io(write_json, path, obj)
+
+async def aappend_jsonl(path: str, obj: Dict[str, Any]):
+    return await run_io(append_jsonl, path, obj)
+
+async def aappend_jsonl_many(path: str, objs: List[Dict[str, Any]]):
+    return await run_io(append_jsonl_many, path, objs)
+
+async def gather_io(*aws):
+    """
+    Await independent calls together. Unlike a bare gather, every call is allowed to finish
+    before the first error (if any) is raised, so no write is left running unobserved.
+    """
+    res = await asyncio.gather(*aws, return_exceptions=True)
+    for r in res:
+        if isinstance(r, BaseException):
+            raise r
+    return res
 
 def selftest(prefix="state"):
-    b = _bucket()
     p = f"{prefix}/selftest.txt"
     try:
-        blob = b.blob(p)
-        blob.upload_from_string("ok", content_type="text/plain")
-        t = blob.download_as_text()
-        blob.delete()
-        return True, f"wrote/read/deleted gs://{_BUCKET}/{p} -> '{t}'"
+        b = backend()
+        b.write_text(p, "ok", content_type="text/plain")
+        t = b.read_text(p)
+        b.delete_many([p])
+        return True, f"wrote/read/deleted {b.name}/{p} -> '{t}'"
     except Exception as e:
         return False, f"{e.__class__.__name__}: {e}"
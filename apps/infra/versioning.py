@@ -1,21 +1,17 @@
-import os, json, hashlib, subprocess, uuid, time
+import os, copy, json, hashlib, subprocess, threading, uuid, time
 from pathlib import Path
+from typing import Any, Dict, Optional
 
 BASE = Path(__file__).resolve().parents[2]
 CFG_PATH = BASE / "configs" / "policy.rebalancer.json"
+# Written into the image at build time when .git is not shipped (see .gcloudignore).
+BUILD_COMMIT_FILE = BASE / "BUILD_COMMIT"
 
 def _git_commit():
     try:
-        return subprocess.check_output(['git','rev-parse','--short','HEAD'], cwd=BASE).decode().strip()
+        return subprocess.check_output(['git','rev-parse','--short','HEAD'], cwd=BASE, stderr=subprocess.DEVNULL).decode().strip()
     except Exception:
-        return os.getenv('GIT_COMMIT','unknown')
-
-def _config_load():
-    try:
-        with open(CFG_PATH, "r", encoding="utf-8") as f:
-            return json.load(f)
-    except Exception:
-        return {}
+        return None
 
 def _config_hash(cfg: dict):
     try:
@@ -24,12 +20,96 @@ def _config_hash(cfg: dict):
         s = str(cfg)
     return hashlib.sha256(s.encode()).hexdigest()[:12]
 
+
+class BuildInfo:
+    """
+    Process-wide build/config fingerprint.
+
+    The commit is resolved once (GIT_COMMIT env, then BUILD_COMMIT file, then git) and kept
+    for the life of the process. The policy file is re-read and re-hashed only when its
+    mtime/size change, so callers can ask on every request.
+    """
+
+    def __init__(self, base: Path = BASE, cfg_path: Path = CFG_PATH, commit_file: Path = BUILD_COMMIT_FILE):
+        self.base = base
+        self.cfg_path = cfg_path
+        self.commit_file = commit_file
+        self._lock = threading.Lock()
+        self._commit: Optional[str] = None
+        self._commit_resolved = False
+        self._cfg_key: Any = object()
+        self._cfg: Dict[str, Any] = {}
+        self._raw_hash = ""
+        self._json_hash = ""
+
+    def _resolve_commit(self) -> Optional[str]:
+        env = os.getenv("GIT_COMMIT")
+        if env:
+            return env.strip()
+        try:
+            baked = self.commit_file.read_text(encoding="utf-8").strip()
+            if baked:
+                return baked
+        except OSError:
+            pass
+        return _git_commit()
+
+    def commit(self, default: str = "n/a") -> str:
+        if not self._commit_resolved:
+            with self._lock:
+                if not self._commit_resolved:
+                    self._commit = self._resolve_commit()
+                    self._commit_resolved = True
+        return self._commit or default
+
+    def _refresh_config(self) -> None:
+        try:
+            st = os.stat(self.cfg_path)
+            key = (st.st_mtime_ns, st.st_size)
+        except OSError:
+            key = None
+        if key == self._cfg_key:
+            return
+        with self._lock:
+            if key == self._cfg_key:
+                return
+            try:
+                raw = self.cfg_path.read_text(encoding="utf-8") if key else "{}"
+            except OSError:
+                raw = "{}"
+            try:
+                cfg = json.loads(raw)
+            except Exception:
+                cfg = {}
+            self._raw_hash = hashlib.sha256(raw.encode()).hexdigest()[:12]
+            self._json_hash = _config_hash(cfg)
+            self._cfg = cfg
+            self._cfg_key = key
+
+    def config(self) -> Dict[str, Any]:
+        """Parsed policy; a copy, so a caller's edits never leak into the shared one."""
+        self._refresh_config()
+        return copy.deepcopy(self._cfg)
+
+    def config_hash(self) -> str:
+        """Hash of the policy file as written (what /mode reports)."""
+        self._refresh_config()
+        return self._raw_hash
+
+    def config_json_hash(self) -> str:
+        """Hash of the parsed policy with sorted keys (what run logs record)."""
+        self._refresh_config()
+        return self._json_hash
+
+
+BUILD = BuildInfo()
+
 def version_info():
-    cfg = _config_load()
+    cfg = BUILD.config()
     return {
         "run_id": str(uuid.uuid4()),
-        "code_commit": _git_commit(),
-        "config_hash": _config_hash(cfg),
+        "code_commit": BUILD.commit("unknown"),
+        "config_hash": BUILD.config_json_hash(),
         "profile": cfg.get("profile","(unset)"),
         "image": os.getenv("K_REVISION","n/a"),      # Cloud Run revision if present
         "trading_mode": os.getenv("TRADING_MODE","paper"),
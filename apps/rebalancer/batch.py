@@ -0,0 +1,125 @@
+# apps/rebalancer/batch.py
+"""
+Planner for many accounts (sleeves) at once.
+
+compute_actions() plans one account from state/balances.json. compute_batch() plans N
+accounts against one price snapshot and one policy: balances come from the caller, from
+state/balances.json for the "trading" account (the same source /plan uses, so both endpoints
+agree on it), and from the ledger for every other account (latest balance_snapshot qty per
+account_id/instrument, one grouped query for all of them). NAV, target value, drift and the
+band test are computed as accounts x symbols arrays. Only rows that trade become dicts, so
+cost grows with the number of actions rather than the number of accounts.
+
+Rules match _gen_actions: NAV is USD plus every priced *-USD holding, targets apply to the
+policy pairs only, a pair trades when |target - current| > nav * band, usd/qty rounded to
+2/8 decimals.
+"""
+import os
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+from apps.rebalancer.main import (
+    _band_from_policy, _latest_prices_from_db, _load_balances, _load_policy_targets, _pairs,
+)
+from libs.db import get_manager
+
+# the paper-trading account: apply_paper keeps its balances in state/balances.json
+STATE_ACCOUNT = "trading"
+
+# bare-column rule: qty comes from the MAX(ts) row of each (account, instrument)
+_LATEST_SQL = ("SELECT account_id, instrument_id, MAX(ts), qty FROM balance_snapshot "
+               "WHERE account_id IN ({}) GROUP BY account_id, instrument_id")
+
+
+def ledger_balances(accounts: Sequence[str],
+                    db_path: Optional[str] = None) -> Dict[str, Dict[str, float]]:
+    """{account: {instrument: qty}} from the latest snapshot rows; each account has a USD entry."""
+    out: Dict[str, Dict[str, float]] = {a: {"USD": 0.0} for a in accounts}
+    if not accounts:
+        return out
+    conn = get_manager(db_path or os.getenv("LEDGER_DB", "/tmp/ledger.db")).reader()
+    for i in range(0, len(accounts), 500):
+        chunk = list(accounts[i:i + 500])
+        sql = _LATEST_SQL.format(",".join("?" * len(chunk)))
+        for acct, inst, _, qty in conn.execute(sql, chunk):
+            out[acct][inst] = float(qty or 0.0)
+    return out
+
+
+def plan_arrays(qty: np.ndarray, cash: np.ndarray, px: np.ndarray, weights: np.ndarray,
+                tradable: np.ndarray, band: float) -> Dict[str, np.ndarray]:
+    """
+    Core of the batch planner. qty is accounts x symbols, cash per account, px / weights /
+    tradable per symbol (px NaN = no price). Returns nav, current and target value, drift
+    (target - current) and the trade mask.
+    """
+    priced = ~np.isnan(px)
+    value = np.where(priced, qty * np.where(priced, px, 0.0), 0.0)
+    nav = cash + value.sum(axis=1)
+    target = nav[:, None] * weights
+    drift = target - value
+    trade = ((nav > 0)[:, None] & (tradable & priced & (px != 0))[None, :]
+             & (np.abs(drift) > (nav * float(band))[:, None]))
+    return {"nav": nav, "value": value, "target": target, "drift": drift, "trade": trade}
+
+
+def compute_batch(accounts: Sequence[str], override_prices: Optional[Dict[str, float]] = None,
+                  balances: Optional[Dict[str, Dict[str, float]]] = None) -> Dict[str, Any]:
+    """
+    Returns:
+      {
+        "prices": {...}, "config": {"band": float},
+        "plans": {account: {"account", "balances", "nav", "actions": [...]}, ...}
+      }
+    `balances` (per account) replaces the state/ledger read for the accounts it names.
+    """
+    accounts = list(dict.fromkeys(accounts))
+    targets = _load_policy_targets()
+    pairs = _pairs(targets)
+    prices = dict(override_prices) if override_prices else _latest_prices_from_db(pairs)
+    if not prices:
+        raise RuntimeError("no prices available from DB; provide override_prices or load DB")
+    band = _band_from_policy(0.01)
+
+    given = dict(balances or {})
+    if STATE_ACCOUNT in accounts and STATE_ACCOUNT not in given:
+        given[STATE_ACCOUNT] = _load_balances()
+    missing = [a for a in accounts if a not in given]
+    bal = dict(ledger_balances(missing)) if missing else {}
+    for a in accounts:
+        if a in given:
+            b = {k: float(v) for k, v in given[a].items()}
+            b.setdefault("USD", 0.0)
+            bal[a] = b
+
+    # symbol axis: policy pairs first, then any other *-USD holding (counts toward NAV only)
+    held = sorted({k for a in accounts for k in bal[a] if k.endswith("-USD")} - set(pairs))
+    symbols = pairs + held
+    col = {s: j for j, s in enumerate(symbols)}
+    qty = np.zeros((len(accounts), len(symbols)))
+    for i, a in enumerate(accounts):
+        for k, q in bal[a].items():
+            j = col.get(k)
+            if j is not None:
+                qty[i, j] = q
+    cash = np.array([bal[a].get("USD", 0.0) for a in accounts])
+    px = np.array([float(prices[s]) if prices.get(s) is not None else np.nan for s in symbols])
+    weights = np.array([float(targets[s.split("-")[0]]) for s in pairs] + [0.0] * len(held))
+    tradable = np.arange(len(symbols)) < len(pairs)
+
+    r = plan_arrays(qty, cash, px, weights, tradable, band)
+    actions: List[List[Dict[str, Any]]] = [[] for _ in accounts]
+    for i, j in zip(*np.nonzero(r["trade"])):  # row-major: pair order within each account
+        delta = float(r["drift"][i, j])
+        usd = round(abs(delta), 2)
+        actions[i].append({"symbol": symbols[j], "side": "buy" if delta > 0 else "sell",
+                           "usd": usd, "qty": round(usd / float(px[j]), 8)})
+
+    return {
+        "prices": prices,
+        "config": {"band": band},
+        "plans": {a: {"account": a, "balances": bal[a], "nav": float(r["nav"][i]),
+                      "actions": actions[i]}
+                  for i, a in enumerate(accounts)},
+    }
@@ -1,74 +1,44 @@
 # apps/rebalancer/main.py
-import os, json, sqlite3
+import os
 from typing import Dict, List, Optional, Any
-from pathlib import Path
 
 from apps.infra.state_gcs import read_json  # balances come from GCS state
+from libs.prices import PRICE_CACHE
+from apps.rebalancer.policy import DEFAULT_TARGETS, Policy, PolicyError, get_policy
 
 # ---------- policy/targets helpers ----------
 
+def _load_policy() -> Optional[Policy]:
+    """Shared compiled policy (re-parsed only when the file changes); None if unavailable."""
+    try:
+        return get_policy()
+    except PolicyError:
+        return None
+
 def _load_policy_targets() -> Dict[str, float]:
     """
-    Load target weights from configs/policy.rebalancer.json.
+    Target weights from configs/policy.rebalancer.json.
     Fallback to a sane split if the file is absent.
     """
-    try:
-        cfg = Path(__file__).resolve().parents[1] / "configs" / "policy.rebalancer.json"
-        data = json.loads(cfg.read_text(encoding="utf-8"))
-        t = data.get("targets_trading") or data.get("targets") or {}
-        return {k.upper(): float(v) for k, v in t.items()}
-    except Exception:
-        return {"BTC": 0.45, "ETH": 0.25, "SOL": 0.15, "LINK": 0.15}
+    pol = _load_policy()
+    return dict(pol.targets) if pol else dict(DEFAULT_TARGETS)
 
 def _pairs(targets: Dict[str, float]) -> List[str]:
     return [f"{k}-USD" for k in targets.keys()]
 
 def _band_from_policy(default_band: float = 0.01) -> float:
     """
-    Read band from band_dynamic {base,min,max}; clamp base into [min,max].
+    Band from band_dynamic {base,min,max}; base clamped into [min,max].
     """
-    try:
-        cfg = Path(__file__).resolve().parents[1] / "configs" / "policy.rebalancer.json"
-        data = json.loads(cfg.read_text(encoding="utf-8"))
-        bd = data.get("band_dynamic") or {}
-        base = float(bd.get("base", default_band))
-        mn   = float(bd.get("min", base))
-        mx   = float(bd.get("max", base))
-        return max(mn, min(base, mx))
-    except Exception:
-        return default_band
-
-# ---------- SQLite helpers (safe with sqlite3.Row) ----------
-
-def _conn() -> sqlite3.Connection:
-    db = os.getenv("LEDGER_DB", "/tmp/ledger.db")
-    if not os.path.exists(db):
-        raise RuntimeError(f"LEDGER_DB not found at {db}")
-    con = sqlite3.connect(db)
-    con.row_factory = sqlite3.Row  # dict-like rows
-    return con
-
-def _symbol_col(cur: sqlite3.Cursor) -> str:
-    cols = [r[1] for r in cur.execute("PRAGMA table_info(price)").fetchall()]
-    lower = [c.lower() for c in cols]
-    if "symbol" in lower:        return cols[lower.index("symbol")]
-    if "instrument_id" in lower: return cols[lower.index("instrument_id")]
-    raise RuntimeError("price table missing symbol/instrument_id")
+    pol = _load_policy()
+    return pol.band if pol else default_band
+
+# ---------- prices ----------
 
 def _latest_prices_from_db(pairs: List[str]) -> Dict[str, float]:
-    out: Dict[str, float] = {}
-    with _conn() as con:
-        cur = con.cursor()
-        symcol = _symbol_col(cur)
-        # Using ORDER BY ts DESC LIMIT 1 for each pair
-        for p in pairs:
-            row = cur.execute(
-                f"SELECT px FROM price WHERE {symcol}=? ORDER BY ts DESC LIMIT 1",
-                (p,)
-            ).fetchone()
-            if row and row["px"] is not None:
-                out[p] = float(row["px"])
-    return out
+    # one grouped query for the whole universe, reused until the ledger changes
+    db = os.getenv("LEDGER_DB", "/tmp/ledger.db")
+    return PRICE_CACHE.prices(db, pairs)
 
 # ---------- balances + NAV ----------
 
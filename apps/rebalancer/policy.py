@@ -0,0 +1,279 @@
+# apps/rebalancer/policy.py
+"""
+Compiled, immutable view of configs/policy.rebalancer.json.
+
+Policy.from_dict() validates the raw JSON once and pre-normalizes everything callers used to
+convert on every call: asset keys upper-cased, pair-keyed maps ("BTC" -> "BTC-USD") for
+targets/caps/qty steps, floats/ints/bools coerced. get_policy() hands out a shared instance
+that is re-read only when the file's mtime/size change, re-parsed only when its content hash
+changes, and swapped in as a single reference; an invalid edit keeps the last good policy
+(and is remembered by mtime/size, so it is not re-read on every call).
+"""
+import dataclasses, hashlib, json, os, threading
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Dict, Mapping, Optional, Tuple
+
+BASE = Path(__file__).resolve().parents[2]
+CFG_PATH = BASE / "configs" / "policy.rebalancer.json"
+
+# Used by callers that must keep working without a policy file (service fallbacks).
+DEFAULT_TARGETS = {"BTC": 0.45, "ETH": 0.25, "SOL": 0.15, "LINK": 0.15}
+
+
+class PolicyError(ValueError):
+    """Policy file missing or failed validation."""
+
+
+def pair(asset: str) -> str:
+    """'btc' -> 'BTC-USD'; already-quoted symbols pass through."""
+    a = asset.strip().upper()
+    return a if a.endswith("-USD") else f"{a}-USD"
+
+
+class FrozenDict(dict):
+    """Read-only dict for policy maps (unlike MappingProxyType it pickles, for sweep workers)."""
+
+    def _readonly(self, *a, **kw):
+        raise TypeError("policy mappings are read-only")
+
+    __setitem__ = __delitem__ = __ior__ = _readonly
+    clear = pop = popitem = setdefault = update = _readonly
+
+    def __reduce__(self):
+        return (FrozenDict, (dict(self),))
+
+
+def _ro(d: Dict) -> Mapping:
+    return FrozenDict(d)
+
+
+def _float(d: Mapping, key: str, default: float) -> float:
+    v = d.get(key, default)
+    try:
+        return float(v)
+    except (TypeError, ValueError):
+        raise PolicyError(f"{key}: expected a number, got {v!r}")
+
+
+def _pair_map(d: Any, key: str) -> Mapping[str, float]:
+    if d is None:
+        return _ro({})
+    if not isinstance(d, dict):
+        raise PolicyError(f"{key}: expected an object")
+    return _ro({pair(k): _float(d, k, 0.0) for k in d})
+
+
+@dataclass(frozen=True, slots=True)
+class Momentum:
+    enabled: bool = False
+    lookback_days: int = 60
+    tilt_max_pct: float = 0.05
+    tilt_strength: float = 1.0
+
+
+@dataclass(frozen=True, slots=True)
+class SatelliteGate:
+    enabled: bool = False
+    symbols: Tuple[str, ...] = ()
+    lookback_days: int = 60
+    threshold_ret: float = 0.0
+    max_weight_pct: Mapping[str, float] = field(default_factory=lambda: _ro({}))
+
+
+@dataclass(frozen=True, slots=True)
+class CashPolicy:
+    floor_usd: float = 0.0
+    auto_deploy_usd_per_day: float = 0.0
+    pro_rata_underweights: bool = True
+
+
+@dataclass(frozen=True, slots=True)
+class BandDynamic:
+    enabled: bool = False
+    base: float = 0.05
+    min: float = 0.02
+    max: float = 0.08
+    lookback_days: int = 30
+    target_ann_vol: float = 0.35
+
+    @property
+    def clamped_base(self) -> float:
+        return max(self.min, min(self.base, self.max))
+
+
+@dataclass(frozen=True, slots=True)
+class RiskStops:
+    halt_on_stale: bool = False
+    min_price_age_sec: int = 900
+    max_30d_drawdown: float = -0.12
+
+
+@dataclass(frozen=True, slots=True)
+class Policy:
+    targets: Mapping[str, float]          # {"BTC": 0.445, ...}
+    pair_targets: Mapping[str, float]     # {"BTC-USD": 0.445, ...}
+    pairs: Tuple[str, ...]                # sorted pair symbols
+    bands_pct: float = 0.05
+    min_trade_usd: float = 1000.0
+    move_fraction: float = 0.5
+    daily_turnover_cap_usd: float = 1e15
+    per_asset_cap_usd: Mapping[str, float] = field(default_factory=lambda: _ro({}))
+    taker_fee_bps: float = 0.0
+    slippage_bps: float = 0.0
+    qty_step: Mapping[str, float] = field(default_factory=lambda: _ro({}))
+    max_trade_count: int = 99
+    ensure_cash: bool = True
+    momentum: Momentum = Momentum()
+    satellite_gate: SatelliteGate = SatelliteGate()
+    cash: CashPolicy = CashPolicy()
+    band_dynamic: BandDynamic = BandDynamic()
+    risk_stops: RiskStops = RiskStops()
+    execution_mode: str = "paper"
+    profile: str = "(unset)"
+    raw: Mapping[str, Any] = field(default_factory=lambda: _ro({}), compare=False)
+    content_hash: str = ""
+
+    @property
+    def band(self) -> float:
+        """Static band: band_dynamic.base clamped into [min, max]."""
+        return self.band_dynamic.clamped_base
+
+    def replace(self, **changes) -> "Policy":
+        return dataclasses.replace(self, **changes)
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any], content_hash: str = "") -> "Policy":
+        if not isinstance(data, dict):
+            raise PolicyError("policy must be a JSON object")
+        t = data.get("targets_trading") or data.get("targets") or {}
+        if not isinstance(t, dict) or not t:
+            raise PolicyError("targets_trading: expected a non-empty object")
+        targets = {k.upper(): _float(t, k, 0.0) for k in t if k.upper() != "USD"}
+        if any(w < 0 for w in targets.values()):
+            raise PolicyError("targets_trading: weights must be >= 0")
+
+        bands = _float(data, "bands_pct", 0.05)
+        mom = data.get("momentum") or {}
+        gate = data.get("satellite_gate") or {}
+        cash = data.get("cash") or {}
+        bd = data.get("band_dynamic") or {}
+        rs = data.get("risk_stops") or {}
+        for key, sub in (("momentum", mom), ("satellite_gate", gate), ("cash", cash),
+                         ("band_dynamic", bd), ("risk_stops", rs)):
+            if not isinstance(sub, dict):
+                raise PolicyError(f"{key}: expected an object")
+
+        band_dynamic = BandDynamic(
+            enabled=bool(bd.get("enabled", False)),
+            base=_float(bd, "base", bands),
+            min=_float(bd, "min", 0.02),
+            max=_float(bd, "max", 0.08),
+            lookback_days=int(_float(bd, "lookback_days", 30)),
+            target_ann_vol=_float(bd, "target_ann_vol", 0.35),
+        )
+        if band_dynamic.min > band_dynamic.max:
+            raise PolicyError("band_dynamic: min > max")
+
+        return cls(
+            targets=_ro(targets),
+            pair_targets=_ro({pair(k): v for k, v in targets.items()}),
+            pairs=tuple(sorted(pair(k) for k in targets)),
+            bands_pct=bands,
+            min_trade_usd=_float(data, "min_trade_usd", 1000.0),
+            move_fraction=_float(data, "move_fraction", 0.5),
+            daily_turnover_cap_usd=_float(data, "daily_turnover_cap_usd", 1e15),
+            per_asset_cap_usd=_pair_map(data.get("per_asset_cap_usd"), "per_asset_cap_usd"),
+            taker_fee_bps=_float(data, "taker_fee_bps", 0.0),
+            slippage_bps=_float(data, "slippage_bps", 0.0),
+            qty_step=_pair_map(data.get("qty_step"), "qty_step"),
+            max_trade_count=int(_float(data, "max_trade_count", 99)),
+            ensure_cash=bool(data.get("ensure_cash", True)),
+            momentum=Momentum(
+                enabled=bool(mom.get("enabled", False)),
+                lookback_days=int(_float(mom, "lookback_days", 60)),
+                tilt_max_pct=_float(mom, "tilt_max_pct", 0.05),
+                tilt_strength=_float(mom, "tilt_strength", 1.0),
+            ),
+            satellite_gate=SatelliteGate(
+                enabled=bool(gate.get("enabled", False)),
+                symbols=tuple(s.upper() for s in gate.get("symbols", [])),
+                lookback_days=int(_float(gate, "lookback_days", 60)),
+                threshold_ret=_float(gate, "threshold_ret", 0.0),
+                max_weight_pct=_ro({k.upper(): _float(gate.get("max_weight_pct") or {}, k, 0.0)
+                                    for k in (gate.get("max_weight_pct") or {})}),
+            ),
+            cash=CashPolicy(
+                floor_usd=_float(cash, "floor_usd", 0.0),
+                auto_deploy_usd_per_day=_float(cash, "auto_deploy_usd_per_day", 0.0),
+                pro_rata_underweights=bool(cash.get("pro_rata_underweights", True)),
+            ),
+            band_dynamic=band_dynamic,
+            risk_stops=RiskStops(
+                halt_on_stale=bool(rs.get("halt_on_stale", False)),
+                min_price_age_sec=int(_float(rs, "min_price_age_sec", 900)),
+                max_30d_drawdown=_float(rs, "max_30d_drawdown", -0.12),
+            ),
+            execution_mode=str(data.get("execution_mode", "paper")),
+            profile=str(data.get("profile", "(unset)")),
+            raw=_ro(data),
+            content_hash=content_hash,
+        )
+
+
+class PolicyStore:
+    """Holds the current Policy for one file and swaps it when the file changes."""
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        self._key: Any = None
+        self._policy: Optional[Policy] = None
+        self._bad_key: Any = None  # mtime/size of a version that failed to load, and why
+        self._bad_error = ""
+
+    def get(self) -> Policy:
+        try:
+            st = os.stat(self.path)
+            key = (st.st_mtime_ns, st.st_size)
+        except OSError as e:
+            if self._policy is not None:
+                return self._policy
+            raise PolicyError(f"policy file not readable: {self.path}") from e
+        cur = self._policy
+        if cur is not None and (key == self._key or key == self._bad_key):
+            return cur
+        with self._lock:
+            if self._policy is not None and key == self._key:
+                return self._policy
+            if key == self._bad_key:
+                if self._policy is not None:
+                    return self._policy
+                raise PolicyError(self._bad_error)
+            raw = self.path.read_bytes()
+            digest = hashlib.sha256(raw).hexdigest()[:12]
+            if self._policy is not None and digest == self._policy.content_hash:
+                self._key = key  # touched, not changed
+                return self._policy
+            try:
+                pol = Policy.from_dict(json.loads(raw.decode("utf-8")), content_hash=digest)
+            except (PolicyError, ValueError) as e:
+                self._bad_key, self._bad_error = key, f"{self.path}: {e}"
+                if self._policy is not None:
+                    return self._policy  # keep serving the last good policy
+                raise PolicyError(self._bad_error) from e
+            self._policy, self._key = pol, key
+            return pol
+
+
+_STORES: Dict[Path, PolicyStore] = {}
+_STORES_LOCK = threading.Lock()
+
+def get_policy(path: Optional[Path] = None) -> Policy:
+    """Shared, hot-reloaded Policy for `path` (default configs/policy.rebalancer.json)."""
+    p = Path(path or CFG_PATH).resolve()
+    store = _STORES.get(p)
+    if store is None:
+        with _STORES_LOCK:
+            store = _STORES.setdefault(p, PolicyStore(p))
+    return store.get()
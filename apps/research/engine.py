@@ -0,0 +1,165 @@
+# apps/research/engine.py
+"""
+Backtest engine on a dense (days x symbols) close matrix.
+
+Everything that does not depend on holdings is precomputed with NumPy: the lookback price
+index for momentum (O(days x symbols) instead of a backwards scan per symbol per day) and the
+full tilted target matrix. What remains is the day loop itself, whose state (cash, qty)
+feeds the next day; it runs on plain floats pulled out of the matrix once.
+
+Policy semantics and float evaluation order are those of the original day-by-day loop in
+backtest_rebal / compare_vs_hodl: bands on crypto-sleeve weights, move_fraction, fee +
+slippage in the effective price, qty_step floor, per-asset caps, ensure-cash, daily
+turnover cap, min_trade_usd. Sums run left to right in the same order, so NAVs match the
+old loop bit for bit (tests/research/test_engine.py keeps the reference loop).
+"""
+import math
+from dataclasses import dataclass
+from typing import List, Mapping, Optional, Sequence
+
+import numpy as np
+
+from apps.rebalancer.policy import Policy
+
+
+@dataclass
+class SimResult:
+    navs: List[float]
+    turnover_usd: float
+    trades: int
+
+
+def _seq_sum(cols: Sequence[np.ndarray]) -> np.ndarray:
+    # Python's sum(): left to right, starting from 0
+    acc = 0
+    for c in cols:
+        acc = acc + c
+    return acc
+
+
+def lookback_index(px: np.ndarray, look: int) -> np.ndarray:
+    """
+    Row of the price used as "past" for each (day, symbol): the last non-zero close at or
+    before day - look (clamped to day 0); -1 if there is none.
+    """
+    n = px.shape[0]
+    rows = np.arange(n)[:, None]
+    have = px != 0  # truthiness, as in the reference loop
+    last = np.maximum.accumulate(np.where(have, rows, -1), axis=0)
+    cut = np.maximum(0, np.arange(n) - look)
+    return last[cut]
+
+
+def momentum_targets(px: np.ndarray, pairs: Sequence[str], targets: Mapping[str, float],
+                     policy: Policy) -> np.ndarray:
+    """Per-day targets (days x symbols) after the momentum tilt; day 0 is never tilted."""
+    base = np.array([targets[s] for s in pairs], dtype=float)
+    out = np.broadcast_to(base, px.shape).copy()
+    mom = policy.momentum
+    if not mom.enabled or px.shape[0] < 2:
+        return out
+    idx = lookback_index(px, mom.lookback_days)
+    cols = np.arange(px.shape[1])
+    past = np.where(idx >= 0, px[np.maximum(idx, 0), cols], np.nan)
+    ok = past > 0
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ret = px / past - 1.0
+    tilt = np.maximum(-mom.tilt_max_pct, np.minimum(mom.tilt_max_pct, ret * mom.tilt_strength))
+    tilted = np.where(ok, np.maximum(0.0, base * (1 + tilt)), base)
+    base_sum = sum(targets.values())
+    t_sum = _seq_sum([tilted[:, j] for j in range(tilted.shape[1])])
+    with np.errstate(divide="ignore", invalid="ignore"):
+        scaled = tilted * (base_sum / t_sum)[:, None]
+    use = t_sum > 0
+    use[0] = False
+    out[use] = scaled[use]
+    return out
+
+
+def simulate(px: np.ndarray, pairs: Sequence[str], targets: Mapping[str, float], policy: Policy,
+             usd: float, qty: Mapping[str, float], ttargets: Optional[np.ndarray] = None) -> SimResult:
+    """
+    Run the rebalancer over `px` (dense closes, columns in `pairs` order) from a starting
+    cash/qty. `ttargets` may be passed in when several runs share the same momentum knobs.
+    """
+    n_sym = len(pairs)
+    if ttargets is None:
+        ttargets = momentum_targets(px, pairs, targets, policy)
+    band = policy.bands_pct
+    mf = policy.move_fraction
+    adj = (policy.taker_fee_bps + policy.slippage_bps) / 10000.0
+    buy_k, sell_k = 1 + adj, 1 - adj
+    steps = [policy.qty_step.get(s, 0.0) for s in pairs]
+    caps = [policy.per_asset_cap_usd.get(s) for s in pairs]
+    min_usd = policy.min_trade_usd
+    daily_cap = policy.daily_turnover_cap_usd
+    floor = math.floor
+    rng = range(n_sym)
+
+    q = [float(qty.get(s, 0.0)) for s in pairs]
+    cash = usd
+    navs: List[float] = []
+    turnover = 0.0
+    trades = 0
+    for prow, trow in zip(px.tolist(), ttargets.tolist()):
+        crypto_val = sum(q[j]*prow[j] for j in rng)
+        actions = []
+        if crypto_val > 0:
+            for j in rng:
+                drift = q[j]*prow[j]/crypto_val - trow[j]
+                if abs(drift) > band:
+                    usd_mv = - drift*crypto_val*mf
+                    buy = usd_mv > 0
+                    pxe = prow[j]*buy_k if buy else prow[j]*sell_k
+                    qraw = abs(usd_mv)/pxe if pxe > 0 else 0.0
+                    step = steps[j]
+                    qrd = qraw if step <= 0 else floor(qraw/step)*step
+                    usd_eff = qrd*pxe if buy else -qrd*pxe
+                    if qrd > 0 and abs(usd_eff) >= min_usd:
+                        actions.append([j, buy, qrd, usd_eff])
+        if not actions:
+            navs.append(cash + sum(q[j]*prow[j] for j in rng))
+            continue
+
+        # per-asset caps
+        for a in actions:
+            cap = caps[a[0]]
+            if cap and abs(a[3]) > cap:
+                sc = cap/abs(a[3])
+                a[2] *= sc; a[3] *= sc
+
+        # ensure cash
+        buys = [a for a in actions if a[3] > 0]
+        avail = cash + sum(-a[3] for a in actions if a[3] < 0)
+        need = sum(a[3] for a in buys)
+        if need > avail and need > 0:
+            sc = avail/need if avail > 0 else 0.0
+            for a in buys:
+                a[2] *= sc; a[3] *= sc
+
+        # daily turnover cap
+        tot = sum(abs(a[3]) for a in actions)
+        if tot > daily_cap and tot > 0:
+            sc = daily_cap/tot
+            for a in actions:
+                a[2] *= sc; a[3] *= sc
+
+        # drop small legs, apply (EOD)
+        for j, buy, qd, ud in actions:
+            if abs(ud) < min_usd:
+                continue
+            if buy:
+                cash -= ud; q[j] += qd
+            else:
+                cash += (-ud); q[j] -= qd
+            turnover += abs(ud); trades += 1
+
+        navs.append(cash + sum(q[j]*prow[j] for j in rng))
+    return SimResult(navs, turnover, trades)
+
+
+def hold_navs(px: np.ndarray, pairs: Sequence[str], usd: float, qty: Mapping[str, float]) -> List[float]:
+    """Buy-and-hold NAV per day, summed in the same order as the reference loop."""
+    if px.shape[0] == 0:
+        return []
+    return (usd + _seq_sum([qty.get(s, 0.0) * px[:, j] for j, s in enumerate(pairs)])).tolist()
@@ -1,6 +1,9 @@
 import argparse, json, sqlite3, statistics, math, datetime
 from pathlib import Path
 
+from apps.rebalancer.policy import get_policy
+from libs.price_store import load_daily
+
 BASE = Path(__file__).resolve().parents[2]
 DB = BASE / "data" / "ledger.db"
 CFG_PATH = BASE / "configs" / "policy.rebalancer.json"
@@ -72,16 +75,8 @@ def save_cfg(cfg):
         json.dump(cfg, f, indent=2)
 
 def daily_series(cur, sym, days):
-    rows = cur.execute("SELECT ts, px FROM price WHERE instrument_id=? ORDER BY ts ASC",(sym,)).fetchall()
-    by_day = {}
-    for ts, px in rows:
-        d = ts[:10]
-        by_day[d] = px  # keep last-of-day
-    dates = sorted(by_day.keys())
-    if days > 0 and len(dates) > days+1:
-        dates = dates[-(days+1):]
-    series = [by_day[d] for d in dates]
-    return dates, series
+    # last-of-day closes, last days+1 points (all if days <= 0)
+    return load_daily(cur.connection, [sym]).series(sym, days+1 if days > 0 else 0)
 
 def daily_rets(series):
     r=[]
@@ -105,11 +100,11 @@ def mom_ret(series, look):
     return None
 
 def retarget(profile_name, alpha=None, days=None, write_knobs=False, universe=None, dry_run=False):
-    cfg = load_cfg()
+    pol = get_policy()
     prof = DEFAULT_PROFILES[profile_name]
 
     # Universe: from provided list or from existing targets
-    cur_targets = cfg.get("targets_trading", {"BTC":0.4,"ETH":0.3,"SOL":0.15,"LINK":0.15})
+    cur_targets = dict(pol.targets)
     assets = [a.upper() for a in (universe if universe else cur_targets.keys())]
     # ensure only the coins we actually handle
     assets = [a for a in assets if a in {"BTC","ETH","SOL","LINK"}]
@@ -127,18 +122,14 @@ def retarget(profile_name, alpha=None, days=None, write_knobs=False, universe=No
     alpha    = float(alpha if alpha is not None else prof["smoothing_alpha"])
 
     # Optional per-asset % cap from config.satellite_gate.max_weight_pct (if present)
-    sat_cap_map = {}
-    sg = cfg.get("satellite_gate", {})
-    if isinstance(sg, dict) and isinstance(sg.get("max_weight_pct"), dict):
-        for k,v in sg["max_weight_pct"].items():
-            sat_cap_map[k.upper()] = float(v)
+    sat_cap_map = pol.satellite_gate.max_weight_pct
 
     # Pull series from DB
     conn = sqlite3.connect(DB); conn.row_factory = sqlite3.Row
-    cur = conn.cursor()
+    daily = load_daily(conn, symbols)
     series = {}
     for s in symbols:
-        _, ser = daily_series(cur, s, risk_win)
+        _, ser = daily.series(s, risk_win+1 if risk_win > 0 else 0)
         series[s] = ser
 
     # Compute inv-vol weights (1/vol)
@@ -254,6 +245,7 @@ def retarget(profile_name, alpha=None, days=None, write_knobs=False, universe=No
     # Write back
     out_targets = {k: round(new_t[k], 4) for k in keys}
     if not dry_run:
+        cfg = load_cfg()  # raw JSON, so keys the Policy doesn't model survive the rewrite
         cfg["targets_trading"] = out_targets
         if write_knobs:
             # apply profile knobs to policy (bands/cash/momentum gates)
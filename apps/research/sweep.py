@@ -0,0 +1,304 @@
+# apps/research/sweep.py
+"""
+Parameter sweeps over the rebalancer policy.
+
+A spec (JSON) names the policy fields to vary; dotted names reach into sub-policies:
+
+  {
+    "mode": "grid",                      # or "random" (+ "samples", "seed")
+    "days": 365, "account": "trading", "rf": 0.0,
+    "start": {"usd": 20000, "qty": {"BTC-USD": 1.0}},   # optional; default = DB balances
+    "params": {
+      "bands_pct": [0.02, 0.035, 0.05],
+      "move_fraction": [0.5, 1.0],
+      "momentum.tilt_strength": {"min": 0.5, "max": 1.5},        # random mode: uniform
+      "momentum.lookback_days": {"min": 20, "max": 90, "int": true},
+      "profile": ["Defensive", "Balanced", "Aggressive"]          # retarget.DEFAULT_PROFILES
+    }
+  }
+
+The price matrix is loaded once and handed to a process pool through shared memory. Each
+evaluated config is appended to an NDJSON checkpoint as it completes, so an interrupted
+sweep resumes where it stopped; the ranked table (Sharpe, CAGR, MDD, turnover) is written
+as CSV at the end. The checkpoint's first line is a fingerprint of the run's inputs (price
+matrix, date range, policy, start balances, rf); a checkpoint from different inputs (new
+prices, a policy edit, other days/start/account) is discarded instead of resumed.
+
+  python -m apps.research.sweep spec.json --out sweep.csv --checkpoint sweep.ckpt.jsonl
+"""
+import argparse, csv, dataclasses, hashlib, itertools, json, math, os, random, sqlite3
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import shared_memory
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from apps.infra.perfstats import PerfStats
+from apps.rebalancer.policy import Policy, get_policy
+from apps.research.engine import momentum_targets, simulate
+from apps.research.retarget import DEFAULT_PROFILES
+from libs.price_store import load_daily
+
+BASE = Path(__file__).resolve().parents[2]
+DB = BASE / "data" / "ledger.db"
+
+# retarget profile knobs that have a counterpart in the backtested policy
+PROFILE_FIELDS = {
+    "band_base": "bands_pct",
+    "tilt_strength": "momentum.tilt_strength",
+    "tilt_max_pct": "momentum.tilt_max_pct",
+    "momentum_lookback_days": "momentum.lookback_days",
+}
+
+RESULT_FIELDS = ["sharpe", "cagr", "mdd", "vol_ann", "turnover_usd", "turnover_x", "trades", "end_nav"]
+
+
+# ---------- configs ----------
+
+def apply_params(policy: Policy, params: Dict[str, Any]) -> Policy:
+    """Policy with `params` applied; "a.b" replaces field b of sub-policy a."""
+    flat: Dict[str, Any] = {}
+    prof = params.get("profile")
+    if prof is not None:
+        for knob, field in PROFILE_FIELDS.items():
+            flat[field] = DEFAULT_PROFILES[prof][knob]
+    flat.update({k: v for k, v in params.items() if k != "profile"})
+
+    top: Dict[str, Any] = {}
+    nested: Dict[str, Dict[str, Any]] = {}
+    for k, v in flat.items():
+        head, _, tail = k.partition(".")
+        if tail:
+            nested.setdefault(head, {})[tail] = v
+        else:
+            top[k] = v
+    for head, fields in nested.items():
+        top[head] = dataclasses.replace(getattr(policy, head), **fields)
+    return dataclasses.replace(policy, **top)
+
+
+def config_id(params: Dict[str, Any]) -> str:
+    return hashlib.sha1(json.dumps(params, sort_keys=True).encode()).hexdigest()[:12]
+
+
+def expand(spec: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """The list of param dicts a spec describes (grid product or random samples)."""
+    params: Dict[str, Any] = spec.get("params", {})
+    names = sorted(params)
+    if spec.get("mode", "grid") == "grid":
+        for n in names:
+            if not isinstance(params[n], list):
+                raise ValueError(f"grid mode needs a list of values for {n}")
+        return [dict(zip(names, combo)) for combo in itertools.product(*(params[n] for n in names))]
+
+    rnd = random.Random(spec.get("seed", 0))
+    out = []
+    for _ in range(int(spec.get("samples", 100))):
+        p = {}
+        for n in names:
+            dom = params[n]
+            if isinstance(dom, list):
+                p[n] = rnd.choice(dom)
+            elif dom.get("int"):
+                p[n] = rnd.randint(int(dom["min"]), int(dom["max"]))
+            elif dom.get("log"):
+                p[n] = math.exp(rnd.uniform(math.log(dom["min"]), math.log(dom["max"])))
+            else:
+                p[n] = rnd.uniform(dom["min"], dom["max"])
+        out.append(p)
+    return out
+
+
+# ---------- evaluation (runs in workers) ----------
+
+_W: Dict[str, Any] = {}
+
+def _init_worker(shm_name: str, shape: Tuple[int, int], pairs: List[str], targets: Dict[str, float],
+                 policy: Policy, usd: float, qty: Dict[str, float], rf: float) -> None:
+    shm = shared_memory.SharedMemory(name=shm_name)
+    _W.update(shm=shm, px=np.ndarray(shape, dtype=np.float64, buffer=shm.buf), pairs=pairs,
+              targets=targets, policy=policy, usd=usd, qty=qty, rf=rf, ttargets={})
+
+
+def evaluate(px: np.ndarray, pairs: Sequence[str], targets: Dict[str, float], policy: Policy,
+             usd: float, qty: Dict[str, float], rf: float = 0.0,
+             ttargets: Optional[np.ndarray] = None) -> Dict[str, Any]:
+    res = simulate(px, pairs, targets, policy, usd, qty, ttargets=ttargets)
+    st = PerfStats.from_series(res.navs)
+    start = res.navs[0] if res.navs else 0.0
+    return {
+        "sharpe": st.sharpe(rf),
+        "cagr": st.cagr(),
+        "mdd": st.max_dd,
+        "vol_ann": st.vol_ann(),
+        "turnover_usd": res.turnover_usd,
+        "turnover_x": res.turnover_usd / start if start > 0 else None,
+        "trades": res.trades,
+        "end_nav": res.navs[-1] if res.navs else None,
+    }
+
+
+def _eval_chunk(chunk: List[Tuple[str, Dict[str, Any]]]) -> List[Dict[str, Any]]:
+    out = []
+    cache: Dict[Any, np.ndarray] = _W["ttargets"]
+    for cid, params in chunk:
+        pol = apply_params(_W["policy"], params)
+        # configs sharing momentum knobs share the tilted target matrix
+        tt = cache.get(pol.momentum)
+        if tt is None:
+            tt = cache[pol.momentum] = momentum_targets(_W["px"], _W["pairs"], _W["targets"], pol)
+        row = evaluate(_W["px"], _W["pairs"], _W["targets"], pol, _W["usd"], _W["qty"], _W["rf"], tt)
+        out.append({"id": cid, "params": params, **row})
+    return out
+
+
+# ---------- driver ----------
+
+def run_fingerprint(px: np.ndarray, pairs: Sequence[str], targets: Dict[str, float], policy: Policy,
+                    usd: float, qty: Dict[str, float], rf: float, context: Optional[Dict[str, Any]] = None) -> str:
+    """Hash of everything a result depends on besides its params."""
+    h = hashlib.sha1()
+    px = np.ascontiguousarray(px, dtype=np.float64)
+    h.update(repr(px.shape).encode())
+    h.update(px.tobytes())
+    h.update(json.dumps({"pairs": list(pairs), "targets": targets, "policy": dataclasses.asdict(policy),
+                         "usd": usd, "qty": qty, "rf": rf, "context": context or {}},
+                        sort_keys=True, default=str).encode())
+    return h.hexdigest()[:16]
+
+
+def _read_checkpoint(path: Optional[Path], fingerprint: str) -> Optional[Dict[str, Dict[str, Any]]]:
+    """Rows of a checkpoint written for `fingerprint`; None if absent or from other inputs."""
+    if not path or not path.exists():
+        return None
+    done: Dict[str, Dict[str, Any]] = {}
+    with open(path, "r", encoding="utf-8") as f:
+        try:
+            head = json.loads(f.readline())
+        except ValueError:
+            return None
+        if not isinstance(head, dict) or head.get("fingerprint") != fingerprint:
+            return None
+        for line in f:
+            try:
+                row = json.loads(line)
+                done[row["id"]] = row
+            except (ValueError, KeyError):
+                continue  # torn last line from an interrupted run
+    return done
+
+
+def run_sweep(spec: Dict[str, Any], px: np.ndarray, pairs: List[str], targets: Dict[str, float],
+              policy: Policy, usd: float, qty: Dict[str, float], checkpoint: Optional[Path] = None,
+              workers: Optional[int] = None, chunk_size: int = 32,
+              context: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+    """
+    Evaluate every config of `spec` not already in `checkpoint`; returns all rows ranked.
+    `context` names inputs that are not visible in the arguments (e.g. the date range) and
+    goes into the checkpoint fingerprint.
+    """
+    rf = float(spec.get("rf", 0.0))
+    configs = {config_id(p): p for p in expand(spec)}
+    fp = run_fingerprint(px, pairs, targets, policy, float(usd), dict(qty), rf, context)
+    done = _read_checkpoint(checkpoint, fp)
+    if checkpoint and done is None:
+        checkpoint.write_text(json.dumps({"fingerprint": fp}) + "\n", encoding="utf-8")
+    done = done or {}
+    todo = [(cid, p) for cid, p in configs.items() if cid not in done]
+    rows = [done[cid] for cid in configs if cid in done]
+
+    if todo:
+        px = np.ascontiguousarray(px, dtype=np.float64)
+        shm = shared_memory.SharedMemory(create=True, size=max(1, px.nbytes))
+        try:
+            np.ndarray(px.shape, dtype=np.float64, buffer=shm.buf)[:] = px
+            init = (shm.name, px.shape, list(pairs), dict(targets), policy, float(usd), dict(qty), rf)
+            chunks = [todo[i:i + chunk_size] for i in range(0, len(todo), chunk_size)]
+            ckpt = open(checkpoint, "a", encoding="utf-8") if checkpoint else None
+            try:
+                with ProcessPoolExecutor(max_workers=workers or os.cpu_count(),
+                                         initializer=_init_worker, initargs=init) as ex:
+                    for fut in as_completed([ex.submit(_eval_chunk, c) for c in chunks]):
+                        batch = fut.result()
+                        rows.extend(batch)
+                        if ckpt:
+                            ckpt.write("".join(json.dumps(r) + "\n" for r in batch))
+                            ckpt.flush()
+            finally:
+                if ckpt:
+                    ckpt.close()
+        finally:
+            shm.close()
+            shm.unlink()
+
+    return rank(rows)
+
+
+def rank(rows: Iterable[Dict[str, Any]], key: str = "sharpe") -> List[Dict[str, Any]]:
+    def k(r):
+        v = r.get(key)
+        return (v is None or (isinstance(v, float) and math.isnan(v)), -(v or 0.0))
+    return sorted(rows, key=k)
+
+
+def write_csv(rows: List[Dict[str, Any]], out: Path) -> None:
+    names = sorted({n for r in rows for n in r["params"]})
+    with open(out, "w", newline="", encoding="utf-8") as f:
+        w = csv.writer(f)
+        w.writerow(["rank", "id"] + names + RESULT_FIELDS)
+        for i, r in enumerate(rows, 1):
+            w.writerow([i, r["id"]] + [r["params"].get(n, "") for n in names]
+                       + ["" if r.get(c) is None else r[c] for c in RESULT_FIELDS])
+
+
+def _start_from_db(conn, account: str, pairs: List[str]) -> Tuple[float, Dict[str, float]]:
+    def q(instr):
+        r = conn.execute("SELECT qty FROM balance_snapshot WHERE account_id=? AND instrument_id=? "
+                         "ORDER BY ts DESC LIMIT 1", (account, instr)).fetchone()
+        return float(r[0]) if r else 0.0
+    return q("USD"), {s: q(s) for s in pairs}
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    ap = argparse.ArgumentParser(description="Parallel policy parameter sweep")
+    ap.add_argument("spec", type=Path)
+    ap.add_argument("--out", type=Path, default=Path("sweep.csv"))
+    ap.add_argument("--checkpoint", type=Path, default=None, help="NDJSON; default <out>.ckpt.jsonl")
+    ap.add_argument("--workers", type=int, default=None)
+    ap.add_argument("--top", type=int, default=10)
+    args = ap.parse_args(argv)
+
+    spec = json.loads(args.spec.read_text(encoding="utf-8"))
+    pol = get_policy()
+    targets = dict(pol.pair_targets)
+    pairs = sorted(targets)
+
+    conn = sqlite3.connect(DB)
+    try:
+        daily = load_daily(conn, pairs).dense(int(spec.get("days", 365)))
+        start = spec.get("start")
+        if start:
+            usd, qty = float(start.get("usd", 0.0)), {s: float(start.get("qty", {}).get(s, 0.0)) for s in pairs}
+        else:
+            usd, qty = _start_from_db(conn, spec.get("account", "trading"), pairs)
+    finally:
+        conn.close()
+    if len(daily.dates) < 2:
+        raise SystemExit("Not enough price history.")
+
+    ckpt = args.checkpoint or args.out.with_suffix(".ckpt.jsonl")
+    rows = run_sweep(spec, daily.px, pairs, targets, pol, usd, qty, checkpoint=ckpt, workers=args.workers,
+                     context={"dates": [daily.dates[0], daily.dates[-1]], "account": spec.get("account", "trading")})
+    write_csv(rows, args.out)
+
+    print(f"=== Sweep: {len(rows)} configs over {daily.dates[0]} → {daily.dates[-1]} ===")
+    for i, r in enumerate(rows[:args.top], 1):
+        sh = r["sharpe"]
+        print(f"{i:>3}. sharpe={'n/a' if sh is None else f'{sh:.2f}'}  cagr={(r['cagr'] or 0):.2%}  "
+              f"mdd={r['mdd']:.2%}  turnover={r['turnover_usd']:,.0f}  {json.dumps(r['params'], sort_keys=True)}")
+    print(f"Results: {args.out}  (checkpoint: {ckpt})")
+
+
+if __name__ == "__main__":
+    main()
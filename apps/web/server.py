@@ -1,4 +1,4 @@
-import os, sys, json, subprocess
+import os, sys, subprocess
 from pathlib import Path
 from flask import Flask, jsonify, request
 
@@ -8,16 +8,12 @@ os.environ.setdefault("PYTHONPATH", str(BASE))
 
 # Reuse your compute_actions
 from apps.rebalancer.main import compute_actions
+from apps.rebalancer.policy import PolicyError, get_policy
 
 def _targets_to_pairs():
-    cfg_path = BASE / "configs" / "policy.rebalancer.json"
     try:
-        with open(cfg_path, "r", encoding="utf-8") as f:
-            cfg = json.load(f)
-        t = cfg.get("targets_trading", {})
-        pairs = [f"{k.upper()}-USD" for k in t.keys() if k.upper() != "USD"]
-        return sorted(pairs)
-    except Exception:
+        return list(get_policy().pairs)
+    except PolicyError:
         # Fallback to your default universe
         return ["BTC-USD","ETH-USD","SOL-USD","LINK-USD"]
 
@@ -0,0 +1,172 @@
+from __future__ import annotations
+
+import json
+import sqlite3
+from typing import Dict, List, Optional, Tuple
+
+# Balances as a projection of the ledger. Every balance_snapshot row sets its instrument to
+# qty (a set_balances seed, a manual reset of one instrument, or a snapshot written by
+# record_trade / import_trades / rebuild_snapshot_after_last); every trade / transfer /
+# income row adds to it. Both are folded in one (ts, src, id) order starting at the account's
+# first snapshot. Snapshot rows sort after the events with the same ts ("~" > any src), so a
+# snapshot includes what happened at its own ts; events before the first snapshot are part
+# of that seed and never folded.
+#
+# balance_checkpoint keeps the folded state every `every` rows, so "balances as of T" is
+# one index seek to the last checkpoint <= T plus a replay of fewer than `every` rows.
+#
+# Fees reduce the instrument they were paid in (fee_instrument_id, default USD) by fee_qty,
+# as record_trade does; no price lookup is involved, so replays are reproducible.
+
+Key = Tuple[str, str, str]  # (ts, src, id) of the last folded row
+SNAPSHOT = "~"              # src of balance_snapshot rows (id = instrument)
+
+_DDL = (
+    """
+    CREATE TABLE IF NOT EXISTS balance_checkpoint (
+        account_id TEXT NOT NULL,
+        ts         TEXT NOT NULL,      -- key of the last event folded in
+        src        TEXT NOT NULL,
+        ev_id      TEXT NOT NULL,
+        anchor     TEXT NOT NULL,      -- ts of the first snapshot it builds on
+        n          INTEGER NOT NULL,   -- rows folded since the anchor
+        balances   TEXT NOT NULL,      -- JSON {instrument_id: qty}
+        PRIMARY KEY (account_id, ts, src, ev_id)
+    ) WITHOUT ROWID""",
+    "CREATE INDEX IF NOT EXISTS idx_trade_acct_ts ON trade(account_id, ts)",
+    "CREATE INDEX IF NOT EXISTS idx_transfer_from_ts ON transfer(from_account_id, ts)",
+    "CREATE INDEX IF NOT EXISTS idx_transfer_to_ts ON transfer(to_account_id, ts)",
+    "CREATE INDEX IF NOT EXISTS idx_income_acct_ts ON income(account_id, ts)",
+    "CREATE INDEX IF NOT EXISTS idx_balance_snapshot_acct_ts ON balance_snapshot(account_id, ts)",
+)
+
+# One row per balance-changing event: (ts, src, id, instrument, dqty, dusd, fee_instrument, fee_qty);
+# for snapshot rows dqty is the qty the instrument is set to.
+# The ts window is repeated in every branch so each one is an index range scan.
+_EVENTS_SQL = """
+SELECT * FROM (
+    SELECT ts, 't' AS src, id, instrument_id,
+           CASE side WHEN 'buy' THEN qty ELSE -qty END AS dq,
+           CASE side WHEN 'buy' THEN -qty * px ELSE qty * px END AS dusd,
+           COALESCE(fee_instrument_id, 'USD') AS fee_inst, COALESCE(fee_qty, 0) AS fee
+      FROM trade WHERE account_id = :a AND ts >= :lo AND ts <= :hi
+    UNION ALL
+    SELECT ts, 'x', id, instrument_id, -qty, 0, NULL, 0
+      FROM transfer WHERE from_account_id = :a AND ts >= :lo AND ts <= :hi
+    UNION ALL
+    SELECT ts, 'y', id, instrument_id, qty, 0, NULL, 0
+      FROM transfer WHERE to_account_id = :a AND ts >= :lo AND ts <= :hi
+    UNION ALL
+    SELECT ts, 'z', id, instrument_id, qty, 0, NULL, 0
+      FROM income WHERE account_id = :a AND ts >= :lo AND ts <= :hi
+    UNION ALL
+    SELECT ts, '~', instrument_id, instrument_id, qty, 0, NULL, 0
+      FROM balance_snapshot WHERE account_id = :a AND ts >= :lo AND ts <= :hi
+) WHERE (ts, src, id) > (:ts, :src, :id)
+ORDER BY ts, src, id
+"""
+
+_END = "9999-12-31"
+
+
+def ensure_balance_checkpoint(conn: sqlite3.Connection) -> None:
+    for stmt in _DDL:
+        conn.execute(stmt)
+
+
+def apply_event(bal: Dict[str, float], ev: tuple) -> None:
+    _, src, _, inst, dq, dusd, fee_inst, fee = ev
+    if src == SNAPSHOT:
+        bal[inst] = float(dq)
+        return
+    bal[inst] = bal.get(inst, 0.0) + dq
+    if dusd:
+        bal["USD"] = bal.get("USD", 0.0) + dusd
+    if fee:
+        bal[fee_inst] = bal.get(fee_inst, 0.0) - fee
+
+
+class BalanceProjector:
+    def __init__(self, conn: sqlite3.Connection, account: str = "trading", every: int = 256):
+        self.conn = conn
+        self.account = account
+        self.every = int(every)
+        ensure_balance_checkpoint(conn)
+
+    # -- start of the fold
+
+    def anchor(self) -> Optional[str]:
+        """ts of the account's first snapshot; None for an unseeded account."""
+        r = self.conn.execute("SELECT MIN(ts) FROM balance_snapshot WHERE account_id=?", (self.account,)).fetchone()
+        return r[0] if r else None
+
+    def _start_key(self, anchor: str) -> Key:
+        # just before the anchor's snapshot rows, after the events at that ts (part of the seed)
+        return (anchor, SNAPSHOT, "")
+
+    def events(self, after: Key, upto: Optional[str] = None) -> List[tuple]:
+        return self.conn.execute(_EVENTS_SQL, {"a": self.account, "lo": after[0], "hi": upto or _END,
+                                               "ts": after[0], "src": after[1], "id": after[2]}).fetchall()
+
+    # -- checkpoints
+
+    def _last_checkpoint(self, anchor: str, upto: Optional[str] = None):
+        return self.conn.execute(
+            "SELECT ts, src, ev_id, n, balances FROM balance_checkpoint "
+            "WHERE account_id=? AND anchor=? AND ts<=? ORDER BY ts DESC, src DESC, ev_id DESC LIMIT 1",
+            (self.account, anchor, upto or _END)).fetchone()
+
+    def _count(self, after: Key, upto: Key) -> int:
+        return self.conn.execute(
+            f"SELECT COUNT(*) FROM ({_EVENTS_SQL}) WHERE (ts, src, id) <= (:uts, :usrc, :uid)",
+            {"a": self.account, "lo": after[0], "hi": upto[0], "ts": after[0], "src": after[1], "id": after[2],
+             "uts": upto[0], "usrc": upto[1], "uid": upto[2]}).fetchone()[0]
+
+    def refresh(self) -> int:
+        """
+        Fold rows past the last checkpoint, writing a checkpoint every `every` rows.
+        Checkpoints for another anchor, or invalidated by a back-dated event or snapshot (row
+        count up to the last checkpoint no longer matches), are dropped and rebuilt. Returns
+        the number of checkpoints written.
+        """
+        anchor = self.anchor()
+        if anchor is None:
+            return 0
+        start = self._start_key(anchor)
+        bal: Dict[str, float] = {}
+        self.conn.execute("DELETE FROM balance_checkpoint WHERE account_id=? AND anchor<>?", (self.account, anchor))
+        cp = self._last_checkpoint(anchor)
+        key, n = start, 0
+        if cp is not None:
+            if self._count(start, tuple(cp[:3])) == cp[3]:
+                key, n, bal = tuple(cp[:3]), cp[3], json.loads(cp[4])
+            else:
+                self.conn.execute("DELETE FROM balance_checkpoint WHERE account_id=?", (self.account,))
+        rows = []
+        for ev in self.events(key):
+            apply_event(bal, ev)
+            n += 1
+            if n % self.every == 0:
+                rows.append((self.account, ev[0], ev[1], ev[2], anchor, n, json.dumps(bal, sort_keys=True)))
+        if rows:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO balance_checkpoint(account_id,ts,src,ev_id,anchor,n,balances) "
+                "VALUES(?,?,?,?,?,?,?)", rows)
+        self.conn.commit()
+        return len(rows)
+
+    # -- queries
+
+    def as_of(self, ts: Optional[str] = None) -> Dict[str, float]:
+        """Balances after every row with ts <= `ts` (default: all). Read-only."""
+        anchor = self.anchor()
+        if anchor is None or (ts is not None and ts < anchor):
+            return {}
+        key = self._start_key(anchor)
+        bal: Dict[str, float] = {}
+        cp = self._last_checkpoint(anchor, ts)
+        if cp is not None:
+            key, bal = tuple(cp[:3]), json.loads(cp[4])
+        for ev in self.events(key, ts):
+            apply_event(bal, ev)
+        return bal
@@ -0,0 +1,181 @@
+from __future__ import annotations
+
+import copy
+import json
+import math
+import os
+import sqlite3
+from pathlib import Path
+from typing import Any, Dict, Optional, Sequence
+
+import numpy as np
+
+from libs.price_daily import _DAY_SQL, load_daily_matrix
+from libs.prices import symbol_column
+
+ANN_DAYS = 365.0  # crypto trades every day
+
+
+class RollingCov:
+    """Sample covariance (ddof=1) of the last `window` daily return vectors."""
+    kind = "rolling"
+
+    def __init__(self, n: int, window: int = 30):
+        self.window = int(window)
+        self.rets = np.empty((0, n))
+
+    def update(self, r: np.ndarray) -> None:
+        self.rets = np.vstack([self.rets, r])[-self.window:]
+
+    def cov(self) -> Optional[np.ndarray]:
+        if len(self.rets) < 2:
+            return None
+        return np.atleast_2d(np.cov(self.rets, rowvar=False, ddof=1))
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"window": self.window, "rets": self.rets.tolist()}
+
+    @classmethod
+    def from_dict(cls, n: int, d: Dict[str, Any]) -> "RollingCov":
+        est = cls(n, d["window"])
+        if d["rets"]:
+            est.rets = np.asarray(d["rets"], dtype=float).reshape(-1, n)
+        return est
+
+
+class EwmaCov:
+    """RiskMetrics-style EWMA covariance: S = lam * S + (1 - lam) * r r' (zero mean)."""
+    kind = "ewma"
+
+    def __init__(self, n: int, lam: float = 0.94):
+        self.lam = float(lam)
+        self.s = np.zeros((n, n))
+        self.n_obs = 0
+
+    def update(self, r: np.ndarray) -> None:
+        outer = np.outer(r, r)
+        self.s = outer if self.n_obs == 0 else self.lam * self.s + (1.0 - self.lam) * outer
+        self.n_obs += 1
+
+    def cov(self) -> Optional[np.ndarray]:
+        return self.s if self.n_obs >= 2 else None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"lam": self.lam, "s": self.s.tolist(), "n_obs": self.n_obs}
+
+    @classmethod
+    def from_dict(cls, n: int, d: Dict[str, Any]) -> "EwmaCov":
+        est = cls(n, d["lam"])
+        est.s = np.asarray(d["s"], dtype=float).reshape(n, n)
+        est.n_obs = int(d["n_obs"])
+        return est
+
+
+def portfolio_vol(cov: Optional[np.ndarray], weights: Sequence[float], ann_days: float = ANN_DAYS) -> Optional[float]:
+    """Annualized sqrt(w' S w) for daily covariance S; None without an estimate."""
+    if cov is None:
+        return None
+    w = np.asarray(weights, dtype=float)
+    return math.sqrt(max(0.0, float(w @ cov @ w)) * ann_days)
+
+
+class CovarianceCache:
+    """
+    Covariance of daily returns for a fixed symbol list, fed from price_daily and persisted
+    in a JSON file. refresh() reads only the closes after the last completed day it has
+    seen and folds each new return in; today's (still moving) close is applied to a copy,
+    so it is re-read on the next refresh instead of being baked in. The file also keeps
+    MAX(rowid) of price: a row written since then for a day at or before last_date (a
+    backfilled close, or one that completes a day dense() dropped) rebuilds from scratch.
+    """
+
+    def __init__(self, path: str | os.PathLike, symbols: Sequence[str], method: str = "rolling",
+                 window: int = 30, lam: float = 0.94):
+        if method not in ("rolling", "ewma"):
+            raise ValueError(f"unknown covariance method {method!r}")
+        self.path = Path(path)
+        self.symbols = list(symbols)
+        self.method = method
+        self.window = int(window)
+        self.lam = float(lam)
+        self.last_date = ""
+        self.last_px: Optional[np.ndarray] = None
+        self.rowid = 0  # MAX(rowid) of price when last_date was committed
+        self.est = self._fresh()
+        self.current = self.est  # committed days + today's provisional return
+
+    def _fresh(self):
+        n = len(self.symbols)
+        return RollingCov(n, self.window) if self.method == "rolling" else EwmaCov(n, self.lam)
+
+    def _key(self) -> Dict[str, Any]:
+        return {"symbols": self.symbols, "method": self.method, "window": self.window, "lam": self.lam}
+
+    def _load(self) -> None:
+        try:
+            d = json.loads(self.path.read_text(encoding="utf-8"))
+        except (FileNotFoundError, ValueError):
+            return
+        if {k: d.get(k) for k in self._key()} != self._key():
+            return  # universe or parameters changed: start over
+        n = len(self.symbols)
+        cls = RollingCov if self.method == "rolling" else EwmaCov
+        self.est = cls.from_dict(n, d["est"])
+        self.last_date = d["last_date"]
+        self.last_px = np.asarray(d["last_px"], dtype=float) if d["last_px"] is not None else None
+        self.rowid = int(d.get("rowid", 0))
+
+    def _save(self) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        d = {**self._key(), "last_date": self.last_date, "rowid": self.rowid,
+             "last_px": None if self.last_px is None else self.last_px.tolist(), "est": self.est.to_dict()}
+        tmp = self.path.with_name(self.path.name + ".tmp")
+        tmp.write_text(json.dumps(d), encoding="utf-8")
+        os.replace(tmp, self.path)
+
+    @staticmethod
+    def _step(est, prev: Optional[np.ndarray], px: np.ndarray) -> None:
+        if prev is not None and np.all(prev > 0):
+            est.update(px / prev - 1.0)
+
+    def _written_behind(self, conn: sqlite3.Connection) -> bool:
+        """Has a close for a committed day been written since the last save? A rowid range."""
+        col = symbol_column(conn)
+        r = conn.execute(f"SELECT MIN({_DAY_SQL.format(ts='ts')}) FROM price WHERE rowid > ? "
+                         f"AND {col} IN ({','.join('?' * len(self.symbols))})",
+                         (self.rowid, *self.symbols)).fetchone()
+        return r[0] is not None and r[0] <= self.last_date
+
+    def refresh(self, conn: sqlite3.Connection) -> "CovarianceCache":
+        self._load()
+        top = conn.execute("SELECT COALESCE(MAX(rowid), 0) FROM price").fetchone()[0]
+        if self.last_date and self._written_behind(conn):
+            self.est, self.last_date, self.last_px = self._fresh(), "", None
+        m = load_daily_matrix(conn, self.symbols, since=self.last_date).dense()
+        rows = [(d, px) for d, px in zip(m.dates, m.px) if d > self.last_date]
+        if not self.last_date and self.method == "rolling":
+            rows = rows[-(self.window + 2):]  # a cold rolling start only needs the window
+        committed, today = rows[:-1], rows[-1:]
+        for d, px in committed:
+            self._step(self.est, self.last_px, px)
+            self.last_date, self.last_px = d, px
+        if committed:
+            self.rowid = top
+            self._save()
+        self.current = self.est
+        if today:
+            self.current = copy.deepcopy(self.est)
+            self._step(self.current, self.last_px, today[0][1])
+        return self
+
+    def cov(self) -> Optional[np.ndarray]:
+        return self.current.cov()
+
+    def portfolio_vol(self, weights: Dict[str, float]) -> Optional[float]:
+        return portfolio_vol(self.cov(), [weights.get(s, 0.0) for s in self.symbols])
+
+    def vols(self) -> Dict[str, float]:
+        c = self.cov()
+        if c is None:
+            return {}
+        return {s: math.sqrt(max(0.0, c[i, i]) * ANN_DAYS) for i, s in enumerate(self.symbols)}
@@ -2,8 +2,11 @@ from __future__ import annotations
 
 import os
 import sqlite3
+import threading
+import time
+from contextlib import contextmanager
 from pathlib import Path
-from typing import Optional
+from typing import Any, Dict, Iterator, List, Optional
 
 # Repo root: .../crypto-ops
 BASE_DIR: Path = Path(__file__).resolve().parents[1]
@@ -12,17 +15,182 @@ BASE_DIR: Path = Path(__file__).resolve().parents[1]
 DEFAULT_DB_PATH: Path = BASE_DIR / "data" / "ledger.db"
 
 
+# Applied once per connection. journal_mode is persistent in the file; the rest are per
+# connection. NORMAL is durable against corruption in WAL mode (a power loss can drop the
+# last commits, never tear the file).
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL;",
+    "PRAGMA synchronous=NORMAL;",
+    "PRAGMA foreign_keys=ON;",
+    "PRAGMA busy_timeout=5000;",
+    "PRAGMA mmap_size=268435456;",   # 256 MiB
+    "PRAGMA cache_size=-16384;",     # 16 MiB
+    "PRAGMA temp_store=MEMORY;",
+)
+
+# sqlite3 keeps this many prepared statements per connection (default 128)
+CACHED_STATEMENTS = 256
+
+
+def _connect(path: Path, **kw: Any) -> sqlite3.Connection:
+    conn = sqlite3.connect(path.as_posix(), timeout=30, cached_statements=CACHED_STATEMENTS, **kw)
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+
 def get_conn(db_path: Optional[str | os.PathLike] = None) -> sqlite3.Connection:
     """
     Return a sqlite3 connection. Ensures parent folder exists.
     Use env CRYPTOOPS_DB or DEFAULT_DB_PATH if not provided.
+    For long-lived processes prefer get_manager(path).reader()/.writer().
     """
     path = Path(db_path or os.environ.get("CRYPTOOPS_DB", DEFAULT_DB_PATH))
     path.parent.mkdir(parents=True, exist_ok=True)
-    conn = sqlite3.connect(path.as_posix())
-    conn.execute("PRAGMA journal_mode=WAL;")
-    conn.execute("PRAGMA foreign_keys=ON;")
-    return conn
+    return _connect(path)
+
+
+class ConnectionManager:
+    """
+    Connection reuse for one SQLite file in a threaded process (FastAPI workers).
+
+    reader() hands each thread its own connection, opened on first use and kept.
+    writer() is a context manager around a single shared connection; callers queue on a
+    lock, and the block commits on success and rolls back on error. Both kinds get the
+    PRAGMAS and a prepared-statement cache once, at open. replace_file() swaps the DB
+    file underneath (e.g. a fresh ledger download): it closes the writer and bumps the
+    generation; a reader thread keeps its open handle (and any query in flight on it) on
+    the old file until its next reader() call, where it closes that handle itself and
+    reopens. SQLite skips the checkpoint-on-close for a file that was replaced, so a late
+    close never touches the new file's WAL.
+    """
+
+    def __init__(self, path: str | os.PathLike):
+        self.path = Path(path)
+        self._lock = threading.Lock()      # guards the registry + counters
+        self._wlock = threading.Lock()     # serializes writers
+        self._local = threading.local()
+        self._generation = 0
+        self._conns: List[sqlite3.Connection] = []
+        self._writer: Optional[sqlite3.Connection] = None
+        self.reader_hits = 0
+        self.reader_misses = 0
+        self.writer_waits = 0
+        self.writer_wait_ms_total = 0.0
+        self.writer_wait_ms_max = 0.0
+
+    def _open(self) -> sqlite3.Connection:
+        if not self.path.exists():
+            raise RuntimeError(f"LEDGER_DB not found at {self.path}")
+        with self._lock:  # not while replace_file() is swapping the file and its -wal/-shm
+            conn = _connect(self.path, check_same_thread=False)
+            self._conns.append(conn)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def _discard(self, conn: sqlite3.Connection) -> None:
+        with self._lock:
+            if conn in self._conns:
+                self._conns.remove(conn)
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def reader(self) -> sqlite3.Connection:
+        cached = getattr(self._local, "conn", None)
+        gen = self._generation
+        if cached is not None and cached[0] == gen:
+            with self._lock:
+                self.reader_hits += 1
+            return cached[1]
+        if cached is not None:
+            self._discard(cached[1])  # this thread's handle on a replaced file
+        conn = self._open()
+        self._local.conn = (gen, conn)
+        with self._lock:
+            self.reader_misses += 1
+        return conn
+
+    @contextmanager
+    def writer(self) -> Iterator[sqlite3.Connection]:
+        t0 = time.perf_counter()
+        with self._wlock:
+            waited = (time.perf_counter() - t0) * 1000.0
+            with self._lock:
+                self.writer_waits += 1
+                self.writer_wait_ms_total += waited
+                self.writer_wait_ms_max = max(self.writer_wait_ms_max, waited)
+            if self._writer is None:
+                self._writer = self._open()
+            conn = self._writer
+            try:
+                yield conn
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                raise
+
+    def checkpoint(self) -> None:
+        """Fold the WAL into the main file (before copying/uploading the .db alone)."""
+        with self.writer() as conn:
+            conn.commit()
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE);").fetchall()
+
+    def close_all(self) -> None:
+        """Close every pooled connection (shutdown); readers must be idle."""
+        with self._wlock:
+            with self._lock:
+                self._generation += 1
+                conns, self._conns, self._writer = self._conns, [], None
+            for conn in conns:
+                try:
+                    conn.close()
+                except Exception:
+                    pass
+
+    def replace_file(self, src: str | os.PathLike) -> None:
+        """Atomically put `src` in place of the DB; stale -wal/-shm go with the old file."""
+        with self._wlock:
+            # holding _wlock: no writer is mid-transaction
+            if self._writer is not None:
+                self._discard(self._writer)
+                self._writer = None
+            with self._lock:
+                os.replace(src, self.path)
+                for suffix in ("-wal", "-shm"):
+                    try:
+                        os.remove(self.path.as_posix() + suffix)
+                    except FileNotFoundError:
+                        pass
+                self._generation += 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "path": str(self.path),
+            "generation": self._generation,
+            "open_connections": len(self._conns),
+            "reader_hits": self.reader_hits,
+            "reader_misses": self.reader_misses,
+            "writer_waits": self.writer_waits,
+            "writer_wait_ms_total": round(self.writer_wait_ms_total, 3),
+            "writer_wait_ms_max": round(self.writer_wait_ms_max, 3),
+        }
+
+
+_MANAGERS: Dict[str, ConnectionManager] = {}
+_MANAGERS_LOCK = threading.Lock()
+
+
+def get_manager(db_path: Optional[str | os.PathLike] = None) -> ConnectionManager:
+    """Process-wide manager for a DB path (default: LEDGER_DB, then CRYPTOOPS_DB/DEFAULT_DB_PATH)."""
+    raw = db_path or os.environ.get("LEDGER_DB") or os.environ.get("CRYPTOOPS_DB", DEFAULT_DB_PATH)
+    key = os.path.abspath(raw)
+    mgr = _MANAGERS.get(key)
+    if mgr is None:
+        with _MANAGERS_LOCK:
+            mgr = _MANAGERS.setdefault(key, ConnectionManager(key))
+    return mgr
 
 
 def apply_schema(conn: Optional[sqlite3.Connection] = None) -> None:
@@ -102,6 +270,8 @@ def apply_schema(conn: Optional[sqlite3.Connection] = None) -> None:
             """
         )
         conn.commit()
+        from libs.price_daily import ensure_price_daily  # imports libs.db
+        ensure_price_daily(conn)
     finally:
         if owns_conn:
             conn.close()
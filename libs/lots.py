@@ -0,0 +1,185 @@
+from __future__ import annotations
+
+import heapq
+import sqlite3
+import uuid
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Sequence, Tuple
+
+METHODS = ("FIFO", "LIFO", "HIFO")
+EPS = 1e-12       # remaining below this is a closed lot (written back as exactly 0)
+SHORT_TOL = 1e-9  # sells may exceed open lots by this much (float noise)
+
+# Open lots only: matching never reads closed rows, however many accumulate.
+LOT_INDEX_SQL = ("CREATE INDEX IF NOT EXISTS idx_lot_open ON lot(account_id, instrument_id, open_ts) "
+                 "WHERE remaining_qty > 0")
+
+
+class LotError(ValueError):
+    """A sell cannot be matched against open lots."""
+
+
+@dataclass
+class Fill:
+    account: str
+    symbol: str
+    side: str                     # "buy" | "sell"
+    qty: float
+    px: float
+    ts: str
+    trade_id: str = ""
+    fee_usd: float = 0.0          # whole fee valued in USD (raises cost / lowers proceeds)
+    fee_in_kind: float = 0.0      # buy fee paid in the bought asset (shrinks the lot)
+    lot_ids: Sequence[str] = ()   # sells: specific lots to consume, in order (spec-ID)
+
+
+@dataclass
+class FillResult:
+    trade_id: str
+    lot_id: Optional[str] = None                                             # buys: lot opened
+    matched: List[Tuple[str, float, float, float]] = field(default_factory=list)  # (lot, qty, proceeds, gain)
+    realized: float = 0.0
+
+
+class LotBook:
+    """Open lots of one (account, instrument), heap-ordered for the matching method."""
+
+    def __init__(self, method: str):
+        if method not in METHODS:
+            raise ValueError(f"unknown lot method {method!r}")
+        self.method = method
+        self._heap: List[list] = []
+        self.lots: Dict[str, list] = {}  # id -> [key, ordinal, id, remaining, open_px]
+        self._n = 0
+
+    def _key(self, ordinal: int, open_px: float):
+        if self.method == "FIFO":
+            return ordinal
+        if self.method == "LIFO":
+            return -ordinal
+        return -open_px  # HIFO; ties fall back to the ordinal (oldest first)
+
+    def add(self, lot_id: str, remaining: float, open_px: float) -> None:
+        """Lots must be added oldest first."""
+        e = [self._key(self._n, open_px), self._n, lot_id, float(remaining), float(open_px)]
+        self._n += 1
+        self.lots[lot_id] = e
+        heapq.heappush(self._heap, e)
+
+    def open_qty(self) -> float:
+        return sum(e[3] for e in self.lots.values())
+
+    def _consume(self, e: list, want: float, out: List[Tuple[str, float, float]]) -> float:
+        take = min(want, e[3])
+        e[3] -= take
+        if e[3] <= EPS:
+            e[3] = 0.0
+            self.lots.pop(e[2], None)  # its heap entry is skipped lazily
+        out.append((e[2], take, e[4]))
+        return want - take
+
+    def take(self, qty: float, lot_ids: Sequence[str] = ()) -> List[Tuple[str, float, float]]:
+        """Consume `qty`: (lot_id, qty taken, open_px) in matching order."""
+        out: List[Tuple[str, float, float]] = []
+        want = float(qty)
+        if lot_ids:
+            for lid in lot_ids:
+                if want <= SHORT_TOL:
+                    break
+                e = self.lots.get(lid)
+                if e is None:
+                    raise LotError(f"lot {lid} is not open")
+                want = self._consume(e, want, out)
+        else:
+            while want > SHORT_TOL and self._heap:
+                e = self._heap[0]
+                if e[3] <= 0.0:
+                    heapq.heappop(self._heap)
+                    continue
+                want = self._consume(e, want, out)
+                if e[3] <= 0.0:
+                    heapq.heappop(self._heap)
+        if want > SHORT_TOL:
+            raise LotError("Not enough lot quantity to match this sale.")
+        return out
+
+
+class LotEngine:
+    """
+    Lot accounting for a batch of fills in one transaction. Open lots are read once per
+    (account, instrument) through the partial index and matched in memory; lot inserts,
+    lot_event inserts and remaining_qty updates go out as three executemany calls at the end.
+    The caller owns the transaction (commit after apply(), together with its trade rows).
+    """
+
+    def __init__(self, conn: sqlite3.Connection, method: str = "HIFO"):
+        method = method.upper()
+        if method not in METHODS:
+            raise ValueError(f"unknown lot method {method!r} (use one of {', '.join(METHODS)})")
+        self.conn = conn
+        self.method = method
+        self._books: Dict[Tuple[str, str], LotBook] = {}
+        conn.execute(LOT_INDEX_SQL)
+
+    def book(self, account: str, symbol: str) -> LotBook:
+        key = (account, symbol)
+        b = self._books.get(key)
+        if b is None:
+            b = self._books[key] = LotBook(self.method)
+            rows = self.conn.execute(
+                "SELECT id, remaining_qty, open_px FROM lot INDEXED BY idx_lot_open "
+                "WHERE account_id=? AND instrument_id=? AND remaining_qty > 0 ORDER BY open_ts, rowid",
+                key,
+            ).fetchall()
+            for lid, rem, px in rows:
+                b.add(lid, rem, px)
+        return b
+
+    def apply(self, fills: Sequence[Fill]) -> List[FillResult]:
+        new_lots: List[tuple] = []
+        events: List[tuple] = []
+        touched: Dict[str, list] = {}
+        results: List[FillResult] = []
+        try:
+            for f in fills:
+                res = FillResult(f.trade_id)
+                b = self.book(f.account, f.symbol)
+                if f.side == "buy":
+                    open_qty = max(0.0, f.qty - f.fee_in_kind)
+                    open_px = (f.px * f.qty + f.fee_usd) / f.qty if f.qty > 0 else f.px
+                    res.lot_id = "lot_" + uuid.uuid4().hex
+                    new_lots.append((res.lot_id, f.ts, f.account, f.symbol, open_qty, open_px, open_qty))
+                    b.add(res.lot_id, open_qty, open_px)
+                elif f.side == "sell":
+                    if not b.lots:
+                        raise LotError("No open lots to match this sale. Seed lots first.")
+                    fee_per_unit = f.fee_usd / f.qty if f.qty > 0 else 0.0
+                    for lid, take, open_px in b.take(f.qty, f.lot_ids):
+                        proceeds = (f.px - fee_per_unit) * take
+                        gl = proceeds - open_px * take
+                        events.append(("le_" + uuid.uuid4().hex, f.ts, lid, f.trade_id, take, proceeds, gl))
+                        res.matched.append((lid, take, proceeds, gl))
+                        res.realized += gl
+                        touched[lid] = b.lots.get(lid) or [None, None, lid, 0.0, open_px]
+                else:
+                    raise LotError(f"unknown side {f.side!r}")
+                results.append(res)
+        except Exception:
+            self._books.clear()  # in-memory books ran ahead of the DB; reload on next use
+            raise
+
+        opened = {r[0] for r in new_lots}
+        if new_lots:
+            # lots opened and consumed within this batch are inserted with their final remaining
+            final = {lid: e[3] for lid, e in touched.items()}
+            new_lots = [r[:6] + (final.get(r[0], r[6]),) for r in new_lots]
+            self.conn.executemany(
+                "INSERT INTO lot(id,open_ts,account_id,instrument_id,open_qty,open_px,remaining_qty) "
+                "VALUES(?,?,?,?,?,?,?)", new_lots)
+        if events:
+            self.conn.executemany(
+                "INSERT INTO lot_event(id,ts,lot_id,trade_id,qty,proceeds,gain_loss) VALUES(?,?,?,?,?,?,?)", events)
+        updates = [(e[3], lid) for lid, e in touched.items() if lid not in opened]
+        if updates:
+            self.conn.executemany("UPDATE lot SET remaining_qty=? WHERE id=?", updates)
+        return results
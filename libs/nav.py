@@ -0,0 +1,263 @@
+from __future__ import annotations
+
+import copy
+import json
+import math
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from libs.db import DEFAULT_DB_PATH
+from libs.prices import symbol_column
+
+# Historical NAV from the ledger: balance_snapshot (holdings) and price (quotes) are both read
+# once in ts order and merged against a grid of bucket closes, so every point is
+# sum(qty as of t * px as of t) with no per-point lookups. A point is labelled with its
+# bucket start and valued as of the bucket end (exclusive): a daily point is the close.
+# Buckets where a held instrument has no price yet are skipped.
+
+RESOLUTIONS = {"hourly": 3600, "daily": 86400}
+
+# epoch seconds for both ts flavours (INTEGER epoch / TEXT 'YYYY-MM-DD HH:MM:SS[.ffffff]' UTC)
+EPOCH_SQL = "CASE WHEN typeof(ts) IN ('integer','real') THEN CAST(ts AS INTEGER) ELSE CAST(strftime('%s', ts) AS INTEGER) END"
+
+Row = Tuple[int, str, float]
+
+
+def _bound(conn: sqlite3.Connection, table: str, epoch: int) -> Any:
+    """`epoch` in the type the table stores ts in, so `ts >= ?` stays an index range."""
+    r = conn.execute(f"SELECT typeof(ts) FROM {table} LIMIT 1").fetchone()
+    if r and r[0] in ("integer", "real"):
+        return epoch
+    return time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(epoch))
+
+
+def _snapshots(conn: sqlite3.Connection, account: str, after: Optional[int]) -> List[Row]:
+    sql = f"SELECT {EPOCH_SQL} AS t, instrument_id, qty FROM balance_snapshot WHERE account_id=?"
+    args: Tuple[Any, ...] = (account,)
+    if after is not None:
+        sql += " AND ts >= ?"
+        args += (_bound(conn, "balance_snapshot", after),)
+    return conn.execute(sql + " ORDER BY t", args).fetchall()
+
+
+def _prices(conn: sqlite3.Connection, symbols: Sequence[str], after: Optional[int]) -> List[Row]:
+    if not symbols:
+        return []
+    col = symbol_column(conn)
+    sql = (f"SELECT {EPOCH_SQL} AS t, {col}, px FROM price "
+           f"WHERE {col} IN ({','.join('?' * len(symbols))}) AND px IS NOT NULL")
+    args: Tuple[Any, ...] = tuple(symbols)
+    if after is not None:
+        sql += " AND ts >= ?"
+        args += (_bound(conn, "price", after),)
+    return conn.execute(sql + " ORDER BY t", args).fetchall()
+
+
+def _last_px(conn: sqlite3.Connection, symbol: str, before: int) -> Optional[float]:
+    col = symbol_column(conn)
+    r = conn.execute(f"SELECT px FROM price WHERE {col}=? AND ts < ? AND px IS NOT NULL ORDER BY ts DESC LIMIT 1",
+                     (symbol, _bound(conn, "price", before))).fetchone()
+    return float(r[0]) if r else None
+
+
+def _stamp(conn: sqlite3.Connection) -> List[int]:
+    """MAX(rowid) of balance_snapshot and price: rows written later have a larger one."""
+    return [int(conn.execute(f"SELECT COALESCE(MAX(rowid), 0) FROM {t}").fetchone()[0])
+            for t in ("balance_snapshot", "price")]
+
+
+def _written_since(conn: sqlite3.Connection, account: str, symbols: Sequence[str],
+                   stamp: Sequence[int]) -> Optional[int]:
+    """Earliest ts among the rows inserted (or replaced) after `stamp`; a rowid range, not a scan."""
+    firsts = [conn.execute(f"SELECT MIN({EPOCH_SQL}) FROM balance_snapshot WHERE rowid > ? AND account_id=?",
+                           (stamp[0], account)).fetchone()[0]]
+    if symbols:
+        col = symbol_column(conn)
+        firsts.append(conn.execute(
+            f"SELECT MIN({EPOCH_SQL}) FROM price WHERE rowid > ? AND {col} IN ({','.join('?' * len(symbols))})"
+            " AND px IS NOT NULL", (stamp[1], *symbols)).fetchone()[0])
+    firsts = [int(t) for t in firsts if t is not None]
+    return min(firsts) if firsts else None
+
+
+def _state_at(conn: sqlite3.Connection, account: str, t: int) -> NavState:
+    """Holdings and last prices as of `t` (exclusive), read back from the ledger."""
+    st = NavState()
+    st.t = t
+    rows = conn.execute("SELECT instrument_id, MAX(ts), qty FROM balance_snapshot "
+                        "WHERE account_id=? AND ts < ? GROUP BY instrument_id",
+                        (account, _bound(conn, "balance_snapshot", t))).fetchall()
+    st.qty = {inst: float(q) for inst, _, q in rows}
+    for sym in set(st.qty) - {"USD"}:
+        px = _last_px(conn, sym, t)
+        if px is not None:
+            st.px[sym] = px
+    return st
+
+
+class NavState:
+    """Holdings and last prices as of `t` (exclusive), plus the merge cursor."""
+
+    def __init__(self):
+        self.t: Optional[int] = None
+        self.qty: Dict[str, float] = {}
+        self.px: Dict[str, float] = {"USD": 1.0}
+
+    def nav(self) -> Optional[float]:
+        total = 0.0
+        for inst, q in self.qty.items():
+            if q == 0.0:
+                continue
+            p = self.px.get(inst)
+            if p is None:
+                return None
+            total += q * p
+        return total
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"t": self.t, "qty": self.qty, "px": self.px}
+
+    @classmethod
+    def from_dict(cls, d: Dict[str, Any]) -> "NavState":
+        st = cls()
+        st.t, st.qty, st.px = d["t"], dict(d["qty"]), dict(d["px"])
+        return st
+
+
+def merge(state: NavState, snaps: Sequence[Row], prices: Sequence[Row], step: int,
+          end: int) -> List[Tuple[int, float]]:
+    """
+    Advance `state` over bucket closes up to `end` (exclusive), consuming the ts-sorted rows
+    in one pass. Rows before state.t are ignored. Returns the (bucket start, nav) points.
+    """
+    out: List[Tuple[int, float]] = []
+    if state.t is None:
+        if not snaps:
+            return out  # nothing held yet; stay at the start
+        state.t = (snaps[0][0] // step) * step
+    i = j = 0
+    t = state.t
+    while t + step <= end:
+        close = t + step
+        # rows before the cursor (quotes preceding the first snapshot, or rows the state has
+        # already seen) replay to the same last value, so the two loops need no separate skip
+        while i < len(snaps) and snaps[i][0] < close:
+            state.qty[snaps[i][1]] = float(snaps[i][2]); i += 1
+        while j < len(prices) and prices[j][0] < close:
+            state.px[prices[j][1]] = float(prices[j][2]); j += 1
+        v = state.nav()
+        if v is not None:
+            out.append((t, v))
+        t = close
+    state.t = t
+    return out
+
+
+def nav_series(conn: sqlite3.Connection, account: str = "trading", step: int = 86400,
+               now: Optional[int] = None) -> List[Tuple[int, float]]:
+    """Full history, closed buckets plus the current one as of `now`; no caching."""
+    now = int(now if now is not None else time.time())
+    snaps = _snapshots(conn, account, None)
+    prices = _prices(conn, sorted({r[1] for r in snaps} - {"USD"}), None)
+    st = NavState()
+    return merge(st, snaps, prices, step, (now // step + 1) * step)
+
+
+class NavCache:
+    """
+    nav_series kept in a JSON file and extended incrementally: refresh() reads only rows at
+    or after the first open bucket, folds the buckets that have closed since, and values the
+    current bucket on a copy so it is recomputed next time. Rows inserted behind the cursor
+    (back-filled closes, late snapshots) are found by rowid and the buckets from the earliest
+    one on are rebuilt; rows updated in place still need full=True. One instance may be
+    shared by threads: refreshes run one at a time and readers see either the old or the
+    new series, never a mix.
+    """
+
+    def __init__(self, path: str | os.PathLike, account: str = "trading", step: int = 86400):
+        self.path = Path(path)
+        self.account = account
+        self.step = int(step)
+        self.state = NavState()
+        self.points: List[Tuple[int, float]] = []  # closed buckets
+        self.current: Optional[Tuple[int, float]] = None
+        self._lock = threading.Lock()  # one refresh at a time
+        self._published: Tuple[List[Tuple[int, float]], Optional[Tuple[int, float]]] = ([], None)
+
+    def _load(self) -> Tuple[NavState, List[Tuple[int, float]], Optional[List[int]]]:
+        try:
+            d = json.loads(self.path.read_text(encoding="utf-8"))
+        except (FileNotFoundError, ValueError):
+            return NavState(), [], None
+        if d.get("account") != self.account or d.get("step") != self.step or "stamp" not in d:
+            return NavState(), [], None
+        return NavState.from_dict(d["state"]), [tuple(p) for p in d["points"]], d["stamp"]
+
+    def _save(self, state: NavState, points: List[Tuple[int, float]], stamp: List[int]) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        d = {"account": self.account, "step": self.step, "state": state.to_dict(), "points": points,
+             "stamp": stamp}
+        tmp = self.path.with_name(f"{self.path.name}.{os.getpid()}.tmp")  # the service and health checks share it
+        tmp.write_text(json.dumps(d), encoding="utf-8")
+        os.replace(tmp, self.path)
+
+    def refresh(self, conn: sqlite3.Connection, now: Optional[int] = None, full: bool = False) -> "NavCache":
+        now = int(now if now is not None else time.time())
+        with self._lock:
+            stamp = _stamp(conn)  # before reading, so rows racing this refresh are checked next time
+            state, points, seen = (NavState(), [], None) if full else self._load()
+            if state.t is not None and seen is not None:
+                first = _written_since(conn, self.account, sorted(set(state.qty) - {"USD"}), seen)
+                if first is not None and first < state.t:  # back-dated: rebuild from its bucket on
+                    start = (first // self.step) * self.step
+                    if points and points[0][0] < start:
+                        state = _state_at(conn, self.account, start)
+                        points = [p for p in points if p[0] < start]
+                    else:
+                        state, points = NavState(), []
+            after = state.t
+            snaps = _snapshots(conn, self.account, after)
+            held = set(state.qty) | {r[1] for r in snaps}
+            if after is not None:
+                for sym in held - set(state.px):  # first held since the cursor: last quote before it
+                    px = _last_px(conn, sym, after)
+                    if px is not None:
+                        state.px[sym] = px
+            prices = _prices(conn, sorted(held - {"USD"}), after)
+            open_start = (now // self.step) * self.step
+            closed = merge(state, snaps, prices, self.step, open_start)
+            points.extend(closed)
+            if closed or after is None or full:
+                self._save(state, points, stamp)
+            tmp = copy.deepcopy(state)
+            cur = merge(tmp, snaps, prices, self.step, open_start + self.step)
+            current = cur[-1] if cur else None
+            self.state, self.points, self.current = state, points, current
+            self._published = (points, current)  # what series() reads, swapped in one assignment
+        return self
+
+    def series(self) -> List[Tuple[int, float]]:
+        points, current = self._published
+        return points + ([current] if current else [])
+
+    def window(self, since_ts: int) -> List[Dict[str, float]]:
+        return [{"ts": t, "nav": v} for t, v in self.series() if t >= since_ts]
+
+
+def max_drawdown(navs: Sequence[float]) -> float:
+    mdd, peak = 0.0, -math.inf
+    for v in navs:
+        peak = max(peak, v)
+        if peak > 0:
+            mdd = min(mdd, v / peak - 1.0)
+    return mdd
+
+
+def nav_cache_path(account: str, resolution: str, db_path: Optional[str | os.PathLike] = None) -> Path:
+    """NavCache file next to the ledger it is built from (default CRYPTOOPS_DB / data/ledger.db)."""
+    db = Path(db_path or os.environ.get("CRYPTOOPS_DB", DEFAULT_DB_PATH))
+    return db.with_name(f"{db.name}.nav.{account}.{resolution}.json")
@@ -0,0 +1,190 @@
+from __future__ import annotations
+
+import argparse
+import sqlite3
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from libs.db import get_conn
+from libs.prices import symbol_column
+
+# price_daily is built by the writers (ensure_price_daily: ingest, apply_schema, or
+# `python -m libs.price_daily`); the loaders below only read, and fall back to grouping the
+# raw ticks on a DB where it hasn't been built yet.
+
+# UTC day of a tick: TEXT ts ('YYYY-MM-DD HH:MM:SS', schema/schema.sql) or INTEGER epoch
+# seconds (libs/db.apply_schema / service ingest).
+_DAY_SQL = "CASE WHEN typeof({ts}) IN ('integer','real') THEN date({ts},'unixepoch') ELSE substr({ts},1,10) END"
+
+TRIGGER_NAMES = ("trg_price_daily_ins", "trg_price_daily_upd")
+
+
+def _ddl(symcol: str) -> List[str]:
+    day = _DAY_SQL.format(ts="NEW.ts")
+    upsert = f"""
+        INSERT INTO price_daily(symbol, d, ts, px) VALUES (NEW.{symcol}, {day}, NEW.ts, NEW.px)
+        ON CONFLICT(symbol, d) DO UPDATE SET ts = excluded.ts, px = excluded.px
+        WHERE excluded.ts >= price_daily.ts;"""
+    guard = f"WHEN NEW.{symcol} IS NOT NULL AND NEW.px IS NOT NULL"
+    return [
+        """
+        CREATE TABLE IF NOT EXISTS price_daily (
+            symbol TEXT NOT NULL,
+            d      TEXT NOT NULL,      -- UTC day, YYYY-MM-DD
+            ts     NOT NULL,           -- ts of the closing tick (same type as price.ts)
+            px     REAL NOT NULL,
+            PRIMARY KEY (symbol, d)
+        ) WITHOUT ROWID""",
+        f"CREATE TRIGGER IF NOT EXISTS {TRIGGER_NAMES[0]} AFTER INSERT ON price {guard} BEGIN{upsert} END",
+        f"CREATE TRIGGER IF NOT EXISTS {TRIGGER_NAMES[1]} AFTER UPDATE OF px ON price {guard} BEGIN{upsert} END",
+    ]
+
+
+def rebuild_price_daily(conn: sqlite3.Connection) -> int:
+    """Recompute every daily close from the tick table (after deletes or bulk repairs)."""
+    symcol = symbol_column(conn)
+    day = _DAY_SQL.format(ts="ts")
+    conn.execute("DELETE FROM price_daily")
+    # bare-column rule: px comes from the MAX(ts) row of each (symbol, day)
+    cur = conn.execute(f"""
+        INSERT INTO price_daily(symbol, d, ts, px)
+        SELECT {symcol}, d, ts, px FROM (
+            SELECT {symcol}, {day} AS d, MAX(ts) AS ts, px
+            FROM price WHERE {symcol} IS NOT NULL AND px IS NOT NULL
+            GROUP BY {symcol}, d
+        )
+    """)
+    return cur.rowcount
+
+
+def has_price_daily(conn: sqlite3.Connection) -> bool:
+    """True if price_daily and both triggers exist (so the table is current)."""
+    names = {r[0] for r in conn.execute(
+        "SELECT name FROM sqlite_master WHERE type IN ('table','trigger') AND name IN (?,?,?)",
+        ("price_daily",) + TRIGGER_NAMES,
+    )}
+    return len(names) == 3
+
+
+def ensure_price_daily(conn: sqlite3.Connection) -> bool:
+    """
+    Create price_daily and its triggers if missing, backfilling from existing ticks in the
+    same transaction so no insert can slip between backfill and trigger. Returns True if
+    it had to build the table. Writer paths only: it takes the write lock when it builds.
+    """
+    if has_price_daily(conn):
+        return False
+    in_tx = conn.in_transaction
+    if not in_tx:
+        conn.execute("BEGIN IMMEDIATE")
+    try:
+        for stmt in _ddl(symbol_column(conn)):
+            conn.execute(stmt)
+        rebuild_price_daily(conn)
+        if not in_tx:
+            conn.execute("COMMIT")
+    except Exception:
+        if not in_tx:
+            conn.execute("ROLLBACK")
+        raise
+    return True
+
+
+@dataclass
+class DailyMatrix:
+    """Daily closes: px[i, j] is symbols[j] on dates[i]; NaN where a symbol has no tick."""
+    dates: List[str]
+    symbols: List[str]
+    px: np.ndarray
+
+    def col(self, symbol: str) -> int:
+        return self.symbols.index(symbol)
+
+    def dense(self, days: int = 0) -> "DailyMatrix":
+        """Rows where every symbol has a close, last `days` of them (0 = all)."""
+        keep = np.flatnonzero(~np.isnan(self.px).any(axis=1))
+        if days > 0:
+            keep = keep[-days:]
+        return DailyMatrix([self.dates[i] for i in keep], list(self.symbols), self.px[keep])
+
+    def series(self, symbol: str, points: int = 0) -> Tuple[List[str], List[float]]:
+        """One symbol's own closes (its gaps skipped), last `points` of them (0 = all)."""
+        j = self.col(symbol)
+        idx = np.flatnonzero(~np.isnan(self.px[:, j]))
+        if points > 0:
+            idx = idx[-points:]
+        return [self.dates[i] for i in idx], self.px[idx, j].tolist()
+
+    def rows(self) -> List[Tuple[str, Dict[str, float]]]:
+        """[(date, {symbol: px})] — the shape the research loops iterate over."""
+        return [(d, dict(zip(self.symbols, row))) for d, row in zip(self.dates, self.px.tolist())]
+
+
+def _closes_sql(conn: sqlite3.Connection, where: str) -> str:
+    """SELECT d, symbol, px of daily closes: price_daily, or the same grouping over raw ticks."""
+    if has_price_daily(conn):
+        return f"SELECT d, symbol, px FROM price_daily WHERE {where}"
+    symcol = symbol_column(conn)
+    return f"""
+        SELECT d, symbol, px FROM (
+            SELECT {symcol} AS symbol, {_DAY_SQL.format(ts="ts")} AS d, MAX(ts) AS ts, px
+            FROM price WHERE {symcol} IS NOT NULL AND px IS NOT NULL
+            GROUP BY {symcol}, d
+        ) WHERE {where}"""
+
+
+def load_daily_matrix(conn: sqlite3.Connection, symbols: Sequence[str], since: str = "") -> DailyMatrix:
+    """Date x symbol close matrix in one read-only query (dates ascending)."""
+    syms = list(dict.fromkeys(symbols))
+    if not syms:
+        return DailyMatrix([], [], np.empty((0, 0)))
+    ph = ",".join("?" * len(syms))
+    rows = conn.execute(
+        _closes_sql(conn, f"symbol IN ({ph}) AND d >= ?") + " ORDER BY d",
+        (*syms, since),
+    ).fetchall()
+    dates: List[str] = []
+    row_of: Dict[str, int] = {}
+    for r in rows:
+        if r[0] not in row_of:
+            row_of[r[0]] = len(dates)
+            dates.append(r[0])
+    px = np.full((len(dates), len(syms)), np.nan)
+    col = {s: j for j, s in enumerate(syms)}
+    for d, s, v in rows:
+        px[row_of[d], col[s]] = v
+    return DailyMatrix(dates, syms, px)
+
+
+def daily_closes(conn: sqlite3.Connection, symbol: str, points: int) -> List[Tuple[str, float]]:
+    """Last `points` (date, close) pairs for one symbol, ascending; an index range scan
+    once price_daily exists."""
+    rows = conn.execute(
+        _closes_sql(conn, "symbol=?") + " ORDER BY d DESC LIMIT ?",
+        (symbol, max(0, int(points))),
+    ).fetchall()
+    return [(r[0], r[2]) for r in reversed(rows)]
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    ap = argparse.ArgumentParser(description="Build (or rebuild) the price_daily close table and its triggers")
+    ap.add_argument("--db", default=None, help="default CRYPTOOPS_DB / data/ledger.db")
+    ap.add_argument("--rebuild", action="store_true", help="recompute every close from the ticks")
+    args = ap.parse_args(argv)
+    conn = get_conn(args.db)
+    try:
+        built = ensure_price_daily(conn)
+        if args.rebuild and not built:
+            with conn:
+                rebuild_price_daily(conn)
+        n = conn.execute("SELECT COUNT(*) FROM price_daily").fetchone()[0]
+    finally:
+        conn.close()
+    print(f"price_daily: {n} closes" + (" (built)" if built else ""))
+
+
+if __name__ == "__main__":
+    main()
+
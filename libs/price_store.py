@@ -0,0 +1,215 @@
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import sqlite3
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+from urllib.parse import quote, unquote
+
+import numpy as np
+
+from libs.db import BASE_DIR, get_conn
+from libs.price_daily import DailyMatrix, load_daily_matrix
+from libs.prices import db_token, symbol_column
+
+# Columnar copy of the `price` table for research reads:
+#   <root>/<symbol>/<YYYY-MM>.npy   one structured array (ts int64 epoch s, px float64) per month
+#   <root>/_state.json              per symbol and month: [rows, max rowid, sum px, sum ts]
+# Sync compares those signatures with one grouped query per symbol and re-exports only the
+# months that differ, so backdated inserts (e.g. coinbase_hist closes), INSERT OR REPLACE
+# upserts, px edits and deletes all reach the store, not just ticks past the newest one.
+# That scan reads every price row, so each symbol also records the ledger's db_token and
+# MAX(rowid) at its last sync; while both are unchanged the scan is skipped and a read
+# through load_daily costs a couple of stat() calls.
+# A partition is rewritten whole (tmp + os.replace), so a reader that already mapped it keeps
+# a consistent old copy. Export reads the ledger through an ordinary SQLite read, which in
+# WAL mode never blocks the writers.
+
+DEFAULT_ROOT = BASE_DIR / "data" / "price_store"
+TICK = np.dtype([("ts", "<i8"), ("px", "<f8")])
+
+# epoch seconds for both ts flavours (INTEGER epoch / TEXT 'YYYY-MM-DD HH:MM:SS' UTC)
+_EPOCH_SQL = "CASE WHEN typeof(ts) IN ('integer','real') THEN CAST(ts AS INTEGER) ELSE CAST(strftime('%s', ts) AS INTEGER) END"
+_MONTH_SQL = f"strftime('%Y-%m', {_EPOCH_SQL}, 'unixepoch')"
+
+
+def _stamp(conn: sqlite3.Connection) -> Optional[list]:
+    """db_token of the ledger file plus MAX(rowid) of price; None for an in-memory DB."""
+    path = next((r[2] for r in conn.execute("PRAGMA database_list") if r[1] == "main"), "")
+    token = db_token(Path(path)) if path else None
+    if token is None:
+        return None
+    top = conn.execute("SELECT MAX(rowid) FROM price").fetchone()[0]
+    return json.loads(json.dumps([token, top]))  # the shape it has after a round trip through _state.json
+
+
+def _month(ts: np.ndarray) -> np.ndarray:
+    return ts.astype("datetime64[s]").astype("datetime64[M]")
+
+
+class PriceStore:
+    def __init__(self, root: str | os.PathLike = DEFAULT_ROOT):
+        self.root = Path(root)
+
+    # -- layout
+
+    def _dir(self, symbol: str) -> Path:
+        return self.root / quote(symbol, safe="-_.")
+
+    def symbols(self) -> List[str]:
+        if not self.root.exists():
+            return []
+        return sorted(unquote(p.name) for p in self.root.iterdir() if p.is_dir())
+
+    def partitions(self, symbol: str) -> List[Path]:
+        d = self._dir(symbol)
+        return sorted(d.glob("*.npy")) if d.exists() else []
+
+    def _state(self) -> Dict[str, object]:
+        try:
+            return json.loads((self.root / "_state.json").read_text(encoding="utf-8"))
+        except FileNotFoundError:
+            return {}
+
+    def _save_state(self, st: Dict[str, object]) -> None:
+        self.root.mkdir(parents=True, exist_ok=True)
+        tmp = self.root / "_state.json.tmp"
+        tmp.write_text(json.dumps(st, sort_keys=True), encoding="utf-8")
+        os.replace(tmp, self.root / "_state.json")
+
+    @staticmethod
+    def _write(path: Path, arr: np.ndarray) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(path.name + ".tmp")
+        with open(tmp, "wb") as f:
+            np.save(f, arr)
+        os.replace(tmp, path)
+
+    # -- export
+
+    def sync(self, conn: sqlite3.Connection, symbols: Optional[Sequence[str]] = None,
+             full: bool = False) -> Dict[str, int]:
+        """
+        Re-export every month whose signature changed since the last sync (all of them with
+        full=True) and drop months that no longer have ticks. Symbols synced since the last
+        commit to the ledger are skipped. Returns the ticks written per symbol.
+        """
+        col = symbol_column(conn)
+        stamp = _stamp(conn)  # before the scan, so a commit racing it is picked up next time
+        if symbols is None:
+            symbols = [r[0] for r in conn.execute(f"SELECT DISTINCT {col} FROM price WHERE {col} IS NOT NULL")]
+        state = self._state()
+        stamps = state.setdefault("_stamps", {})
+        written: Dict[str, int] = {}
+        for sym in symbols:
+            if not full and stamp is not None and stamps.get(sym) == stamp and sym in state:
+                written[sym] = 0
+                continue
+            sigs = {r[0]: list(r[1:]) for r in conn.execute(
+                f"SELECT {_MONTH_SQL} AS m, COUNT(*), MAX(rowid), TOTAL(px), TOTAL({_EPOCH_SQL}) "
+                f"FROM price WHERE {col}=? AND px IS NOT NULL GROUP BY m", (sym,))}
+            old = state.get(sym)
+            if full or not isinstance(old, dict):  # no usable signatures (or a pre-signature state)
+                for p in self.partitions(sym):
+                    p.unlink()
+                old = {}
+            for m in old.keys() - sigs.keys():
+                (self._dir(sym) / f"{m}.npy").unlink(missing_ok=True)
+            changed = sorted(m for m in sigs if sigs[m] != old.get(m))
+            written[sym] = 0
+            if changed:
+                lo = int(np.datetime64(changed[0], "M").astype("datetime64[s]").astype(np.int64))
+                hi = int((np.datetime64(changed[-1], "M") + 1).astype("datetime64[s]").astype(np.int64))
+                rows = conn.execute(
+                    f"SELECT {_EPOCH_SQL} AS e, px FROM price WHERE {col}=? AND px IS NOT NULL "
+                    "AND e >= ? AND e < ? ORDER BY e", (sym, lo, hi)).fetchall()
+                arr = np.array([(r[0], r[1]) for r in rows], dtype=TICK)
+                months = np.datetime_as_string(_month(arr["ts"]))
+                for m in changed:
+                    part = arr[months == m]
+                    self._write(self._dir(sym) / f"{m}.npy", part)
+                    written[sym] += len(part)
+            state[sym] = sigs
+            stamps[sym] = stamp
+        self._save_state(state)
+        return written
+
+    # -- read
+
+    def ticks(self, symbol: str, start: Optional[int] = None, end: Optional[int] = None) -> np.ndarray:
+        """Ticks (TICK dtype, ts ascending) with start <= ts < end; a read-only memmap view
+        when they sit in one partition."""
+        parts = []
+        lo = np.datetime64(start, "s").astype("datetime64[M]") if start is not None else None
+        hi = np.datetime64(end, "s").astype("datetime64[M]") if end is not None else None
+        for p in self.partitions(symbol):
+            m = np.datetime64(p.stem, "M")
+            if (lo is not None and m < lo) or (hi is not None and m > hi):
+                continue
+            parts.append(np.load(p, mmap_mode="r"))
+        if not parts:
+            return np.empty(0, dtype=TICK)
+        arr = parts[0] if len(parts) == 1 else np.concatenate(parts)
+        i = 0 if start is None else int(np.searchsorted(arr["ts"], start, "left"))
+        j = len(arr) if end is None else int(np.searchsorted(arr["ts"], end, "left"))
+        return arr[i:j]
+
+    def daily_closes(self, symbol: str) -> Tuple[np.ndarray, np.ndarray]:
+        """(UTC day number, close) per day with ticks: the last tick of each day."""
+        t = self.ticks(symbol)
+        if len(t) == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0)
+        day = t["ts"] // 86400
+        last = np.append(np.flatnonzero(day[1:] != day[:-1]), len(day) - 1)
+        return day[last], np.asarray(t["px"][last], dtype=float)
+
+    def daily_matrix(self, symbols: Sequence[str], since: str = "") -> DailyMatrix:
+        """Same shape and semantics as price_daily.load_daily_matrix, from the columnar copy."""
+        syms = list(dict.fromkeys(symbols))
+        per = [self.daily_closes(s) for s in syms]
+        days = np.unique(np.concatenate([d for d, _ in per])) if per else np.empty(0, dtype=np.int64)
+        if since:
+            days = days[days >= np.datetime64(since[:10], "D").astype(np.int64)]
+        px = np.full((len(days), len(syms)), np.nan)
+        for j, (d, c) in enumerate(per):
+            keep = np.isin(d, days)
+            px[np.searchsorted(days, d[keep]), j] = c[keep]
+        dates = np.datetime_as_string(days.astype("datetime64[D]")).tolist()
+        return DailyMatrix(dates, syms, px)
+
+
+def load_daily(conn: sqlite3.Connection, symbols: Sequence[str], since: str = "",
+               store: Optional[str | os.PathLike] = None) -> DailyMatrix:
+    """
+    Daily close matrix for the research tools: from price_daily by default, or from the
+    columnar store when PRICE_STORE (or `store`) names its directory, synced first (a no-op
+    while the ledger is unchanged since the last sync).
+    """
+    root = store or os.environ.get("PRICE_STORE")
+    if not root:
+        return load_daily_matrix(conn, symbols, since)
+    ps = PriceStore(root)
+    ps.sync(conn, symbols)
+    return ps.daily_matrix(symbols, since)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    ap = argparse.ArgumentParser(description="Export the ledger price table to the columnar store")
+    ap.add_argument("--root", default=os.environ.get("PRICE_STORE") or str(DEFAULT_ROOT))
+    ap.add_argument("--db", default=None, help="default CRYPTOOPS_DB / data/ledger.db")
+    ap.add_argument("--full", action="store_true", help="rewrite every month, not just changed ones")
+    ap.add_argument("symbols", nargs="*")
+    args = ap.parse_args(argv)
+    conn = get_conn(args.db)
+    try:
+        added = PriceStore(args.root).sync(conn, args.symbols or None, full=args.full)
+    finally:
+        conn.close()
+    for s, n in sorted(added.items()):
+        print(f"{s}: +{n}")
+
+
+if __name__ == "__main__":
+    main()
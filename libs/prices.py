@@ -0,0 +1,112 @@
+from __future__ import annotations
+
+import os
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from libs.db import get_manager
+
+# (ts, px) of the newest row per symbol; ts is INTEGER epoch or TEXT 'YYYY-MM-DD HH:MM:SS'
+Quote = Tuple[object, float]
+
+
+def symbol_column(conn: sqlite3.Connection) -> str:
+    """
+    Name of the symbol column in `price`: the service schema uses `symbol`,
+    schema/schema.sql uses `instrument_id`.
+    """
+    cols = [r[1] for r in conn.execute("PRAGMA table_info(price)").fetchall()]
+    lower = [c.lower() for c in cols]
+    if "symbol" in lower:
+        return cols[lower.index("symbol")]
+    if "instrument_id" in lower:
+        return cols[lower.index("instrument_id")]
+    raise RuntimeError("price table missing symbol/instrument_id")
+
+
+def latest_quotes(conn: sqlite3.Connection, symbols: Iterable[str]) -> Dict[str, Quote]:
+    """
+    Newest (ts, px) for every requested symbol, in one statement.
+
+    Relies on SQLite's documented bare-column rule: with a single MAX() aggregate, the other
+    selected columns come from the row holding the max. With the (symbol, ts) index this is
+    one index seek per symbol, whatever the table size.
+    """
+    syms = sorted({s for s in symbols if s})
+    if not syms:
+        return {}
+    col = symbol_column(conn)
+    ph = ",".join("?" * len(syms))
+    rows = conn.execute(
+        f"SELECT {col}, MAX(ts), px FROM price WHERE {col} IN ({ph}) GROUP BY {col}",
+        syms,
+    ).fetchall()
+    return {r[0]: (r[1], float(r[2])) for r in rows if r[2] is not None}
+
+
+def latest_prices(conn: sqlite3.Connection, symbols: Iterable[str]) -> Dict[str, float]:
+    return {s: q[1] for s, q in latest_quotes(conn, symbols).items()}
+
+
+def db_token(path: Path) -> Optional[tuple]:
+    """Changes whenever a commit lands: the main file (checkpoint/replace) or its WAL."""
+    parts: List[tuple] = []
+    for p in (path, path.with_name(path.name + "-wal")):
+        try:
+            st = os.stat(p)
+        except FileNotFoundError:
+            parts.append(())
+            continue
+        parts.append((st.st_ino, st.st_mtime_ns, st.st_size))
+    return tuple(parts) if parts[0] else None
+
+
+class PriceSnapshotCache:
+    """
+    Per-process cache of latest quotes, keyed by DB path and invalidated by db_token().
+    Back-to-back planner calls against an unchanged ledger never touch SQLite.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # path -> (db token, quotes, symbols asked for under that token)
+        self._entries: Dict[str, Tuple[tuple, Dict[str, Quote], frozenset]] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def quotes(self, db_path: str | os.PathLike, symbols: Iterable[str]) -> Dict[str, Quote]:
+        path = Path(db_path)
+        want = set(symbols)
+        token = db_token(path)
+        if token is None:
+            raise RuntimeError(f"LEDGER_DB not found at {path}")
+        key = str(path)
+        with self._lock:
+            ent = self._entries.get(key)
+            if ent and ent[0] == token and want <= ent[2]:
+                self.hits += 1
+                return {s: ent[1][s] for s in want if s in ent[1]}
+        q = latest_quotes(get_manager(path).reader(), want)
+        with self._lock:
+            self.misses += 1
+            ent = self._entries.get(key)
+            if ent and ent[0] == token:
+                # same DB state: widen the snapshot rather than replace it
+                q_all = {**ent[1], **q}
+                asked = ent[2] | want
+            else:
+                q_all, asked = q, frozenset(want)
+            self._entries[key] = (token, q_all, asked)
+        return q
+
+    def prices(self, db_path: str | os.PathLike, symbols: Iterable[str]) -> Dict[str, float]:
+        return {s: q[1] for s, q in self.quotes(db_path, symbols).items()}
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+PRICE_CACHE = PriceSnapshotCache()
@@ -0,0 +1,184 @@
+from __future__ import annotations
+
+import asyncio
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, Iterable, Optional, Tuple
+from urllib.parse import urlsplit
+
+COINBASE_SPOT = "https://api.coinbase.com/v2/prices/{pair}/spot"
+
+
+class RequestsTransport:
+    """Keep-alive HTTP via one pooled requests.Session (thread-safe for plain GETs)."""
+
+    def __init__(self, pool_size: int = 16):
+        import requests  # lazy import
+        from requests.adapters import HTTPAdapter
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def get_json(self, url: str, timeout: float) -> Any:
+        r = self.session.get(url, timeout=timeout)
+        r.raise_for_status()
+        return r.json()
+
+
+def host_fault(exc: BaseException) -> bool:
+    """
+    True if `exc` says the host is unhealthy: a 5xx, a timeout or another transport error.
+    A 4xx (unknown or delisted pair, bad request) or a malformed body is about the request,
+    not the host, and must not trip the breaker for every other pair behind it.
+    """
+    status = getattr(getattr(exc, "response", None), "status_code", None)
+    if status is not None:
+        return int(status) >= 500
+    return not isinstance(exc, (ValueError, TypeError, KeyError))
+
+
+class CircuitBreaker:
+    """
+    Per-host breaker: after `threshold` consecutive failures the host is skipped for
+    `cooldown` seconds, then one probe is let through (half-open); a success closes it.
+    Callers report only host faults (see host_fault) as failures.
+    """
+
+    def __init__(self, threshold: int = 3, cooldown: float = 30.0, clock: Callable[[], float] = time.monotonic):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._hosts: Dict[str, Tuple[int, float]] = {}  # host -> (consecutive failures, open until)
+
+    def allow(self, host: str) -> bool:
+        with self._lock:
+            fails, until = self._hosts.get(host, (0, 0.0))
+            if fails < self.threshold:
+                return True
+            now = self.clock()
+            if now < until:
+                return False
+            # half-open: let this caller probe, keep the rest out for another cooldown
+            self._hosts[host] = (fails, now + self.cooldown)
+            return True
+
+    def success(self, host: str) -> None:
+        with self._lock:
+            self._hosts.pop(host, None)
+
+    def failure(self, host: str) -> None:
+        with self._lock:
+            fails, _ = self._hosts.get(host, (0, 0.0))
+            fails += 1
+            self._hosts[host] = (fails, self.clock() + self.cooldown if fails >= self.threshold else 0.0)
+
+    def is_open(self, host: str) -> bool:
+        with self._lock:
+            fails, until = self._hosts.get(host, (0, 0.0))
+            return fails >= self.threshold and self.clock() < until
+
+
+class SpotPriceFetcher:
+    """
+    Spot prices for many pairs at once: one request per uncached pair on a shared thread
+    pool, all bounded by a single deadline, so a slow or dead pair costs the deadline once
+    instead of a timeout per pair. Quotes are cached for `ttl` seconds; requests still in
+    flight at the deadline keep running and fill the cache for the next call.
+    """
+
+    def __init__(self, transport: Any = None, url: str = COINBASE_SPOT, ttl: float = 5.0,
+                 timeout: float = 5.0, max_workers: int = 8, breaker: Optional[CircuitBreaker] = None,
+                 clock: Callable[[], float] = time.monotonic):
+        self._transport = transport
+        self.url = url
+        self.ttl = ttl
+        self.timeout = timeout  # per request; may outlive the caller's deadline
+        self.clock = clock
+        self.breaker = breaker or CircuitBreaker(clock=clock)
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="spot")
+        self._lock = threading.Lock()
+        self._cache: Dict[str, Tuple[float, float]] = {}  # pair -> (fetched at, px)
+        self.hits = 0
+        self.misses = 0
+        self.skipped = 0
+
+    @property
+    def transport(self) -> Any:
+        if self._transport is None:
+            with self._lock:
+                if self._transport is None:
+                    self._transport = RequestsTransport()
+        return self._transport
+
+    def _one(self, pair: str) -> float:
+        url = self.url.format(pair=pair)
+        host = urlsplit(url).netloc
+        try:
+            data = self.transport.get_json(url, self.timeout)
+            px = float(((data or {}).get("data") or {}).get("amount"))
+        except Exception as e:
+            if host_fault(e):
+                self.breaker.failure(host)
+            else:
+                self.breaker.success(host)  # the host answered; this pair is the problem
+            raise
+        self.breaker.success(host)
+        with self._lock:
+            self._cache[pair] = (self.clock(), px)
+        return px
+
+    def _submit(self, pairs: Iterable[str]) -> Tuple[Dict[str, float], Dict[Future, str]]:
+        """Cached quotes, plus one pool future per pair that still has to be fetched."""
+        now = self.clock()
+        out: Dict[str, float] = {}
+        todo = []
+        with self._lock:
+            for p in dict.fromkeys(pairs):
+                hit = self._cache.get(p)
+                if hit and now - hit[0] < self.ttl:
+                    out[p] = hit[1]
+                    self.hits += 1
+                else:
+                    todo.append(p)
+        futs: Dict[Future, str] = {}
+        for p in todo:
+            if not self.breaker.allow(urlsplit(self.url.format(pair=p)).netloc):
+                self.skipped += 1
+                continue
+            futs[self._pool.submit(self._one, p)] = p
+        self.misses += len(futs)
+        return out, futs
+
+    @staticmethod
+    def _collect(out: Dict[str, float], futs: Dict[Future, str], done: Iterable[Future]) -> Dict[str, float]:
+        for f in done:
+            if f.exception() is None:
+                out[futs[f]] = f.result()
+        return out
+
+    def fetch(self, pairs: Iterable[str], deadline: float = 3.0) -> Dict[str, float]:
+        """{pair: px} for the pairs that answered within `deadline` seconds (others omitted)."""
+        out, futs = self._submit(pairs)
+        done, _ = wait(futs, timeout=deadline)
+        return self._collect(out, futs, done)
+
+    async def afetch(self, pairs: Iterable[str], deadline: float = 3.0) -> Dict[str, float]:
+        """fetch() for the event loop: the caller awaits instead of blocking a thread."""
+        out, futs = self._submit(pairs)
+        if futs:
+            # shield: a deadline or cancellation must not cancel the pool work (it fills the cache)
+            waiters = {asyncio.shield(asyncio.wrap_future(f)): f for f in futs}
+            done, _ = await asyncio.wait(waiters, timeout=deadline)
+            self._collect(out, futs, [waiters[w] for w in done])
+        return out
+
+    def clear(self) -> None:
+        with self._lock:
+            self._cache.clear()
+
+
+SPOT_PRICES = SpotPriceFetcher()
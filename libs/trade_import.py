@@ -0,0 +1,200 @@
+from __future__ import annotations
+
+import csv
+import datetime as dt
+import hashlib
+import io
+import itertools
+import json
+import sqlite3
+from typing import Any, Dict, Iterable, Iterator, List, Sequence
+
+import numpy as np
+
+from libs.lots import Fill, LotEngine
+from libs.prices import latest_prices
+
+# Bulk path for fills: CSV or NDJSON in, one transaction out (orders, trades, lots through
+# LotEngine, a single balance snapshot). The `trades/*.jsonl` records written by
+# /apply_paper are accepted as-is: symbol, side, qty, px/px_eff/usd, optional ts, fee.
+
+TS_FMT = "%Y-%m-%d %H:%M:%S.%f"  # same as record_trade
+
+
+def fee_to_usd(fee_qty, fee_asset, px_map):
+    a = (fee_asset or "USD").upper()
+    if fee_qty is None: return 0.0
+    if a == "USD": return float(fee_qty)
+    if a == "BTC": return float(fee_qty) * (px_map.get("BTC-USD") or 0.0)
+    if a == "ETH": return float(fee_qty) * (px_map.get("ETH-USD") or 0.0)
+    return 0.0
+
+
+def fee_instrument(fee_asset: str) -> str:
+    a = (fee_asset or "USD").upper()
+    return "USD" if a == "USD" else ("BTC-USD" if a == "BTC" else "ETH-USD")
+
+
+def _ts(v: Any) -> str:
+    if v in (None, ""):
+        return dt.datetime.now(dt.timezone.utc).strftime(TS_FMT)
+    if isinstance(v, (int, float)) or str(v).replace(".", "", 1).isdigit():
+        return dt.datetime.fromtimestamp(float(v), dt.timezone.utc).strftime(TS_FMT)
+    return str(v)
+
+
+def read_records(stream: Iterable[str], fmt: str = "auto") -> Iterator[Dict[str, Any]]:
+    """Dicts from an NDJSON or CSV text stream (auto: first non-blank char '{' means NDJSON)."""
+    it = iter(stream)
+    head: List[str] = []
+    for line in it:
+        head.append(line)
+        if line.strip():
+            break
+    if fmt == "auto":
+        fmt = "ndjson" if head and head[-1].lstrip().startswith("{") else "csv"
+    lines = itertools.chain(head, it)
+    if fmt == "csv":
+        yield from csv.DictReader(lines)
+        return
+    for line in lines:
+        if line.strip():
+            yield json.loads(line)
+
+
+def _lot_ids(v: Any) -> List[str]:
+    if isinstance(v, list):
+        return [str(x) for x in v]
+    return [x for x in str(v or "").replace(";", ",").split(",") if x]  # CSV: "lot_a;lot_b"
+
+
+def to_fills(records: Iterable[Dict[str, Any]], account: str = "trading") -> List[Dict[str, Any]]:
+    """
+    Normalize records to fill dicts, in time order (stable). Each fill gets a deterministic
+    trade id (hash of the record and its occurrence), so importing a file twice is a no-op.
+    """
+    out: List[Dict[str, Any]] = []
+    seen: Dict[str, int] = {}
+    for r in records:
+        qty = float(r["qty"])
+        if qty <= 0:
+            continue
+        px = r.get("px_eff") or r.get("px")
+        px = float(px) if px not in (None, "") else float(r["usd"]) / qty
+        raw = json.dumps(r, sort_keys=True, default=str)
+        n = seen[raw] = seen.get(raw, 0) + 1
+        digest = hashlib.sha1(f"{n}|{raw}".encode()).hexdigest()[:32]
+        out.append({
+            "account": r.get("account") or r.get("account_id") or account,
+            "symbol": r.get("symbol") or r["instrument_id"],
+            "side": str(r["side"]).lower(),
+            "qty": qty,
+            "px": px,
+            "fee": float(r.get("fee") or 0.0),
+            "fee_asset": (r.get("fee_asset") or "USD").upper(),
+            "ts": _ts(r.get("ts")),
+            "lot_ids": _lot_ids(r.get("lot_ids")),
+            "trade_id": "tr_" + digest,
+            "order_id": "ord_" + digest,
+        })
+    out.sort(key=lambda f: f["ts"])
+    return out
+
+
+def _fee_in_kind(f: Dict[str, Any]) -> bool:
+    """BTC/ETH fee paid out of the traded asset itself (record_trade's rule)."""
+    return f["fee_asset"] in ("BTC", "ETH") and f["symbol"] == f["fee_asset"] + "-USD"
+
+
+def _latest_qty(conn: sqlite3.Connection, account: str, instr: str) -> float:
+    r = conn.execute("SELECT qty FROM balance_snapshot WHERE account_id=? AND instrument_id=? "
+                     "ORDER BY ts DESC LIMIT 1", (account, instr)).fetchone()
+    return float(r[0]) if r else 0.0
+
+
+def replay_balances(fills: Sequence[Dict[str, Any]], start: Dict[tuple, float]) -> Dict[tuple, float]:
+    """
+    Balances after `fills` in one vectorized pass, with record_trade's rules: buys cost
+    qty*px USD, sells return it; a USD fee comes off USD, a BTC/ETH fee off the matching
+    spot leg. Keys are (account, instrument).
+    """
+    keys = sorted({(f["account"], f["symbol"]) for f in fills} | {(f["account"], "USD") for f in fills} | set(start))
+    idx = {k: i for i, k in enumerate(keys)}
+    sign = np.array([1.0 if f["side"] == "buy" else -1.0 for f in fills])
+    qty = np.array([f["qty"] for f in fills])
+    px = np.array([f["px"] for f in fills])
+    fee = np.array([f["fee"] for f in fills])
+    spot = np.array([idx[(f["account"], f["symbol"])] for f in fills], dtype=np.intp)
+    usd = np.array([idx[(f["account"], "USD")] for f in fills], dtype=np.intp)
+    fee_usd = np.array([f["fee_asset"] == "USD" for f in fills])
+    fee_kind = np.array([_fee_in_kind(f) for f in fills])
+
+    bal = np.array([start.get(k, 0.0) for k in keys])
+    n = len(keys)
+    bal += np.bincount(spot, sign * qty - np.where(fee_kind, fee, 0.0), minlength=n)
+    bal += np.bincount(usd, -sign * qty * px - np.where(fee_usd, fee, 0.0), minlength=n)
+    return {k: float(b) for k, b in zip(keys, bal)}
+
+
+def import_fills(conn: sqlite3.Connection, records: Iterable[Dict[str, Any]], account: str = "trading",
+                 method: str = "HIFO") -> Dict[str, Any]:
+    """
+    Apply all fills in one transaction and write one consolidated balance_snapshot per
+    touched account. Fills whose trade id is already in the ledger are skipped. Any error
+    (e.g. a sell with no lots) rolls the whole batch back.
+    """
+    fills = to_fills(records, account)
+    ids = [f["trade_id"] for f in fills]
+    have = set()
+    for i in range(0, len(ids), 500):
+        chunk = ids[i:i + 500]
+        have.update(r[0] for r in conn.execute(
+            f"SELECT id FROM trade WHERE id IN ({','.join('?' * len(chunk))})", chunk))
+    fills = [f for f in fills if f["trade_id"] not in have]
+    stats: Dict[str, Any] = {"fills": len(fills), "skipped": len(have), "realized": 0.0, "balances": {}}
+    if not fills:
+        return stats
+
+    px_map = latest_prices(conn, ["BTC-USD", "ETH-USD"])
+    try:
+        syms = sorted({f["symbol"] for f in fills})
+        conn.executemany("INSERT OR IGNORE INTO instrument(id,symbol,kind) VALUES(?,?,?)",
+                         [(s, s, "fiat" if s.upper() == "USD" else "crypto") for s in syms])
+        conn.executemany(
+            "INSERT INTO \"order\"(id,ts,account_id,instrument_id,side,ord_type,qty,px,status) VALUES(?,?,?,?,?,?,?,?,?)",
+            [(f["order_id"], f["ts"], f["account"], f["symbol"], f["side"], "market", f["qty"], f["px"], "filled")
+             for f in fills])
+        conn.executemany(
+            "INSERT INTO trade(id,ts,order_id,account_id,instrument_id,side,qty,px,fee_qty,fee_instrument_id) "
+            "VALUES(?,?,?,?,?,?,?,?,?,?)",
+            [(f["trade_id"], f["ts"], f["order_id"], f["account"], f["symbol"], f["side"], f["qty"], f["px"],
+              f["fee"], fee_instrument(f["fee_asset"])) for f in fills])
+
+        lot_fills = []
+        for f in fills:
+            pm = dict(px_map, **{f["symbol"]: f["px"]})
+            in_kind = f["fee"] if f["side"] == "buy" and _fee_in_kind(f) else 0.0
+            lot_fills.append(Fill(f["account"], f["symbol"], f["side"], f["qty"], f["px"], f["ts"], f["trade_id"],
+                                  fee_usd=fee_to_usd(f["fee"], f["fee_asset"], pm), fee_in_kind=in_kind,
+                                  lot_ids=f["lot_ids"]))
+        stats["realized"] = sum(r.realized for r in LotEngine(conn, method).apply(lot_fills))
+
+        start = {}
+        for k in {(f["account"], f["symbol"]) for f in fills} | {(f["account"], "USD") for f in fills}:
+            start[k] = _latest_qty(conn, *k)
+        bal = replay_balances(fills, start)
+        snap_ts = max(max(f["ts"] for f in fills), dt.datetime.now(dt.timezone.utc).strftime(TS_FMT))
+        conn.executemany(
+            "INSERT INTO balance_snapshot(ts,account_id,instrument_id,qty) VALUES(?,?,?,?) "
+            "ON CONFLICT(ts,account_id,instrument_id) DO UPDATE SET qty=excluded.qty",
+            [(snap_ts, a, i, q) for (a, i), q in sorted(bal.items())])
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    stats["balances"] = {f"{a}:{i}": q for (a, i), q in sorted(bal.items())}
+    return stats
+
+
+def import_text(conn: sqlite3.Connection, text: str, fmt: str = "auto", **kw: Any) -> Dict[str, Any]:
+    return import_fills(conn, read_records(io.StringIO(text), fmt), **kw)
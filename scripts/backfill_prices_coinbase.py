@@ -1,40 +1,27 @@
-import sys, json, datetime, time, urllib.request, sqlite3
+import argparse, datetime
+from pathlib import Path
 from libs.db import get_conn
-
-API = "https://api.coinbase.com/v2/prices/{pair}/spot?date={date}"
-
-def fetch(pair, date_str):
-    url = API.format(pair=pair, date=date_str)
-    with urllib.request.urlopen(url) as r:
-        data = json.load(r)
-        return float(data["data"]["amount"])
+from src.ingest.coinbase_backfill import Backfiller
 
 if __name__ == "__main__":
-    pairs = ["BTC-USD","ETH-USD","SOL-USD","LINK-USD"]
-    days = int(sys.argv[1]) if len(sys.argv)>1 else 120   # default 120 days
-    today = datetime.date.today()
+    ap = argparse.ArgumentParser(description="Backfill daily Coinbase closes (only days not in the DB yet)")
+    ap.add_argument("days", nargs="?", type=int, default=120, help="days back from yesterday (default 120)")
+    ap.add_argument("--start", help="YYYY-MM-DD; overrides days")
+    ap.add_argument("--pair", action="append", help="Repeatable; default BTC/ETH/SOL/LINK-USD")
+    ap.add_argument("--workers", type=int, default=8)
+    ap.add_argument("--rps", type=float, default=None, help="requests/s (default INGEST_RPS)")
+    ap.add_argument("--checkpoint", type=Path, default=Path("data") / "backfill_coinbase.ckpt.jsonl")
+    args = ap.parse_args()
+
+    pairs = args.pair or ["BTC-USD","ETH-USD","SOL-USD","LINK-USD"]
+    end = datetime.date.today() - datetime.timedelta(days=1)
+    start = datetime.date.fromisoformat(args.start) if args.start else end - datetime.timedelta(days=args.days - 1)
 
-    conn = get_conn(); cur = conn.cursor()
-    for p in pairs:
-        # ensure instrument exists
-        cur.execute("INSERT OR IGNORE INTO instrument(id,symbol,kind) VALUES(?,?,?)",(p,p,"crypto"))
-        for d in range(days, 0, -1):
-            day = today - datetime.timedelta(days=d)
-            ds = day.strftime("%Y-%m-%d")
-            try:
-                px = fetch(p, ds)
-            except Exception as e:
-                print("skip", p, ds, e); continue
-            ts = ds + " 23:59:59"
-            # UPSERT: replace existing row for that day/symbol
-            cur.execute("""
-                INSERT INTO price(ts,instrument_id,px,source) VALUES(?,?,?,?)
-                ON CONFLICT(ts, instrument_id) DO UPDATE SET
-                    px=excluded.px,
-                    source=excluded.source
-            """, (ts, p, px, "coinbase_hist"))
-            # gentle throttle to avoid rate limits
-            time.sleep(0.08)
-        print("backfilled:", p)
-    conn.commit()
+    conn = get_conn()
+    args.checkpoint.parent.mkdir(parents=True, exist_ok=True)
+    stats = Backfiller(conn, rps=args.rps, workers=args.workers, checkpoint=args.checkpoint).run(pairs, start, end)
+    conn.close()
+    for f in stats.pop("failures"):
+        print("skip", f["pair"], f["day"], f["error"])
+    print(f"backfilled {start} → {end}: {stats}")
     print("done.")
@@ -1,19 +1,21 @@
-import json, sys, urllib.request, datetime
+import sys, datetime
 from libs.db import get_conn
+from libs.price_daily import ensure_price_daily
+from libs.spot_prices import SpotPriceFetcher
 
-API = "https://api.coinbase.com/v2/prices/{pair}/spot"
-
-def fetch(pair):
-    with urllib.request.urlopen(API.format(pair=pair)) as r:
-        data = json.load(r)
-        return float(data["data"]["amount"])
+fetcher = SpotPriceFetcher(ttl=0)
 
 if __name__ == "__main__":
     pairs = sys.argv[1:] or ["BTC-USD","ETH-USD","SOL-USD","LINK-USD"]
     ts = datetime.datetime.now(datetime.timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+    prices = fetcher.fetch(pairs, deadline=10.0)  # all pairs concurrently
+    missing = [p for p in pairs if p not in prices]
+    if missing:
+        raise SystemExit(f"spot price fetch failed for: {', '.join(missing)}")
     conn = get_conn(); cur = conn.cursor()
+    ensure_price_daily(conn)
     for p in pairs:
-        px = fetch(p)
+        px = prices[p]
         cur.execute("INSERT OR IGNORE INTO instrument(id,symbol,kind) VALUES(?,?,?)",(p,p,"crypto"))
         cur.execute("INSERT INTO price(ts,instrument_id,px,source) VALUES(?,?,?,?)",(ts,p,px,"coinbase"))
         print(f"{p}={px}")
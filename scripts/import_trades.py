@@ -0,0 +1,34 @@
+import argparse, sys
+from pathlib import Path
+from libs.db import get_conn
+from libs.lots import METHODS
+from libs.trade_import import import_fills, read_records
+
+if __name__ == "__main__":
+    p = argparse.ArgumentParser(description="Import fills (CSV or NDJSON, e.g. trades/*.jsonl) in one transaction")
+    p.add_argument("files", nargs="*", type=Path, help="default: stdin")
+    p.add_argument("--account","-a", default="trading", help="for records without an account field")
+    p.add_argument("--format", default="auto", choices=["auto","csv","ndjson"])
+    p.add_argument("--method", default="HIFO", type=str.upper, choices=METHODS, help="lot matching for sells (default HIFO)")
+    args = p.parse_args()
+
+    def records():
+        if not args.files:
+            yield from read_records(sys.stdin, args.format)
+        for f in args.files:
+            with open(f, encoding="utf-8-sig", newline="") as fh:
+                yield from read_records(fh, args.format)
+
+    conn = get_conn()
+    try:
+        stats = import_fills(conn, records(), account=args.account, method=args.method)
+    except ValueError as e:
+        raise SystemExit(f"Import aborted, nothing written: {e}")
+    finally:
+        conn.close()
+
+    print(f"Imported {stats['fills']} fills ({stats['skipped']} already in the ledger).")
+    if stats["fills"]:
+        print(f"Realized PnL (USD): {stats['realized']:.2f}")
+        for k, q in stats["balances"].items():
+            print(f"  {k}: {q:.6f}")
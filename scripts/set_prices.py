@@ -1,5 +1,6 @@
 import argparse, datetime
 from libs.db import get_conn
+from libs.price_daily import ensure_price_daily
 if __name__ == "__main__":
     p = argparse.ArgumentParser()
     p.add_argument("--btc", type=float)
@@ -8,6 +9,7 @@ if __name__ == "__main__":
     args = p.parse_args()
     ts = datetime.datetime.now(datetime.timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
     conn = get_conn(); cur = conn.cursor()
+    ensure_price_daily(conn)
     pairs = []
     if args.btc is not None: pairs.append(("BTC-USD", args.btc))
     if args.eth is not None: pairs.append(("ETH-USD", args.eth))
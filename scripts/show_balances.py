@@ -1,4 +1,5 @@
 from libs.db import get_conn
+from libs.prices import latest_prices
 
 def latest_qty(conn, account, instr):
     r = conn.execute(
@@ -7,13 +8,6 @@ def latest_qty(conn, account, instr):
     ).fetchone()
     return r["qty"] if r else 0.0
 
-def latest_price(conn, instr):
-    r = conn.execute(
-        "SELECT px FROM price WHERE instrument_id=? ORDER BY ts DESC LIMIT 1",
-        (instr,)
-    ).fetchone()
-    return r["px"] if r else None
-
 if __name__ == "__main__":
     acct = "trading"
     conn = get_conn()
@@ -24,11 +18,12 @@ if __name__ == "__main__":
     ) if row["instrument_id"] != "USD"]
 
     usd = latest_qty(conn, acct, "USD")
+    px_map = latest_prices(conn, syms)
     rows = []
     total_crypto_val = 0.0
     for s in syms:
         q = latest_qty(conn, acct, s)
-        p = latest_price(conn, s) or 0.0
+        p = px_map.get(s) or 0.0
         val = q * p
         total_crypto_val += val
         rows.append((s, q, p, val))
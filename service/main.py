@@ -1,19 +1,34 @@
 # service/main.py
-import os, time, math, statistics, hashlib, subprocess, uuid, json as _json
-from typing import Optional, List, Dict, Any
+import asyncio, copy, os, threading, time, uuid
 from pathlib import Path
+from typing import Optional, List, Dict, Any
 
 from fastapi import FastAPI, Query, Header, HTTPException
-import requests, sqlite3
+import requests
 
+from apps.rebalancer.batch import STATE_ACCOUNT, compute_batch
 from apps.rebalancer.main import compute_actions
-from apps.infra.state_gcs import read_json, write_json, append_jsonl
+from apps.rebalancer.policy import DEFAULT_TARGETS, PolicyError, get_policy
+from apps.infra.state_gcs import (
+    io_stats, ndjson_log,
+    aread_json, awrite_json, aappend_jsonl, aappend_jsonl_many, ageneration, gather_io, run_io,
+)
+from apps.infra.singleflight import SingleFlight
+from apps.infra.equity_cache import EquityCache
+from apps.infra.ledger_sync import ledger_sync_for
+from apps.infra.perfstats import PerfStats
+# commit resolved once per process; policy hash only recomputed when the file changes
+from apps.infra.versioning import BUILD as _BUILD
+from libs.db import get_manager
+from libs.nav import RESOLUTIONS, NavCache, nav_cache_path
+from libs.price_daily import ensure_price_daily
+from libs.prices import db_token
+from libs.spot_prices import SPOT_PRICES
 
 # Optional helpers from state_gcs (we fall back gracefully if unavailable)
 try:
-    from apps.infra.state_gcs import read_ndjson, selftest  # type: ignore
+    from apps.infra.state_gcs import selftest  # type: ignore
 except Exception:  # pragma: no cover
-    read_ndjson = None
     selftest = None
 
 app = FastAPI(title="CryptoOps Planner", version="1.6")
@@ -37,29 +52,14 @@ if ENABLE_DEBUG:
 # helpers
 # ------------------------------------------------------------------------
 
-def _git_commit() -> str:
-    try:
-        out = subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL)
-        return out.decode().strip()
-    except Exception:
-        return "n/a"
-
-def _config_hash() -> str:
-    try:
-        cfg_path = Path(__file__).resolve().parents[1] / "configs" / "policy.rebalancer.json"
-        s = cfg_path.read_text(encoding="utf-8")
-    except Exception:
-        s = "{}"
-    return hashlib.sha256(s.encode()).hexdigest()[:12]
-
 def _mode_payload() -> Dict[str, Any]:
     return {
         "trading_mode": os.getenv("TRADING_MODE", "paper"),
         "coinbase_env": os.getenv("COINBASE_ENV", "sandbox"),
         "state_bucket": os.getenv("STATE_BUCKET", "(unset)"),
         "revision": os.getenv("K_REVISION", "n/a"),
-        "code_commit": _git_commit(),
-        "config_hash": _config_hash(),
+        "code_commit": _BUILD.commit(),
+        "config_hash": _BUILD.config_hash(),
         "run_id": str(uuid.uuid4()),
         "ts": int(time.time()),
     }
@@ -91,88 +91,74 @@ def _ts_str(ts: Optional[int] = None) -> str:
 def _is_sunday(ts: Optional[int] = None) -> bool:
     return time.gmtime(ts or int(time.time())).tm_wday == 6  # Monday=0 ... Sunday=6
 
-def _safe_read_ndjson(path: str) -> List[dict]:
-    """Use state_gcs.read_ndjson if present, else parse text manually."""
-    if read_ndjson:
-        try:
-            return read_ndjson(path)  # type: ignore
-        except Exception:
-            return []
-    try:
-        from apps.infra.state_gcs import read_text
-        txt = read_text(path)
-        if not txt:
-            return []
-        out = []
-        for ln in txt.splitlines():
-            ln = ln.strip()
-            if ln:
-                try:
-                    out.append(_json.loads(ln))
-                except Exception:
-                    pass
-        return out
-    except Exception:
-        return []
-
 def _load_targets_from_policy() -> Dict[str, float]:
-    """Pull target weights from configs/policy.rebalancer.json (fallback to a sane split)."""
+    """Target weights from the shared compiled policy (fallback to a sane split)."""
     try:
-        cfg_path = Path(__file__).resolve().parents[1] / "configs" / "policy.rebalancer.json"
-        data = _json.loads(cfg_path.read_text(encoding="utf-8"))
-        t = data.get("targets_trading") or data.get("targets") or {}
-        return {k.upper(): float(v) for k, v in t.items()}
-    except Exception:
-        return {"BTC": 0.45, "ETH": 0.25, "SOL": 0.15, "LINK": 0.15}
+        return dict(get_policy().targets)
+    except PolicyError:
+        return dict(DEFAULT_TARGETS)
 
 def _pairs_from_targets(t: Dict[str, float]) -> List[str]:
     return [f"{k}-USD" for k in t.keys()]
 
-def _fetch_public_prices(pairs: List[str]) -> Dict[str, float]:
-    """DB-free fallback using Coinbase public spot prices."""
-    out: Dict[str, float] = {}
-    for p in pairs:
-        try:
-            url = f"https://api.coinbase.com/v2/prices/{p}/spot"
-            r = requests.get(url, timeout=5)
-            amt = float(((r.json() or {}).get("data") or {}).get("amount"))
-            out[p] = amt
-        except Exception:
-            pass
-    return out
+async def _afetch_public_prices(pairs: List[str]) -> Dict[str, float]:
+    """DB-free fallback using Coinbase public spot prices (all pairs at once, 5 s budget)."""
+    return await SPOT_PRICES.afetch(pairs, deadline=5.0)
+
+async def _fallback_state() -> tuple:
+    """(prices, balances) when the planner is down: both GCS reads at once, spot prices if needed."""
+    prices, balances = await gather_io(aread_json("state/latest_prices.json", default=None),
+                                       aread_json("state/balances.json", default=None))
+    if not prices:
+        prices = await _afetch_public_prices(_pairs_from_targets(_load_targets_from_policy()))
+    return prices or {}, balances
+
+# One planner run per distinct input state: concurrent /plan, /apply_paper and /snapshot_now
+# share it, and repeats are served from memory until the ledger, balances or policy change.
+_planner = SingleFlight(size=16)
+
+async def _plan_key(account: str, overrides: Optional[Dict[str, float]]) -> tuple:
+    try:
+        pol = get_policy().content_hash
+    except PolicyError:
+        pol = None
+    db = os.getenv("LEDGER_DB", "/tmp/ledger.db")
+    return (account, tuple(sorted((overrides or {}).items())), db_token(Path(db)),
+            await ageneration("state/balances.json"), pol)
+
+async def _compute_actions(account: str = "trading", overrides: Optional[Dict[str, float]] = None,
+                           refresh: bool = False) -> Dict[str, Any]:
+    """compute_actions() through the single-flight layer; callers get their own copy."""
+    await asyncio.to_thread(_ensure_ledger_db, force=refresh)
+    key = await _plan_key(account, overrides)
+    res = await _planner.do(key, lambda: asyncio.to_thread(compute_actions, account, override_prices=overrides or None))
+    return copy.deepcopy(res)
 
 def _gmtime_iso(ts: int) -> str:
     return time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(ts))
 
 # ---------- Ledger DB fetch/inspect -------------------------------------
 
-def _ensure_ledger_db(force: bool = False) -> None:
+def _ensure_ledger_db(force: bool = False, full: bool = False) -> Optional[Dict[str, Any]]:
     """
     If LEDGER_DB_GCS and LEDGER_DB are set and the local file is missing (or force=True),
-    download gs://... to the local path (e.g., /tmp/ledger.db).
+    sync gs://... into the local path (e.g., /tmp/ledger.db). An unchanged remote costs one
+    metadata request; otherwise only the page deltas since the last sync are fetched
+    (full=True always re-downloads the checkpoint). See apps/infra/ledger_sync.py.
     """
     gcs_uri = os.getenv("LEDGER_DB_GCS")
     local_path = os.getenv("LEDGER_DB")
     if not gcs_uri or not local_path:
-        return
+        return None
     if (not force) and os.path.exists(local_path):
-        return
+        return None
 
     try:
-        if not gcs_uri.startswith("gs://"):
-            return
-        rest = gcs_uri[5:]
-        bucket_name, blob_name = rest.split("/", 1)
-
-        from google.cloud import storage  # lazy import
-        Path(local_path).parent.mkdir(parents=True, exist_ok=True)
-        client = storage.Client()
-        bucket = client.bucket(bucket_name)
-        blob = bucket.blob(blob_name)
-        blob.download_to_filename(local_path)
-    except Exception:
+        sync = ledger_sync_for(gcs_uri, local_path)
+        return sync.pull(full=full) if sync else None
+    except Exception as e:
         # Don't fail requests; /plan has a fallback path, and debug endpoints can diagnose
-        pass
+        return {"action": "error", "error": f"{e.__class__.__name__}: {e}"}
 
 def _db_info() -> Dict[str, Any]:
     """Return concise info about the local DB to help debug planner hookup."""
@@ -195,7 +181,8 @@ def _db_info() -> Dict[str, Any]:
 
     # Try to introspect tables + price columns + sample symbols
     try:
-        con = sqlite3.connect(path)
+        mgr = get_manager(path)
+        con = mgr.reader()
         cur = con.cursor()
         # tables
         cur.execute("SELECT name FROM sqlite_master WHERE type='table'")
@@ -223,8 +210,7 @@ def _db_info() -> Dict[str, Any]:
             d["symbols"] = symbols
         except Exception as e:
             d["price_introspect_error"] = f"{e.__class__.__name__}: {e}"
-        finally:
-            con.close()
+        d["pool"] = mgr.stats()
     except Exception as e:
         d["open_error"] = f"{e.__class__.__name__}: {e}"
     return d
@@ -232,6 +218,7 @@ def _db_info() -> Dict[str, Any]:
 # Best‑effort fetch on startup (also done per-request)
 @app.on_event("startup")
 def _startup_fetch_db():
+    _BUILD.commit()  # resolve once, off the request path
     _ensure_ledger_db(force=False)
 
 # ------------------------------------------------------------------------
@@ -243,17 +230,17 @@ def _startup_fetch_db():
 @app.get("/healthz",     include_in_schema=False, tags=["meta"])
 @app.get("/readyz",      include_in_schema=False, tags=["meta"])
 @app.get("/_ah/health",  include_in_schema=False, tags=["meta"])
-def health_all():
+async def health_all():
     return {"ok": True, **_mode_payload()}
 
 @app.get("/mode", tags=["meta"])
-def mode():
+async def mode():
     return _mode_payload()
 
 @app.get("/myip", tags=["meta"])
-def myip():
+async def myip():
     try:
-        r = requests.get("https://api.ipify.org?format=json", timeout=5)
+        r = await run_io(requests.get, "https://api.ipify.org?format=json", timeout=5)
         return {"egress_ip": (r.json() or {}).get("ip")}
     except Exception as e:
         return {"error": f"ipify failed: {e.__class__.__name__}"}
@@ -274,21 +261,26 @@ def planner_force_dbfetch():
     local = os.getenv("LEDGER_DB")
     if not gcs_uri or not local:
         raise HTTPException(status_code=400, detail="LEDGER_DB_GCS and/or LEDGER_DB not set")
-    _ensure_ledger_db(force=True)
+    sync = _ensure_ledger_db(force=True, full=True)
     exists = os.path.exists(local)
     size = os.path.getsize(local) if exists else 0
     mtime = _gmtime_iso(int(os.path.getmtime(local))) if exists else None
-    return {"ok": True, "status": {"gcs": gcs_uri, "local": local, "downloaded": True, "exists": exists, "size": size, "mtime_utc": mtime}, **_mode_payload()}
+    return {"ok": True, "status": {"gcs": gcs_uri, "local": local, "downloaded": True, "exists": exists, "size": size, "mtime_utc": mtime, "sync": sync}, **_mode_payload()}
+
+@app.get("/state_debug", tags=["debug"])
+def state_debug():
+    """Latency counters of the state backend (per operation, since process start)."""
+    return {"ok": True, "state": io_stats(), **_mode_payload()}
 
 @app.get("/planner_debug_db", tags=["debug"])
 def planner_debug_db():
     """Return introspection of the local DB file the planner will use."""
-    return {"ok": True, "db": _db_info(), **_mode_payload()}
+    return {"ok": True, "db": _db_info(), "planner": _planner.stats(), **_mode_payload()}
 
 # --- NEW: price appender -------------------------------------------------
 
 @app.get("/prices_append", tags=["ingest"])
-def prices_append(
+async def prices_append(
     symbol: Optional[List[str]] = Query(default=None),
     commit: int = 1,
     refresh: int = 1,
@@ -302,10 +294,10 @@ def prices_append(
     if expected and x_app_key != expected:
         raise HTTPException(status_code=401, detail="missing/invalid app key")
 
-    _ensure_ledger_db(force=bool(refresh))
-
     pairs = symbol or ["BTC-USD", "ETH-USD", "SOL-USD", "LINK-USD"]
-    prices = _fetch_public_prices(pairs)
+    # the DB sync and the spot fetch are independent
+    _, prices = await asyncio.gather(asyncio.to_thread(_ensure_ledger_db, force=bool(refresh)),
+                                     _afetch_public_prices(pairs))
     if not prices:
         raise HTTPException(status_code=502, detail="price fetch failed")
 
@@ -313,81 +305,59 @@ def prices_append(
     if not local or not os.path.exists(local):
         raise HTTPException(status_code=500, detail="local DB missing")
 
-    con = sqlite3.connect(local)
-    cur = con.cursor()
+    ts, inserted = await asyncio.to_thread(_insert_prices, local, prices)
 
-    cols = [r[1] for r in cur.execute("PRAGMA table_info(price)").fetchall()]
-    lower = [c.lower() for c in cols]
-    if "ts" not in lower:
-        con.close()
-        raise HTTPException(status_code=500, detail="price.ts missing")
+    # Upload back to GCS: only the pages this insert touched, or a checkpoint now and then;
+    # the analytics fallback (state/latest_prices.json) is written alongside
+    pushed = None
+    if commit:
+        sync = ledger_sync_for(os.getenv("LEDGER_DB_GCS") or "", local)
+        pushed, _ = await asyncio.gather(run_io(sync.push) if sync else asyncio.sleep(0),
+                                             awrite_json("state/latest_prices.json", prices),
+                                             return_exceptions=True)
+        if isinstance(pushed, BaseException):
+            e = pushed
+            raise HTTPException(status_code=500, detail=f"GCS upload failed: {e.__class__.__name__}: {e}")
 
-    symcol = "symbol" if "symbol" in lower else ("instrument_id" if "instrument_id" in lower else None)
-    pxcol  = "px" if "px" in lower else ("price" if "price" in lower else None)
-    if not symcol or not pxcol:
-        con.close()
-        raise HTTPException(status_code=500, detail="price.{symbol/px} missing")
+    return {"ok": True, "ts": ts, "inserted": inserted, "prices": prices, "upload": pushed, **_mode_payload()}
 
-    ts = int(time.time())
-    inserted: List[str] = []
-    for s, px in prices.items():
-        try:
-            cur.execute(f"SELECT 1 FROM price WHERE {symcol}=? AND ts=?", (s, ts))
-            if cur.fetchone():
-                continue
-            cur.execute(
-                f"INSERT INTO price(ts, {symcol}, {pxcol}, source) VALUES (?, ?, ?, ?)",
-                (ts, s, float(px), "cb_spot"),
-            )
-            inserted.append(s)
-        except Exception as e:
-            inserted.append(f"{s}:ERR:{e.__class__.__name__}")
-    con.commit()
-    con.close()
+def _insert_prices(local: str, prices: Dict[str, float]) -> tuple:
+    mgr = get_manager(local)
+    with mgr.writer() as con:
+        cur = con.cursor()
 
-    # Upload back to GCS (best-effort)
-    if commit:
-        gcs_uri = os.getenv("LEDGER_DB_GCS")
-        try:
-            if gcs_uri and gcs_uri.startswith("gs://"):
-                from google.cloud import storage
-                bucket_name, blob_name = gcs_uri[5:].split("/", 1)
-                client = storage.Client()
-                bucket = client.bucket(bucket_name)
-                # try rename flow for atomic swap
-                try:
-                    tmp_blob = bucket.blob(blob_name + ".tmp")
-                    tmp_blob.upload_from_filename(local)
-                    bucket.rename_blob(tmp_blob, new_name=blob_name)
-                except Exception:
-                    # fallback: direct upload to final
-                    blob = bucket.blob(blob_name)
-                    blob.upload_from_filename(local)
-        except Exception as e:
-            raise HTTPException(status_code=500, detail=f"GCS upload failed: {e.__class__.__name__}: {e}")
+        cols = [r[1] for r in cur.execute("PRAGMA table_info(price)").fetchall()]
+        lower = [c.lower() for c in cols]
+        if "ts" not in lower:
+            raise HTTPException(status_code=500, detail="price.ts missing")
 
-        # refresh analytics fallback
-        try:
-            write_json("state/latest_prices.json", prices)
-        except Exception:
-            pass
+        symcol = "symbol" if "symbol" in lower else ("instrument_id" if "instrument_id" in lower else None)
+        pxcol  = "px" if "px" in lower else ("price" if "price" in lower else None)
+        if not symcol or not pxcol:
+            raise HTTPException(status_code=500, detail="price.{symbol/px} missing")
 
-    return {"ok": True, "ts": ts, "inserted": inserted, "prices": prices, **_mode_payload()}
+        ensure_price_daily(con)  # built here, by the writer, never by the loaders
+        ts = int(time.time())
+        inserted: List[str] = []
+        for s, px in prices.items():
+            try:
+                cur.execute(f"SELECT 1 FROM price WHERE {symcol}=? AND ts=?", (s, ts))
+                if cur.fetchone():
+                    continue
+                cur.execute(
+                    f"INSERT INTO price(ts, {symcol}, {pxcol}, source) VALUES (?, ?, ?, ?)",
+                    (ts, s, float(px), "cb_spot"),
+                )
+                inserted.append(s)
+            except Exception as e:
+                inserted.append(f"{s}:ERR:{e.__class__.__name__}")
+    return ts, inserted
 
 # ------------------------------------------------------------------------
 # plan + paper apply
 # ------------------------------------------------------------------------
 
-@app.get("/plan", tags=["planner"])
-def plan(refresh: int = 0, pair: Optional[List[str]] = Query(default=None), debug: int = 0):
-    """
-    Returns the current plan JSON.
-    If the planner's DB is unavailable, returns a no-trade fallback with prices from GCS or Coinbase.
-    Optional what-if overrides:
-      /plan?pair=BTC-USD=125000&pair=SOL-USD=177
-    """
-    _ensure_ledger_db(force=bool(refresh))
-
+def _parse_overrides(pair: Optional[List[str]]) -> Dict[str, float]:
     overrides: Dict[str, float] = {}
     for kv in (pair or []):
         if "=" in kv:
@@ -396,29 +366,69 @@ def plan(refresh: int = 0, pair: Optional[List[str]] = Query(default=None), debu
                 overrides[k.strip()] = float(v)
             except Exception:
                 pass
+    return overrides
 
+@app.get("/plan", tags=["planner"])
+async def plan(refresh: int = 0, pair: Optional[List[str]] = Query(default=None), debug: int = 0):
+    """
+    Returns the current plan JSON.
+    If the planner's DB is unavailable, returns a no-trade fallback with prices from GCS or Coinbase.
+    Optional what-if overrides:
+      /plan?pair=BTC-USD=125000&pair=SOL-USD=177
+    """
+    overrides = _parse_overrides(pair)
     try:
-        return compute_actions("trading", override_prices=overrides or None)
+        return await _compute_actions("trading", overrides or None, refresh=bool(refresh))
     except Exception as e:
         # Fallback: try last saved prices in GCS, otherwise public spot
-        prices = read_json("state/latest_prices.json", default=None)
-        if not prices:
-            targets = _load_targets_from_policy()
-            prices = _fetch_public_prices(_pairs_from_targets(targets))
-        balances = read_json("state/balances.json", default={}) or {}
+        prices, balances = await _fallback_state()
+        balances = balances or {}
         note = f"planner_fallback: {e.__class__.__name__}"
         if debug:
             note += f" | {e}"
         return {
             "account": "trading",
-            "prices": prices or {},
+            "prices": prices,
             "balances": balances,
             "actions": [],
             "note": note,
             "config": {"band": None},
         }
 
-def _append_snapshots(ts: int, nav_before: float, nav_after: float, turnover_usd: float, actions_count: int, source: str):
+@app.get("/plan_batch", tags=["planner"])
+async def plan_batch(account: List[str] = Query(default=["trading"]), pair: Optional[List[str]] = Query(default=None),
+                     refresh: int = 0, debug: int = 0):
+    """
+    Plans for several accounts in one call, against one shared price snapshot and policy:
+      /plan_batch?account=sleeve_a&account=sleeve_b   (or account=sleeve_a,sleeve_b)
+    Balances: "trading" reads state/balances.json, like /plan, so its plan matches /plan's;
+    every other account reads its latest ledger balance_snapshot rows.
+    `pair` overrides work as in /plan.
+    """
+    accounts = list(dict.fromkeys(a.strip() for v in account for a in v.split(",") if a.strip()))
+    if not accounts:
+        raise HTTPException(status_code=400, detail="no accounts")
+    overrides = _parse_overrides(pair)
+    try:
+        await asyncio.to_thread(_ensure_ledger_db, force=bool(refresh))
+        try:
+            pol = get_policy().content_hash
+        except PolicyError:
+            pol = None
+        bal_gen = await ageneration("state/balances.json") if STATE_ACCOUNT in accounts else 0
+        key = ("batch", tuple(accounts), tuple(sorted(overrides.items())),
+               db_token(Path(os.getenv("LEDGER_DB", "/tmp/ledger.db"))), bal_gen, pol)
+        res = await _planner.do(key, lambda: asyncio.to_thread(compute_batch, accounts, override_prices=overrides or None))
+        return copy.deepcopy(res)
+    except Exception as e:
+        note = f"planner_fallback: {e.__class__.__name__}"
+        if debug:
+            note += f" | {e}"
+        prices, _ = await _fallback_state()
+        return {"prices": prices, "config": {"band": None}, "note": note,
+                "plans": {a: {"account": a, "balances": {}, "nav": None, "actions": []} for a in accounts}}
+
+async def _append_snapshots(ts: int, nav_before: float, nav_after: float, turnover_usd: float, actions_count: int, source: str):
     rec = {
         "ts": ts,
         "nav_before": round(nav_before, 2),
@@ -429,12 +439,14 @@ def _append_snapshots(ts: int, nav_before: float, nav_after: float, turnover_usd
         "revision": os.getenv("K_REVISION", "n/a"),
         "commit": True,
     }
-    append_jsonl("snapshots/daily.jsonl", rec)
-    if _is_sunday(ts):
-        append_jsonl("snapshots/weekly.jsonl", rec)
+    await _append_snapshot_rec(ts, rec)
+
+async def _append_snapshot_rec(ts: int, rec: Dict[str, Any]):
+    logs = ["snapshots/daily.jsonl"] + (["snapshots/weekly.jsonl"] if _is_sunday(ts) else [])
+    await gather_io(*(aappend_jsonl(p, rec) for p in logs))
 
 @app.get("/apply_paper", tags=["planner"])
-def apply_paper(
+async def apply_paper(
     commit: int = 0,
     refresh: int = 0,
     x_app_key: Optional[str] = Header(None),
@@ -445,21 +457,20 @@ def apply_paper(
     if expected and x_app_key != expected:
         raise HTTPException(status_code=401, detail="missing/invalid app key")
 
-    _ensure_ledger_db(force=bool(refresh))
+    bal_path = "state/balances.json"
+
+    # The plan (local DB) and the current balances (GCS) are independent; fetch both at once.
+    plan_res, bal_res = await asyncio.gather(_compute_actions("trading", refresh=bool(refresh)), aread_json(bal_path, default=None), return_exceptions=True)
 
     # Get plan (fail => 503 for commit, fallback for dry-run)
-    try:
-        plan_obj = compute_actions("trading")
-    except Exception as e:
+    if isinstance(plan_res, Exception):
+        e = plan_res
         if commit:
             raise HTTPException(status_code=503, detail=f"planner unavailable: {e.__class__.__name__}")
         else:
-            prices = read_json("state/latest_prices.json", default=None)
-            if not prices:
-                targets = _load_targets_from_policy()
-                prices = _fetch_public_prices(_pairs_from_targets(targets))
-            balances_before = read_json("state/balances.json", default={}) or {}
-            nav = _nav(balances_before, prices or {})
+            prices, balances_before = await _fallback_state()
+            balances_before = balances_before or {}
+            nav = _nav(balances_before, prices)
             msg = f"planner_fallback: {e.__class__.__name__}"
             if debug:
                 msg += f" | {e}"
@@ -473,28 +484,25 @@ def apply_paper(
                 "note": msg,
             }
 
+    plan_obj = plan_res
     actions = plan_obj.get("actions", [])
     prices  = plan_obj.get("prices", {}) or {}
 
-    bal_path    = "state/balances.json"
     ts          = int(time.time())
     ts_str      = _ts_str(ts)
-    run_id      = _mode_payload()["run_id"]
+    run_id      = str(uuid.uuid4())
     trades_path = f"trades/{ts_str[:8]}.jsonl"
     plan_path   = f"plans/plan_{ts_str}_{run_id}.json"
 
-    # Read balances (tolerant for dry-run)
+    # Balances read (tolerant for dry-run)
     balances_before = None
     gcs_read_ok = True
-    try:
-        try:
-            balances_before = read_json(bal_path, default=None)
-        except TypeError:
-            balances_before = read_json(bal_path)
-    except Exception:
+    if isinstance(bal_res, Exception):
         gcs_read_ok = False
         if commit == 1:
-            raise
+            raise bal_res
+    else:
+        balances_before = bal_res
 
     if balances_before is None:
         balances_before = plan_obj.get("balances", {}) or {}
@@ -518,31 +526,34 @@ def apply_paper(
 
     if commit:
         try:
-            write_json(plan_path, plan_obj)
-            write_json(bal_path, balances_after)
+            # every write is independent of the others: issue them together
+            writes = [awrite_json(plan_path, plan_obj), awrite_json(bal_path, balances_after)]
             if prices:
-                write_json("state/latest_prices.json", prices)
+                writes.append(awrite_json("state/latest_prices.json", prices))
 
             if actions:
                 meta = {
                     "ts": ts,
                     "run_id": run_id,
                     "revision": os.getenv("K_REVISION", "n/a"),
-                    "code_commit": _git_commit(),
+                    "code_commit": _BUILD.commit(),
                     "plan_path": plan_path
                 }
+                recs = []
                 for a in actions:
                     rec = dict(meta); rec.update(a)
-                    append_jsonl(trades_path, rec)
+                    recs.append(rec)
+                writes.append(aappend_jsonl_many(trades_path, recs))
 
-            _append_snapshots(
+            writes.append(_append_snapshots(
                 ts=ts,
                 nav_before=nav_before,
                 nav_after=nav_after,
                 turnover_usd=turnover,
                 actions_count=len(actions),
                 source="apply_paper"
-            )
+            ))
+            await gather_io(*writes)
 
             summary["writes"] = {
                 "balances": bal_path,
@@ -565,7 +576,7 @@ def apply_paper(
 # ------------------------------------------------------------------------
 
 @app.get("/snapshot_now", tags=["analytics"])
-def snapshot_now(commit: int = 0, x_app_key: Optional[str] = Header(None), debug: int = 0):
+async def snapshot_now(commit: int = 0, x_app_key: Optional[str] = Header(None), debug: int = 0):
     """
     Record a NAV snapshot using current balances and prices (no trade).
     Fallback if planner DB is unavailable.
@@ -574,19 +585,17 @@ def snapshot_now(commit: int = 0, x_app_key: Optional[str] = Header(None), debug
     if expected and x_app_key != expected:
         raise HTTPException(status_code=401, detail="missing/invalid app key")
 
-    _ensure_ledger_db(force=False)
-
     try:
-        try:
-            plan_obj = compute_actions("trading")
-            prices = plan_obj.get("prices", {}) or {}
-            balances = read_json("state/balances.json", default=None) or plan_obj.get("balances", {}) or {}
-        except Exception:
-            prices = read_json("state/latest_prices.json", default=None)
-            if not prices:
-                targets = _load_targets_from_policy()
-                prices = _fetch_public_prices(_pairs_from_targets(targets))
-            balances = read_json("state/balances.json", default={}) or {}
+        plan_res, gcs_bal = await asyncio.gather(_compute_actions("trading"), aread_json("state/balances.json", default=None),
+                                                 return_exceptions=True)
+        if isinstance(gcs_bal, Exception):
+            raise gcs_bal
+        if not isinstance(plan_res, Exception):
+            prices = plan_res.get("prices", {}) or {}
+            balances = gcs_bal or plan_res.get("balances", {}) or {}
+        else:
+            prices, balances = await _fallback_state()
+            balances = balances or {}
         balances.setdefault("USD", 0.0)
 
         nav = _nav(balances, prices or {})
@@ -603,9 +612,7 @@ def snapshot_now(commit: int = 0, x_app_key: Optional[str] = Header(None), debug
                 "revision": os.getenv("K_REVISION", "n/a"),
                 "commit": True,
             }
-            append_jsonl("snapshots/daily.jsonl", rec)
-            if _is_sunday(ts):
-                append_jsonl("snapshots/weekly.jsonl", rec)
+            await _append_snapshot_rec(ts, rec)
 
         return {"ok": True, "committed": bool(commit), "ts": ts, "nav": round(nav, 2)}
     except Exception as e:
@@ -613,87 +620,85 @@ def snapshot_now(commit: int = 0, x_app_key: Optional[str] = Header(None), debug
             raise HTTPException(status_code=500, detail=f"snapshot failed: {e.__class__.__name__}: {e}")
         raise
 
+# Parsed snapshots/daily.jsonl, refreshed from the log cursor on each call.
+_equity_cache = EquityCache(lambda: ndjson_log("snapshots/daily.jsonl"))
+
 def _equity_series(days: int = 365) -> List[Dict[str, float]]:
-    rows = _safe_read_ndjson("snapshots/daily.jsonl")
-    if not rows:
+    try:
+        return _equity_cache.window(days)
+    except Exception:
         return []
-    rows = sorted(rows, key=lambda r: int(r.get("ts", 0)))
-    cutoff = int(time.time()) - days * 86400
-    out = []
-    for r in rows:
-        ts = int(r.get("ts", 0))
-        if ts >= cutoff:
-            nav = r.get("nav")
-            if nav is None:
-                nav = r.get("nav_after", 0.0)
-            out.append({"ts": ts, "nav": float(nav)})
-    return out
-
-def _metrics_from_series(series: List[Dict[str, float]]) -> Dict[str, float]:
-    if len(series) < 2:
-        last = series[-1]["nav"] if series else None
+
+def _metrics_from_stats(st: PerfStats) -> Dict[str, Any]:
+    if st.n < 2:
+        last = st.last_nav
         return {
-            "points": len(series),
+            "points": st.n,
             "last_nav": round(last, 2) if last is not None else None,
             "note": "Not enough data for statistics",
         }
 
-    ts0, nav0 = series[0]["ts"], series[0]["nav"]
-    tsN, navN = series[-1]["ts"], series[-1]["nav"]
-    days = max(1, round((tsN - ts0) / 86400))
-
-    rets = []
-    for i in range(1, len(series)):
-        n0 = series[i - 1]["nav"]
-        n1 = series[i]["nav"]
-        if n0 > 0:
-            rets.append((n1 / n0) - 1.0)
-
-    if len(rets) >= 2:
-        mu_d = statistics.mean(rets)
-        sd_d = statistics.pstdev(rets) if len(rets) > 1 else 0.0
-        vol_ann = (sd_d * math.sqrt(365.0)) if sd_d > 0 else 0.0
-        sharpe = (mu_d / sd_d * math.sqrt(365.0)) if sd_d > 0 else None
-    else:
-        mu_d, vol_ann, sharpe = 0.0, 0.0, None
-
-    total_ret = (navN / nav0) - 1.0 if nav0 > 0 else None
-    cagr = ((navN / nav0) ** (365.0 / days) - 1.0) if (nav0 > 0 and days >= 1) else None
-
-    peak = -1e18
-    maxdd = 0.0
-    for p in series:
-        v = p["nav"]
-        if v > peak:
-            peak = v
-        if peak > 0:
-            dd = (v / peak) - 1.0
-            if dd < maxdd:
-                maxdd = dd
+    def _r(x, nd):
+        return round(x, nd) if x is not None else None
 
     return {
-        "points": len(series),
-        "first_ts": ts0,
-        "last_ts": tsN,
-        "days": days,
-        "first_nav": round(nav0, 2),
-        "last_nav": round(navN, 2),
-        "total_return": round(total_ret, 6) if total_ret is not None else None,
-        "cagr": round(cagr, 6) if cagr is not None else None,
-        "vol_ann": round(vol_ann, 6),
-        "sharpe": round(sharpe, 4) if sharpe is not None else None,
-        "max_drawdown": round(maxdd, 6),
+        "points": st.n,
+        "first_ts": st.first_ts,
+        "last_ts": st.last_ts,
+        "days": st.days,
+        "first_nav": round(st.first_nav, 2),
+        "last_nav": round(st.last_nav, 2),
+        "total_return": _r(st.total_return(), 6),
+        "cagr": _r(st.cagr(), 6),
+        "vol_ann": round(st.vol_ann(), 6),
+        "sharpe": _r(st.sharpe(), 4),
+        "sortino": _r(st.sortino(), 4),
+        "calmar": _r(st.calmar(), 4),
+        "max_drawdown": round(st.max_dd, 6),
+        "max_drawdown_days": st.max_dd_len,
     }
 
+# NAV reconstructed from the ledger (holdings x prices as of each bucket), one per
+# (db, account, resolution); the JSON file next to the DB carries it across restarts.
+_nav_caches: Dict[tuple, NavCache] = {}
+_nav_caches_lock = threading.Lock()
+
+def _ledger_nav_series(days: int, resolution: str, account: str) -> List[Dict[str, float]]:
+    _ensure_ledger_db(force=False)
+    local = os.getenv("LEDGER_DB")
+    if not local or not os.path.exists(local):
+        raise HTTPException(status_code=500, detail="local DB missing")
+    key = (local, account, resolution)
+    nav = _nav_caches.get(key)
+    if nav is None:
+        with _nav_caches_lock:
+            nav = _nav_caches.get(key) or _nav_caches.setdefault(
+                key, NavCache(nav_cache_path(account, resolution, local), account, RESOLUTIONS[resolution]))
+    nav.refresh(get_manager(local).reader())
+    return nav.window(int(time.time()) - days * 86400)
+
 @app.get("/equity_curve", tags=["analytics"])
-def equity_curve(days: int = 365):
-    series = _equity_series(days=days)
+async def equity_curve(days: int = 365, source: str = "snapshots", resolution: str = "daily", account: str = "trading"):
+    """
+    source=snapshots: NAV points logged by apply_paper / snapshot_now.
+    source=ledger: NAV reconstructed from balance_snapshot x price at `resolution` (hourly|daily).
+    """
+    if source == "ledger":
+        if resolution not in RESOLUTIONS:
+            raise HTTPException(status_code=400, detail=f"resolution must be one of {sorted(RESOLUTIONS)}")
+        series = await asyncio.to_thread(_ledger_nav_series, days, resolution, account)
+        return {"ok": True, "days": days, "source": source, "resolution": resolution,
+                "series": series, **_mode_payload()}
+    series = await run_io(_equity_series, days=days)
     return {"ok": True, "days": days, "series": series, **_mode_payload()}
 
 @app.get("/metrics", tags=["analytics"])
-def metrics(days: int = 365):
-    series = _equity_series(days=days)
-    m = _metrics_from_series(series)
+async def metrics(days: int = 365):
+    try:
+        st = await run_io(_equity_cache.window_stats, days)
+    except Exception:
+        st = PerfStats()
+    m = _metrics_from_stats(st)
     return {"ok": True, "days": days, "metrics": m, **_mode_payload()}
 
 # ------------------------------------------------------------------------
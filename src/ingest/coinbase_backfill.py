@@ -0,0 +1,159 @@
+"""Daily Coinbase close backfill into the SQLite ledger (scripts/backfill_prices_coinbase.py).
+
+Only (pair, day) combinations without a daily close yet are requested: a day counts as
+present when it has a coinbase_hist row or a row at CLOSE_TIME (an intraday tick from the
+spot feed does not make it a close). The missing set comes from one range query on price.
+Requests run on a small thread pool behind a shared token bucket; rows are upserted with
+executemany and committed every `batch_size` rows, so a crash loses at most one batch and
+the next run skips whatever was committed. Days the API has no data for (before a listing,
+4xx) go to an NDJSON checkpoint so reruns don't ask again; requests that still fail after
+retries are returned in the stats for the caller to report.
+"""
+from __future__ import annotations
+
+import datetime as _dt
+import json
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+from libs.price_daily import ensure_price_daily
+
+from .common import TokenBucket
+
+API = "https://api.coinbase.com/v2/prices/{pair}/spot?date={date}"
+CLOSE_TIME = " 23:59:59"
+SOURCE = "coinbase_hist"
+
+UPSERT_SQL = """
+    INSERT INTO price(ts,instrument_id,px,source) VALUES(?,?,?,?)
+    ON CONFLICT(ts, instrument_id) DO UPDATE SET
+        px=excluded.px,
+        source=excluded.source
+"""
+
+_EMPTY_STATUS = (400, 404)
+
+
+def day_range(start: _dt.date, end: _dt.date) -> List[str]:
+    """Inclusive list of YYYY-MM-DD strings."""
+    n = (end - start).days
+    return [(start + _dt.timedelta(days=i)).isoformat() for i in range(n + 1)]
+
+
+def read_checkpoint(path: Optional[Path]) -> Set[Tuple[str, str]]:
+    """(pair, day) the API already answered "no data" for."""
+    out: Set[Tuple[str, str]] = set()
+    if path and path.exists():
+        for line in path.read_text(encoding="utf-8").splitlines():
+            try:
+                row = json.loads(line)
+                out.add((row["pair"], row["day"]))
+            except (ValueError, KeyError):
+                continue  # torn last line
+    return out
+
+
+def missing_days(conn: sqlite3.Connection, pairs: Sequence[str], start: _dt.date, end: _dt.date,
+                 skip: Iterable[Tuple[str, str]] = ()) -> List[Tuple[str, str]]:
+    """(pair, day) in [start, end] with no daily close yet, oldest first."""
+    days = day_range(start, end)
+    if not pairs or not days:
+        return []
+    ph = ",".join("?" * len(pairs))
+    have = set(conn.execute(
+        f"""SELECT instrument_id, substr(ts,1,10) FROM price
+            WHERE instrument_id IN ({ph}) AND ts >= ? AND ts <= ?
+              AND (source = ? OR ts = substr(ts,1,10) || ?)""",
+        (*pairs, days[0], days[-1] + CLOSE_TIME, SOURCE, CLOSE_TIME),
+    ).fetchall())
+    have.update(skip)
+    return [(p, d) for d in days for p in pairs if (p, d) not in have]
+
+
+def _status(exc: BaseException) -> Optional[int]:
+    resp = getattr(exc, "response", None)
+    return getattr(resp, "status_code", None)
+
+
+class Backfiller:
+    def __init__(self, conn: sqlite3.Connection, transport: Any = None, rps: Optional[float] = None,
+                 workers: int = 8, batch_size: int = 500, checkpoint: Optional[Path] = None,
+                 retries: int = 3, timeout: float = 10.0):
+        self.conn = conn
+        if transport is None:
+            from libs.spot_prices import RequestsTransport
+            transport = RequestsTransport(pool_size=workers)
+        self.transport = transport
+        self.bucket = TokenBucket(rps) if rps else TokenBucket()
+        self.workers = workers
+        self.batch_size = batch_size
+        self.checkpoint = checkpoint
+        self.retries = retries
+        self.timeout = timeout
+
+    def _fetch(self, pair: str, day: str) -> Optional[float]:
+        """Close for the day, None if the API has no data; raises after `retries` failed tries."""
+        url = API.format(pair=pair, date=day)
+        for attempt in range(self.retries):
+            self.bucket.acquire()
+            try:
+                data = self.transport.get_json(url, self.timeout)
+                amt = ((data or {}).get("data") or {}).get("amount")
+                return float(amt) if amt is not None else None
+            except Exception as e:
+                if _status(e) in _EMPTY_STATUS:
+                    return None
+                if attempt == self.retries - 1:
+                    raise
+                time.sleep(0.5 * 2 ** attempt)
+        return None
+
+    def _flush(self, rows: List[tuple], empty: List[Tuple[str, str]]) -> None:
+        if rows:
+            self.conn.executemany(UPSERT_SQL, rows)
+        self.conn.commit()
+        if empty and self.checkpoint:
+            with open(self.checkpoint, "a", encoding="utf-8") as f:
+                f.write("".join(json.dumps({"pair": p, "day": d}) + "\n" for p, d in empty))
+
+    def run(self, pairs: Sequence[str], start: _dt.date, end: _dt.date) -> Dict[str, Any]:
+        t0 = time.perf_counter()
+        self.conn.executemany("INSERT OR IGNORE INTO instrument(id,symbol,kind) VALUES(?,?,?)",
+                              [(p, p, "crypto") for p in pairs])
+        self.conn.commit()
+        ensure_price_daily(self.conn)  # so the upserts below keep the daily closes current
+        todo = missing_days(self.conn, pairs, start, end, read_checkpoint(self.checkpoint))
+        stats: Dict[str, Any] = {"missing": len(todo), "written": 0, "empty": 0, "failed": 0,
+                                 "failures": []}
+        rows: List[tuple] = []
+        empty: List[Tuple[str, str]] = []
+        ex = ThreadPoolExecutor(max_workers=self.workers)
+        try:
+            futs = {ex.submit(self._fetch, p, d): (p, d) for p, d in todo}
+            for fut in as_completed(futs):
+                p, d = futs[fut]
+                try:
+                    px = fut.result()
+                except Exception as e:
+                    stats["failed"] += 1
+                    stats["failures"].append({"pair": p, "day": d,
+                                              "error": f"{type(e).__name__}: {e}"})
+                    continue
+                if px is None:
+                    empty.append((p, d))
+                    stats["empty"] += 1
+                else:
+                    rows.append((d + CLOSE_TIME, p, px, SOURCE))
+                    stats["written"] += 1
+                if len(rows) + len(empty) >= self.batch_size:
+                    self._flush(rows, empty)
+                    rows, empty = [], []
+        finally:
+            # on Ctrl-C keep what already arrived; the rest is still "missing" next run
+            ex.shutdown(wait=False, cancel_futures=True)
+            self._flush(rows, empty)
+        stats["seconds"] = round(time.perf_counter() - t0, 3)
+        return stats
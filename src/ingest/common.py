@@ -1,10 +1,66 @@
 from __future__ import annotations
 
+import asyncio
 import os
+import threading
+import time
+from typing import Callable, Optional
+
 import pandas as pd  # type: ignore[import-not-found]
 
 RATE_LIMIT_PER_SEC = float(os.getenv("INGEST_RPS", "5"))
 
+
+class TokenBucket:
+    """Thread-safe token bucket: `rate` requests/s on average, bursts of up to `burst`.
+
+    acquire() reserves a token under the lock and sleeps outside it, so concurrent callers
+    queue fairly instead of all waking at once.
+    """
+
+    def __init__(
+        self,
+        rate: float = RATE_LIMIT_PER_SEC,
+        burst: Optional[float] = None,
+        clock: Callable[[], float] = time.monotonic,
+        sleep: Callable[[float], None] = time.sleep,
+    ) -> None:
+        if rate <= 0:
+            raise ValueError("rate must be > 0")
+        self.rate = rate
+        self.burst = burst if burst is not None else max(1.0, rate)
+        self._clock = clock
+        self._sleep = sleep
+        self._lock = threading.Lock()
+        self._tokens = self.burst
+        self._last = clock()
+
+    def _reserve(self, n: float) -> float:
+        """Take `n` tokens (possibly going into debt); return how long to wait for them."""
+        with self._lock:
+            now = self._clock()
+            self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            self._tokens -= n
+            return -self._tokens / self.rate if self._tokens < 0 else 0.0
+
+    def acquire(self, n: float = 1.0) -> float:
+        wait = self._reserve(n)
+        if wait > 0:
+            self._sleep(wait)
+        return wait
+
+
+class AsyncTokenBucket(TokenBucket):
+    """TokenBucket whose acquire() awaits instead of blocking the event loop."""
+
+    async def acquire(self, n: float = 1.0) -> float:  # type: ignore[override]
+        wait = self._reserve(n)
+        if wait > 0:
+            await asyncio.sleep(wait)
+        return wait
+
+
 def bq_write_v3(df: pd.DataFrame, table: str = "crypto.price", if_exists: str = "append") -> None:
     """Write DataFrame to BigQuery (schema v3).
     DRY_RUN=1 will log instead of writing. Set GCP_PROJECT/BQCRED_PATH appropriately.
@@ -15,4 +71,4 @@ def bq_write_v3(df: pd.DataFrame, table: str = "crypto.price", if_exists: str =
     from google.cloud import bigquery  # type: ignore[import-not-found]
     client = bigquery.Client(project=os.getenv("GCP_PROJECT"))
     job = client.load_table_from_dataframe(df, table)
-    job.result()
\ No newline at end of file
+    job.result()
@@ -1,11 +1,18 @@
 from __future__ import annotations
 
+import asyncio
 import os
 import time
-from typing import List
+from typing import Any, Callable, Dict, List, Optional, Sequence
 
 import pandas as pd  # type: ignore[import-not-found]
 
+from .common import AsyncTokenBucket, bq_write_v3
+
+COLUMNS = ["exchange", "symbol", "ts", "open", "high", "low", "close", "volume"]
+PAGE_LIMIT = 1000
+CHUNK_ROWS = 50_000
+
 def backfill(symbol: str, days: int = 30, timeframe: str = "1h") -> pd.DataFrame:
     """Return OHLCV DataFrame for the last `days` (mockable via MOCK_INGEST=1)."""
     if os.getenv("MOCK_INGEST", "0") == "1":
@@ -48,3 +55,140 @@ def backfill(symbol: str, days: int = 30, timeframe: str = "1h") -> pd.DataFrame
     df.insert(0, "exchange", "binance")
     df.insert(1, "symbol", symbol)
     return df
+
+
+# ---------- streaming ingest ----------
+
+def timeframe_ms(timeframe: str) -> int:
+    units = {"m": 60_000, "h": 3_600_000, "d": 86_400_000}
+    return int(timeframe[:-1]) * units[timeframe[-1]]
+
+
+class MockExchange:
+    """Async stand-in for ccxt's binance: flat 1.0 candles up to now (MOCK_INGEST=1, tests)."""
+
+    def __init__(self, now_ms: Optional[int] = None):
+        self.now_ms = now_ms
+        self.calls = 0
+
+    async def fetch_ohlcv(self, symbol: str, timeframe: str = "1h", since: Optional[int] = None,
+                          limit: int = PAGE_LIMIT) -> List[List[float]]:
+        self.calls += 1
+        step = timeframe_ms(timeframe)
+        now = self.now_ms if self.now_ms is not None else int(time.time() * 1000)
+        end = now // step * step
+        t = -(-int(since or 0) // step) * step
+        out: List[List[float]] = []
+        while t <= end and len(out) < limit:
+            out.append([t, 1.0, 1.0, 1.0, 1.0, 0.0])
+            t += step
+        await asyncio.sleep(0)
+        return out
+
+    async def close(self) -> None:
+        pass
+
+
+def _exchange() -> Any:
+    if os.getenv("MOCK_INGEST", "0") == "1":
+        return MockExchange()
+    import ccxt.async_support as ccxt_async  # type: ignore[import-not-found]
+    return ccxt_async.binance({"enableRateLimit": False})  # paced by our own limiter
+
+
+def _frame(rows: List[tuple]) -> pd.DataFrame:
+    df = pd.DataFrame(rows, columns=["symbol", "ts", "open", "high", "low", "close", "volume"])
+    df["ts"] = pd.to_datetime(df["ts"], unit="ms", utc=True)
+    df.insert(0, "exchange", "binance")
+    return df[COLUMNS]
+
+
+async def _produce(ex: Any, symbol: str, since_ms: int, timeframe: str, limiter: AsyncTokenBucket,
+                   queue: "asyncio.Queue", limit: int) -> None:
+    while True:
+        await limiter.acquire()
+        batch = await ex.fetch_ohlcv(symbol, timeframe=timeframe, since=since_ms, limit=limit)
+        if not batch:
+            return
+        await queue.put((symbol, batch))  # blocks while the writer is behind
+        since_ms = int(batch[-1][0]) + 1
+        if len(batch) < limit:
+            return
+
+
+async def _consume(queue: "asyncio.Queue", write: Callable[[pd.DataFrame, str], Any], table: str,
+                   chunk_rows: int) -> Dict[str, Any]:
+    stats: Dict[str, Any] = {"rows": 0, "chunks": 0, "pages": 0, "max_buffered": 0, "symbols": {}}
+    buf: List[tuple] = []
+
+    async def flush(rows: List[tuple]) -> None:
+        # the write runs in a thread, so pages keep arriving while it is in flight
+        await asyncio.to_thread(write, _frame(rows), table)
+        stats["chunks"] += 1
+
+    while True:
+        item = await queue.get()
+        if item is None:
+            break
+        symbol, batch = item
+        stats["pages"] += 1
+        stats["rows"] += len(batch)
+        stats["symbols"][symbol] = stats["symbols"].get(symbol, 0) + len(batch)
+        buf.extend((symbol, *c[:6]) for c in batch)
+        stats["max_buffered"] = max(stats["max_buffered"], len(buf))
+        while len(buf) >= chunk_rows:
+            chunk, buf = buf[:chunk_rows], buf[chunk_rows:]
+            await flush(chunk)
+    if buf:
+        await flush(buf)
+    return stats
+
+
+async def stream_ingest(
+    symbols: Sequence[str],
+    days: int = 30,
+    timeframe: str = "1h",
+    write: Callable[[pd.DataFrame, str], Any] = bq_write_v3,
+    table: str = "crypto.price",
+    exchange: Any = None,
+    limiter: Optional[AsyncTokenBucket] = None,
+    chunk_rows: int = CHUNK_ROWS,
+    queue_pages: int = 8,
+    limit: int = PAGE_LIMIT,
+) -> Dict[str, Any]:
+    """
+    Page OHLCV for all `symbols` concurrently (one shared INGEST_RPS limiter) and hand the
+    rows to `write` in chunks of at most `chunk_rows` as they arrive. The page queue is
+    bounded, so memory is about chunk_rows + queue_pages pages whatever `days` is.
+    """
+    ex = exchange if exchange is not None else _exchange()
+    limiter = limiter or AsyncTokenBucket()
+    queue: asyncio.Queue = asyncio.Queue(maxsize=queue_pages)
+    since_ms = int((pd.Timestamp.utcnow() - pd.Timedelta(days=days)).timestamp() * 1000)
+
+    producers = asyncio.ensure_future(asyncio.gather(
+        *(_produce(ex, s, since_ms, timeframe, limiter, queue, limit) for s in symbols)))
+    consumer = asyncio.ensure_future(_consume(queue, write, table, chunk_rows))
+    try:
+        await asyncio.wait({producers, consumer}, return_when=asyncio.FIRST_COMPLETED)
+        if consumer.done():
+            consumer.result()  # the writer failed: surface it (finally cancels the fetchers)
+        await producers
+        await queue.put(None)
+        stats = await consumer
+    finally:
+        pending = [t for t in (producers, consumer) if not t.done()]
+        for t in pending:
+            t.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+        if exchange is None:
+            await ex.close()
+    return stats
+
+
+def ingest(symbols: Sequence[str], days: int = 30, timeframe: str = "1h", **kw: Any) -> Dict[str, Any]:
+    """Blocking wrapper around stream_ingest (scripts, jobs)."""
+    t0 = time.perf_counter()
+    stats = asyncio.run(stream_ingest(symbols, days, timeframe, **kw))
+    stats["seconds"] = round(time.perf_counter() - t0, 3)
+    return stats
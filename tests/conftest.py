@@ -0,0 +1,36 @@
+import sqlite3
+from pathlib import Path
+
+import pytest
+
+SCHEMA = Path(__file__).resolve().parents[1] / "schema" / "schema.sql"
+
+
+@pytest.fixture
+def ledger():
+    """Empty in-memory ledger built from schema/schema.sql; each test seeds the rows it needs."""
+    conn = sqlite3.connect(":memory:", check_same_thread=False)  # the backfill writes from a pool
+    conn.executescript(SCHEMA.read_text(encoding="utf-8"))
+    yield conn
+    conn.close()
+
+
+@pytest.fixture
+def price_db():
+    """
+    Factory for a bare `price` table in either ledger flavour: make() is schema.sql's TEXT ts +
+    instrument_id, make("symbol", "INTEGER") the epoch/symbol one. Keyed on (symbol, ts), so
+    INSERT OR REPLACE upserts a tick.
+    """
+    conns = []
+
+    def make(symcol: str = "instrument_id", ts_type: str = "TEXT", path=":memory:"):
+        conn = sqlite3.connect(path)
+        conn.execute(f"CREATE TABLE price (ts {ts_type} NOT NULL, {symcol} TEXT, px REAL NOT NULL, "
+                     f"source TEXT, PRIMARY KEY ({symcol}, ts))")
+        conns.append(conn)
+        return conn
+
+    yield make
+    for conn in conns:
+        conn.close()
@@ -0,0 +1,93 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import time
+
+from fastapi.testclient import TestClient
+
+import apps.infra.state_gcs as state_gcs
+import service.main as svc
+
+PLAN = {
+    "account": "trading",
+    "prices": {"BTC-USD": 100.0},
+    "balances": {"USD": 1000.0, "BTC-USD": 0.0},
+    "actions": [{"symbol": "BTC-USD", "side": "buy", "qty": 1.0, "usd": 100.0}],
+}
+
+
+def test_apply_paper_issues_gcs_writes_concurrently(monkeypatch):
+    store = {"state/balances.json": {"USD": 1000.0}}
+    wrote = []
+    live, peak = [0], [0]
+    lock = threading.Lock()
+
+    def slow(kind):
+        def fn(path, obj, *a, **kw):
+            with lock:
+                live[0] += 1
+                peak[0] = max(peak[0], live[0])
+            time.sleep(0.2)
+            with lock:
+                live[0] -= 1
+                wrote.append((kind, path))
+        return fn
+
+    monkeypatch.setattr(state_gcs, "read_json", lambda path, default=None: store.get(path, default))
+    monkeypatch.setattr(state_gcs, "generation", lambda path: 1)
+    monkeypatch.setattr(state_gcs, "write_json", slow("json"))
+    monkeypatch.setattr(state_gcs, "append_jsonl", slow("log"))
+    monkeypatch.setattr(state_gcs, "append_jsonl_many", slow("log"))
+    monkeypatch.setattr(svc, "compute_actions", lambda account, override_prices=None: dict(PLAN))
+    monkeypatch.setattr(svc, "_ensure_ledger_db", lambda force=False, full=False: None)
+    monkeypatch.delenv("APP_KEY", raising=False)
+
+    t0 = time.perf_counter()
+    r = TestClient(svc.app).get("/apply_paper?commit=1")
+    took = time.perf_counter() - t0
+    assert r.status_code == 200, r.text
+    body = r.json()
+    assert body["nav_before"] == 1000.0 and body["nav_after"] == 900.0 + 100.0
+    paths = sorted(p for _, p in wrote)
+    assert "state/balances.json" in paths and "state/latest_prices.json" in paths
+    assert any(p.startswith("plans/") for p in paths) and any(p.startswith("trades/") for p in paths)
+    assert peak[0] >= 4  # plan, balances, prices, trades, snapshots together
+    assert took < 0.2 * len(wrote) / 2
+
+
+def test_plan_burst_runs_the_planner_once(monkeypatch):
+    runs = []
+
+    def compute(account, override_prices=None):
+        runs.append(override_prices)
+        time.sleep(0.1)
+        return dict(PLAN)
+
+    gen = [1]
+    monkeypatch.setattr(state_gcs, "generation", lambda path: gen[0])
+    monkeypatch.setattr(svc, "compute_actions", compute)
+    monkeypatch.setattr(svc, "_ensure_ledger_db", lambda force=False, full=False: None)
+    svc._planner.forget()
+
+    client = TestClient(svc.app)
+    with ThreadPoolExecutor(8) as pool:
+        res = list(pool.map(lambda _: client.get("/plan").json(), range(8)))
+    assert all(r["actions"] == PLAN["actions"] for r in res)
+    assert len(runs) == 1
+    client.get("/plan?pair=BTC-USD=120")  # different overrides: a different key
+    gen[0] = 2  # balances.json rewritten
+    client.get("/plan")
+    assert runs == [None, {"BTC-USD": 120.0}, None]
+
+
+def test_plan_batch_endpoint(monkeypatch):
+    bal = {"a": {"USD": 1000.0}, "b": {"USD": 0.0, "BTC-USD": 0.01}}
+    monkeypatch.setattr("apps.rebalancer.batch.ledger_balances", lambda accounts: {x: bal[x] for x in accounts})
+    monkeypatch.setattr(svc, "_ensure_ledger_db", lambda force=False, full=False: None)
+    svc._planner.forget()
+    with TestClient(svc.app) as client:
+        r = client.get("/plan_batch", params={"account": "a,b", "pair": ["BTC-USD=100000", "ETH-USD=3000",
+                                                                             "LINK-USD=20", "SOL-USD=150"]})
+    body = r.json()
+    assert r.status_code == 200 and set(body["plans"]) == {"a", "b"}, body
+    assert all(x["side"] == "buy" for x in body["plans"]["a"]["actions"])
+    assert body["plans"]["b"]["nav"] == 1000.0
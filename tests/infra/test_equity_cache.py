@@ -0,0 +1,44 @@
+from apps.infra.blobstore import LocalBlobStore
+from apps.infra.equity_cache import EquityCache
+from apps.infra.ndjson_log import SegmentedLog
+
+
+class CountingStore(LocalBlobStore):
+    def __init__(self, root):
+        super().__init__(root)
+        self.bytes_read = 0
+
+    def read(self, name, start=0, generation=None):
+        data = super().read(name, start=start, generation=generation)
+        self.bytes_read += len(data)
+        return data
+
+
+def test_incremental_refresh_reads_only_new_bytes(tmp_path):
+    store = CountingStore(tmp_path)
+    log = SegmentedLog(store, "snapshots/daily.jsonl", compact_threshold=4)
+    cache = EquityCache(lambda: log)
+    now = 1_000 * 86400
+    for d in range(20):
+        log.append({"ts": now - (20 - d) * 86400, "nav": 100.0 + d})
+    assert len(cache.window(365, now=now)) == 20
+
+    store.bytes_read = 0
+    assert len(cache.window(365, now=now)) == 20
+    assert store.bytes_read == 0  # unchanged log: metadata only
+
+    for d in range(6):  # crosses a compaction
+        log.append({"ts": now + d, "nav": 200.0 + d})
+    assert store.bytes_read == 0
+    series = cache.window(365, now=now)
+    assert len(series) == 26
+    assert store.bytes_read < 6 * 60
+    assert [p["nav"] for p in cache.window(5, now=now)][:3] == [115.0, 116.0, 117.0]
+
+
+def test_out_of_order_points_stay_sorted(tmp_path):
+    log = SegmentedLog(LocalBlobStore(tmp_path), "snapshots/daily.jsonl")
+    cache = EquityCache(lambda: log)
+    for ts in (30, 10, 20):
+        log.append({"ts": ts, "nav_after": float(ts)})
+    assert [p["ts"] for p in cache.window(1, now=40)] == [10, 20, 30]
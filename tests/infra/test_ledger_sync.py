@@ -0,0 +1,115 @@
+import sqlite3
+
+from apps.infra.blobstore import LocalBlobStore
+from apps.infra.ledger_sync import LedgerSync
+from libs.db import ConnectionManager
+
+
+def _replica(store, path, **kw):
+    return LedgerSync(store, "db/ledger.db", path, manager=ConnectionManager(path), **kw)
+
+
+def _seed(path):
+    con = sqlite3.connect(path)
+    con.execute("CREATE TABLE price (ts INTEGER, symbol TEXT, px REAL, PRIMARY KEY (symbol, ts))")
+    con.execute("CREATE TABLE pad (b BLOB)")
+    con.executemany("INSERT INTO pad VALUES (?)", [(b"x" * 3000,) for _ in range(200)])
+    con.commit()
+    con.close()
+
+
+def _rows(sync):
+    return sync.manager.reader().execute("SELECT ts, symbol, px FROM price ORDER BY ts").fetchall()
+
+
+def test_push_pull_ships_only_changed_pages(tmp_path):
+    store = LocalBlobStore(tmp_path / "bucket")
+    a = _replica(store, tmp_path / "a" / "ledger.db")
+    b = _replica(store, tmp_path / "b" / "ledger.db")
+    (tmp_path / "a").mkdir()
+    _seed(a.local)
+
+    first = a.push()
+    assert first["action"] == "checkpoint"
+    assert b.pull()["action"] == "checkpoint"
+    assert b.pull()["action"] == "noop"
+
+    with a.manager.writer() as con:
+        con.execute("INSERT INTO price VALUES (1, 'BTC-USD', 100.0)")
+    up = a.push()
+    assert up["action"] == "delta" and up["seq"] == 1
+    assert up["bytes"] < first["bytes"] / 10
+
+    down = b.pull()
+    assert down["action"] == "delta" and down["bytes"] == up["bytes"]
+    assert [tuple(r) for r in _rows(b)] == [(1, "BTC-USD", 100.0)]
+    assert b.local.read_bytes() == a.local.read_bytes()
+
+    # b writes next; a catches up from the delta b pushed
+    with b.manager.writer() as con:
+        con.execute("INSERT INTO price VALUES (2, 'ETH-USD', 5.0)")
+    assert b.push()["action"] == "delta"
+    assert a.pull()["action"] == "delta"
+    assert [tuple(r) for r in _rows(a)] == [(1, "BTC-USD", 100.0), (2, "ETH-USD", 5.0)]
+
+
+def test_checkpoint_rollover_and_unpushed_local_edits(tmp_path):
+    store = LocalBlobStore(tmp_path / "bucket")
+    a = _replica(store, tmp_path / "a" / "ledger.db", max_deltas=2)
+    b = _replica(store, tmp_path / "b" / "ledger.db")
+    (tmp_path / "a").mkdir()
+    _seed(a.local)
+    a.push()
+    b.pull()
+
+    actions = []
+    for i in range(3):
+        with a.manager.writer() as con:
+            con.execute("INSERT INTO price VALUES (?, 'BTC-USD', 1.0)", (i,))
+        actions.append(a.push()["action"])
+    assert actions == ["delta", "delta", "checkpoint"]
+    assert [s.name for s in store.list("db/ledger.db.deltas/")] == []
+
+    # an edit on b that was never pushed is discarded by the next refresh, as a download would
+    with b.manager.writer() as con:
+        con.execute("INSERT INTO price VALUES (99, 'SOL-USD', 1.0)")
+    assert b.pull()["action"] == "checkpoint"
+    assert [r[0] for r in _rows(b)] == [0, 1, 2]
+
+
+def test_checkpoint_survives_a_manifest_race(tmp_path):
+    class Racy(LocalBlobStore):
+        hook = None
+
+        def put(self, name, data, if_generation_match=None, **kw):
+            if name.endswith(".manifest.json") and self.hook:
+                hook, self.hook = self.hook, None
+                hook()  # another writer swaps the manifest first
+            return super().put(name, data, if_generation_match=if_generation_match, **kw)
+
+    store = Racy(tmp_path / "bucket")
+    a = _replica(store, tmp_path / "a" / "ledger.db")
+    b = _replica(store, tmp_path / "b" / "ledger.db")
+    c = _replica(store, tmp_path / "c" / "ledger.db")
+    (tmp_path / "a").mkdir()
+    (tmp_path / "b").mkdir()
+    _seed(a.local)
+    _seed(b.local)
+    a.push()
+
+    def a_pushes():
+        with a.manager.writer() as con:
+            con.execute("INSERT INTO price VALUES (1, 'BTC-USD', 1.0)")
+        assert a.push()["action"] == "delta"
+
+    with b.manager.writer() as con:
+        con.execute("INSERT INTO price VALUES (2, 'ETH-USD', 2.0)")
+    store.hook = a_pushes
+    res = b.push()  # b never synced: checkpoint, whose manifest swap loses once and retries
+    assert res["action"] == "checkpoint" and res["conflict"]
+
+    assert c.pull()["action"] == "checkpoint"
+    assert [r[1] for r in _rows(c)] == ["ETH-USD"]
+    assert [s.name for s in store.list("db/ledger.db.ckpt/")] == [f"db/ledger.db.ckpt/{res['epoch']}"]
+    assert store.stat("db/ledger.db").metadata["ledger_epoch"] == res["epoch"]
+    assert a.pull()["action"] == "checkpoint" and [r[1] for r in _rows(a)] == ["ETH-USD"]
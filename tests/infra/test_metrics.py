@@ -0,0 +1,61 @@
+import pytest
+
+import apps.infra.metrics as metrics
+import apps.infra.state_gcs as state_gcs
+from apps.infra.blobstore import MemoryBlobStore
+from apps.infra.state_gcs import StateBackend
+
+PXS = [100.0, 104.0, 98.0, 101.0, 107.0]
+
+
+@pytest.fixture
+def backend():
+    b = StateBackend(MemoryBlobStore())
+    prev = state_gcs.set_backend(b)
+    yield b
+    state_gcs.set_backend(prev)
+
+
+def _record(monkeypatch, i):
+    monkeypatch.setattr(metrics, "_utc_date_str", lambda: f"2025-01-{i + 1:02d}")
+    return metrics.record_daily({"BTC-USD": PXS[i]}, {"USD": 50.0 + i, "BTC-USD": 1.0}, "c0", "h0")
+
+
+def _replayed():
+    rows = sorted(state_gcs.read_ndjson(metrics.NAV_LOG), key=lambda r: r["date"])
+    return metrics._stats(metrics._series_nav(rows))
+
+
+def test_state_tracks_log_and_replays_after_foreign_append(backend, monkeypatch):
+    for i in range(3):
+        _record(monkeypatch, i)
+    st = state_gcs.read_json(metrics.STATE_PATH)
+    assert st["records"] == 3 and st["log_size"] == state_gcs.ndjson_log(metrics.NAV_LOG).size()
+    assert metrics.compute_summary()["strategy"] == _replayed()
+
+    # a record the running stats never saw: the summary and the next update replay the log
+    state_gcs.append_jsonl(metrics.NAV_LOG, {"date": "2025-01-04", "nav": 150.0, "prices": {"BTC-USD": 100.0}})
+    assert metrics.compute_summary()["records"] == 4
+    _record(monkeypatch, 4)
+    st = state_gcs.read_json(metrics.STATE_PATH)
+    assert st["records"] == 5
+    assert metrics.compute_summary()["strategy"] == _replayed()
+
+
+def test_lost_state_race_retries_on_the_new_generation(backend, monkeypatch):
+    _record(monkeypatch, 0)
+    read = metrics.read_json
+    raced = []
+
+    def racy_read(path, default=None):
+        out = read(path, default)
+        if path == metrics.STATE_PATH and not raced:
+            raced.append(1)
+            state_gcs.write_json(path, {"records": 0, "log_size": -1})  # someone else's write
+        return out
+
+    monkeypatch.setattr(metrics, "read_json", racy_read)
+    _record(monkeypatch, 1)
+    assert raced and backend.stats()["write"]["errors"] == 1
+    st = state_gcs.read_json(metrics.STATE_PATH)
+    assert st["records"] == 2 and metrics.compute_summary()["strategy"] == _replayed()
@@ -0,0 +1,60 @@
+import json
+import threading
+
+from apps.infra.blobstore import LocalBlobStore, PreconditionFailed
+from apps.infra.ndjson_log import SegmentedLog
+
+
+def test_append_read_and_compact(tmp_path):
+    log = SegmentedLog(LocalBlobStore(tmp_path), "snapshots/daily.jsonl", compact_threshold=4)
+    for i in range(10):
+        log.append({"ts": i, "nav": 100.0 + i})
+    assert [r["ts"] for r in log.read()] == list(range(10))
+    # threshold 4 => at most 3 segments left pending
+    assert len(log.store.list(log.prefix)) < 4
+    assert log.compact()
+    assert log.store.list(log.prefix) == []
+    base = (tmp_path / "snapshots" / "daily.jsonl").read_text().splitlines()
+    assert len(base) == 10
+
+
+def test_reader_skips_absorbed_segments_left_behind(tmp_path):
+    store = LocalBlobStore(tmp_path)
+    log = SegmentedLog(store, "trades/20250101.jsonl", compact_threshold=100)
+    for i in range(3):
+        log.append({"i": i})
+    segs = store.list(log.prefix)
+    # simulate a compactor that committed the new base and crashed before deleting
+    store.compose(log.path, [s.name for s in segs], if_generation_match=0,
+                  metadata={"compacted": json.dumps([[s.name, s.size] for s in segs])})
+    assert [r["i"] for r in log.read()] == [0, 1, 2]
+    log.append({"i": 3})
+    assert log.compact()
+    assert [r["i"] for r in log.read()] == [0, 1, 2, 3]
+
+
+def test_create_is_exclusive(tmp_path):
+    store = LocalBlobStore(tmp_path)
+    store.create("a", b"1")
+    try:
+        store.create("a", b"2")
+        assert False, "second create should fail"
+    except PreconditionFailed:
+        pass
+
+
+def test_concurrent_appends_never_drop_records(tmp_path):
+    log = SegmentedLog(LocalBlobStore(tmp_path), "snapshots/daily.jsonl", compact_threshold=3)
+
+    def worker(k):
+        for i in range(25):
+            log.append({"w": k, "i": i})
+
+    threads = [threading.Thread(target=worker, args=(k,)) for k in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    rows = log.read()
+    assert len(rows) == 100
+    assert {(r["w"], r["i"]) for r in rows} == {(k, i) for k in range(4) for i in range(25)}
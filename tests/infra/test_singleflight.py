@@ -0,0 +1,52 @@
+import asyncio
+
+import pytest
+
+from apps.infra.singleflight import SingleFlight
+
+
+def test_concurrent_callers_share_one_run_and_result_is_memoized():
+    sf = SingleFlight(size=2)
+    runs = []
+
+    async def compute(v):
+        runs.append(v)
+        await asyncio.sleep(0.05)
+        return {"v": v}
+
+    async def main():
+        burst = await asyncio.gather(*(sf.do(("trading", 1), lambda: compute(1)) for _ in range(20)))
+        assert all(r is burst[0] for r in burst)
+        assert await sf.do(("trading", 1), lambda: compute(1)) is burst[0]  # memo hit
+        await sf.do(("trading", 2), lambda: compute(2))  # an input version changed
+        await sf.do(("trading", 3), lambda: compute(3))  # evicts key 1 (size=2)
+        await sf.do(("trading", 1), lambda: compute(1))
+
+    asyncio.run(main())
+    assert runs == [1, 2, 3, 1]
+    assert sf.stats() == {"runs": 4, "hits": 1, "shared": 19, "inflight": 0, "memo": 2}
+
+
+def test_failures_are_shared_not_memoized_and_cancel_does_not_stop_the_run():
+    sf = SingleFlight()
+    calls = []
+
+    async def boom():
+        calls.append("boom")
+        await asyncio.sleep(0.02)
+        raise RuntimeError("db down")
+
+    async def slow():
+        calls.append("slow")
+        await asyncio.sleep(0.05)
+        return 42
+
+    async def main():
+        res = await asyncio.gather(*(sf.do("k", boom) for _ in range(3)), return_exceptions=True)
+        assert all(isinstance(r, RuntimeError) for r in res) and calls == ["boom"]
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(sf.do("k", slow), 0.01)  # the caller gives up ...
+        assert await sf.do("k", slow) == 42  # ... the run it started is joined, not restarted
+
+    asyncio.run(main())
+    assert calls == ["boom", "slow"]
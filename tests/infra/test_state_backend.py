@@ -0,0 +1,108 @@
+import pytest
+
+import apps.infra.blobstore as blobstore
+import apps.infra.state_gcs as state_gcs
+from apps.infra.blobstore import LocalBlobStore, MemoryBlobStore
+from apps.infra.state_gcs import StateBackend
+
+
+@pytest.fixture(params=["memory", "local"])
+def backend(request, tmp_path):
+    store = MemoryBlobStore() if request.param == "memory" else LocalBlobStore(tmp_path)
+    b = StateBackend(store)
+    prev = state_gcs.set_backend(b)
+    yield b
+    state_gcs.set_backend(prev)
+
+
+def test_helpers_go_through_the_swapped_backend(backend):
+    assert state_gcs.read_json("state/plan.json", default={}) == {}
+    assert state_gcs.generation("state/plan.json") == 0
+    state_gcs.write_json("state/plan.json", {"a": 1})
+    g1 = state_gcs.generation("state/plan.json")
+    state_gcs.write_json_many({"state/plan.json": {"a": 2}, "state/balances.json": {"USD": 10}})
+    assert state_gcs.generation("state/plan.json") > g1
+    got = state_gcs.read_json_many(["state/plan.json", "state/balances.json", "state/missing.json"], default=None)
+    assert got == {"state/plan.json": {"a": 2}, "state/balances.json": {"USD": 10}, "state/missing.json": None}
+
+    state_gcs.append_jsonl("trades/x.jsonl", {"i": 0})
+    state_gcs.append_jsonl_many("trades/x.jsonl", [{"i": 1}, {"i": 2}])
+    assert [r["i"] for r in state_gcs.read_ndjson("trades/x.jsonl")] == [0, 1, 2]
+    assert state_gcs.selftest()[0]
+
+    ops = state_gcs.io_stats()["ops"]
+    assert ops["write"]["calls"] == 4  # 1 + 2 + selftest
+    assert ops["read"]["calls"] >= 4 and ops["read"]["errors"] == 0
+
+
+def test_compaction_deletes_segments_in_one_call(backend):
+    calls = []
+    orig = backend.store.delete_many
+    backend.store.delete_many = lambda names: (calls.append(list(names)), orig(names))
+    log = backend.log("snapshots/daily.jsonl")
+    for i in range(5):
+        log.store.create(f"{log.prefix}{i:020d}-x", f'{{"i":{i}}}\n'.encode())
+    assert log.compact()
+    assert len(calls) == 1 and len(calls[0]) == 5
+    assert backend.store.list(log.prefix) == []
+    assert [r["i"] for r in log.read()] == list(range(5))
+
+
+def test_gcs_client_is_shared_and_pooled(monkeypatch):
+    import google.auth
+    from google.auth.credentials import AnonymousCredentials
+
+    monkeypatch.setattr(google.auth, "default", lambda scopes=None: (AnonymousCredentials(), "proj"))
+    monkeypatch.setattr(blobstore, "_CLIENTS", {})
+    monkeypatch.setenv("GCS_POOL_SIZE", "7")
+    c = blobstore.gcs_client()
+    assert blobstore.gcs_client() is c
+    assert c.project == "proj"
+    assert c._http.get_adapter("https://storage.googleapis.com")._pool_maxsize == 7
+
+
+def test_cache_serves_unchanged_objects_without_download(tmp_path):
+    store = MemoryBlobStore()
+    b = StateBackend(store, cache=state_gcs.StateCache(tmp_path / "cache"))
+    b.write_json("state/balances.json", {"USD": 100.0})
+    got = b.read_json("state/balances.json")
+    got["USD"] = 0.0  # callers get a copy
+    assert b.read_json("state/balances.json") == {"USD": 100.0}
+    assert "read" not in b.stats()  # write-through: only generation checks so far
+    assert b.stats()["stat"]["calls"] == 2
+
+    store.put("state/balances.json", b'{"USD": 50.0}')  # another writer
+    assert b.read_json("state/balances.json") == {"USD": 50.0}
+    assert b.stats()["read"]["calls"] == 1
+
+    # a fresh process with the same cache dir starts warm
+    b2 = StateBackend(store, cache=state_gcs.StateCache(tmp_path / "cache"))
+    assert b2.read_json("state/balances.json") == {"USD": 50.0}
+    assert "read" not in b2.stats() and b2.cache.stats()["disk_hits"] == 1
+
+    store.delete("state/balances.json")
+    assert b.read_json("state/balances.json", default={}) == {}
+    assert b.read_json("plans/x.json", default=1) == 1  # outside the cached prefixes
+    assert "stat" in b.stats() and b.stats()["read"]["calls"] == 2
+
+
+def test_default_cache_is_namespaced_per_backend(tmp_path, monkeypatch):
+    monkeypatch.setenv("STATE_CACHE_DIR", str(tmp_path / "cache"))
+    monkeypatch.delenv("STATE_CACHE", raising=False)
+    seen = {}
+    for name in ("a", "b"):
+        monkeypatch.setenv("STATE_DIR", str(tmp_path / name))
+        state_gcs.set_backend(None)
+        b = state_gcs.backend()
+        state_gcs.write_json("state/balances.json", {"USD": name})  # generation 1 in both stores
+        seen[name] = b.cache.root
+    state_gcs.set_backend(None)
+    assert seen["a"] != seen["b"] and seen["a"].parent == seen["b"].parent == tmp_path / "cache"
+
+    # a fresh process on store "a" must not be handed store "b"'s entry for the same generation
+    monkeypatch.setenv("STATE_DIR", str(tmp_path / "a"))
+    prev = state_gcs.set_backend(None)
+    try:
+        assert state_gcs.read_json("state/balances.json") == {"USD": "a"}
+    finally:
+        state_gcs.set_backend(prev)
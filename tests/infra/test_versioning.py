@@ -0,0 +1,58 @@
+import json
+import os
+
+import apps.infra.versioning as versioning
+from apps.infra.versioning import BuildInfo
+
+
+def _build(tmp_path):
+    cfg = tmp_path / "policy.json"
+    cfg.write_text(json.dumps({"profile": "p1", "targets_trading": {"BTC": 1.0}}), encoding="utf-8")
+    baked = tmp_path / "BUILD_COMMIT"
+    baked.write_text("baked123\n", encoding="utf-8")
+    return BuildInfo(base=tmp_path, cfg_path=cfg, commit_file=baked), cfg
+
+
+def test_commit_resolution_order(tmp_path, monkeypatch):
+    monkeypatch.setattr(versioning, "_git_commit", lambda: "gitsha")
+    monkeypatch.setenv("GIT_COMMIT", " envsha ")
+    assert _build(tmp_path)[0].commit() == "envsha"
+
+    monkeypatch.delenv("GIT_COMMIT")
+    assert _build(tmp_path)[0].commit() == "baked123"
+    (tmp_path / "BUILD_COMMIT").write_text("\n", encoding="utf-8")  # empty file: fall through to git
+    assert BuildInfo(base=tmp_path, commit_file=tmp_path / "BUILD_COMMIT").commit() == "gitsha"
+    assert BuildInfo(base=tmp_path, commit_file=tmp_path / "missing").commit() == "gitsha"
+
+    monkeypatch.setattr(versioning, "_git_commit", lambda: None)
+    b = BuildInfo(base=tmp_path, commit_file=tmp_path / "missing")
+    assert b.commit() == "n/a" and b.commit("unknown") == "unknown"
+    monkeypatch.setenv("GIT_COMMIT", "late")
+    assert b.commit() == "n/a"  # resolved once per process
+
+
+def test_config_rehashed_only_when_mtime_or_size_change(tmp_path, monkeypatch):
+    b, cfg = _build(tmp_path)
+    os.utime(cfg, ns=(1_000_000_000, 1_000_000_000))
+    reads = []
+    read_text = type(cfg).read_text
+    monkeypatch.setattr(type(cfg), "read_text", lambda self, *a, **kw: reads.append(self) or read_text(self, *a, **kw))
+
+    h1, j1 = b.config_hash(), b.config_json_hash()
+    assert b.config()["profile"] == "p1" and b.config_hash() == h1
+    assert len(reads) == 1
+
+    got = b.config()
+    got["profile"] = "edited"  # callers get a copy
+    assert b.config()["profile"] == "p1"
+
+    # same size, new mtime: re-read
+    cfg.write_text(json.dumps({"profile": "p2", "targets_trading": {"BTC": 1.0}}), encoding="utf-8")
+    os.utime(cfg, ns=(2_000_000_000, 2_000_000_000))
+    assert b.config()["profile"] == "p2" and b.config_hash() != h1 and b.config_json_hash() != j1
+    assert len(reads) == 2
+
+    # same mtime, new size: re-read
+    cfg.write_text(json.dumps({"profile": "p33", "targets_trading": {"BTC": 1.0}}), encoding="utf-8")
+    os.utime(cfg, ns=(2_000_000_000, 2_000_000_000))
+    assert b.config()["profile"] == "p33" and len(reads) == 3
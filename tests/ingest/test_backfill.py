@@ -19,3 +19,35 @@ def test_symbol_handling():
     assert not df.empty
     assert df["symbol"].iloc[0] == "ETH/USDT"
     assert len(df) == 24  # 1 day of hourly data
+
+def test_stream_ingest_chunks_and_bounded_buffer():
+    """Several symbols page concurrently; the writer sees bounded chunks as they arrive."""
+    import asyncio
+    from src.ingest.common import AsyncTokenBucket
+    from src.ingest.ingest_binance import MockExchange, stream_ingest
+
+    chunks = []
+    ex = MockExchange()
+    stats = asyncio.run(stream_ingest(
+        ["BTC/USDT", "ETH/USDT", "SOL/USDT"], days=90, write=lambda df, table: chunks.append(len(df)),
+        exchange=ex, limiter=AsyncTokenBucket(rate=1000), chunk_rows=1000, queue_pages=2, limit=500,
+    ))
+    per_symbol = set(stats["symbols"].values())
+    assert len(per_symbol) == 1 and per_symbol.pop() in (24 * 90, 24 * 90 + 1)
+    assert sum(chunks) == stats["rows"] and max(chunks) == 1000
+    assert stats["max_buffered"] < 1000 + 500  # one chunk plus one page, whatever `days` is
+    assert ex.calls >= stats["pages"]
+
+
+def test_stream_ingest_writer_error_stops_fetchers():
+    import asyncio
+    import pytest
+    from src.ingest.common import AsyncTokenBucket
+    from src.ingest.ingest_binance import MockExchange, stream_ingest
+
+    def boom(df, table):
+        raise RuntimeError("bq down")
+
+    with pytest.raises(RuntimeError, match="bq down"):
+        asyncio.run(stream_ingest(["BTC/USDT"], days=365, write=boom, exchange=MockExchange(),
+                                  limiter=AsyncTokenBucket(rate=1000), chunk_rows=100, limit=100))
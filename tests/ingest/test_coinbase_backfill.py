@@ -0,0 +1,65 @@
+import datetime as dt
+import threading
+
+from src.ingest.coinbase_backfill import Backfiller, missing_days
+from src.ingest.common import TokenBucket
+
+class _NotFound(Exception):
+    class response:
+        status_code = 404
+
+
+class FakeCoinbase:
+    def __init__(self, listed=dt.date(2024, 1, 3), fail_once=(), fail_always=()):
+        self.listed = listed
+        self.fail_once = set(fail_once)
+        self.fail_always = set(fail_always)
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def get_json(self, url, timeout):
+        pair = url.split("/")[5]
+        day = url.rsplit("=", 1)[1]
+        with self._lock:
+            self.calls.append((pair, day))
+            if (pair, day) in self.fail_once or (pair, day) in self.fail_always:
+                self.fail_once.discard((pair, day))
+                raise ConnectionError("reset")
+        if dt.date.fromisoformat(day) < self.listed:
+            raise _NotFound()
+        return {"data": {"amount": str(int(day[-2:]) + (1000 if pair == "BTC-USD" else 0))}}
+
+
+def test_backfill_only_fetches_missing_and_resumes(ledger, tmp_path):
+    conn = ledger
+    conn.execute("INSERT INTO price(ts,instrument_id,px,source) VALUES('2024-01-05 23:59:59','BTC-USD',1.0,'x')")
+    conn.execute("INSERT INTO price(ts,instrument_id,px,source) VALUES('2024-01-06 12:00:00','BTC-USD',2.0,'cb_spot')")
+    ckpt = tmp_path / "ckpt.jsonl"
+    start, end = dt.date(2024, 1, 1), dt.date(2024, 1, 10)
+
+    api = FakeCoinbase(fail_once=[("ETH-USD", "2024-01-07")], fail_always=[("ETH-USD", "2024-01-09")])
+    bf = Backfiller(conn, api, rps=1000, workers=4, batch_size=3, checkpoint=ckpt, retries=2)
+    stats = bf.run(["BTC-USD", "ETH-USD"], start, end)
+    assert ("BTC-USD", "2024-01-05") not in api.calls  # a close at CLOSE_TIME is present
+    assert ("BTC-USD", "2024-01-06") in api.calls  # an intraday spot tick is not a close
+    assert stats == {**stats, "missing": 19, "written": 14, "empty": 4, "failed": 1}
+    assert stats["failures"] == [{"pair": "ETH-USD", "day": "2024-01-09", "error": "ConnectionError: reset"}]
+
+    closes = dict(conn.execute("SELECT substr(ts,1,10), px FROM price WHERE instrument_id='ETH-USD'").fetchall())
+    assert closes["2024-01-07"] == 7.0 and "2024-01-02" not in closes
+
+    # second run: everything is in the DB or known-empty in the checkpoint, except the failure
+    api2 = FakeCoinbase()
+    stats2 = Backfiller(conn, api2, rps=1000, checkpoint=ckpt).run(["BTC-USD", "ETH-USD"], start, end)
+    assert stats2["missing"] == 1 and api2.calls == [("ETH-USD", "2024-01-09")]
+    assert missing_days(conn, ["BTC-USD"], dt.date(2024, 1, 3), dt.date(2024, 1, 11)) == [("BTC-USD", "2024-01-11")]
+
+
+def test_token_bucket_paces_after_burst():
+    now = [0.0]
+    slept = []
+    tb = TokenBucket(rate=10, burst=2, clock=lambda: now[0], sleep=slept.append)
+    waits = [tb.acquire() for _ in range(4)]
+    assert waits[:2] == [0.0, 0.0]
+    assert [round(w, 3) for w in waits[2:]] == [0.1, 0.2]
+    assert slept == waits[2:]
@@ -0,0 +1,80 @@
+import pytest
+
+from libs.balances import BalanceProjector
+
+def _seed(conn):
+    conn.executemany("INSERT INTO balance_snapshot VALUES(?,?,?,?)",
+                     [("2024-01-01 00:00:00", "trading", "USD", 1000.0),
+                      ("2024-01-01 00:00:00", "trading", "BTC-USD", 1.0)])
+    return conn
+
+
+def _trade(conn, i, ts, side, qty, px, fee=0.0, fee_inst="USD"):
+    conn.execute("INSERT INTO trade(id,ts,account_id,instrument_id,side,qty,px,fee_qty,fee_instrument_id) "
+                 "VALUES(?,?,?,?,?,?,?,?,?)", (f"tr{i:04d}", ts, "trading", "BTC-USD", side, qty, px, fee, fee_inst))
+
+
+def _brute(conn, upto):
+    bal = {"USD": 1000.0, "BTC-USD": 1.0}
+    for side, qty, px, fee, fi in conn.execute(
+            "SELECT side, qty, px, fee_qty, fee_instrument_id FROM trade WHERE ts<=? ORDER BY ts, id", (upto,)):
+        s = 1 if side == "buy" else -1
+        bal["BTC-USD"] += s * qty
+        bal["USD"] -= s * qty * px
+        bal[fi] -= fee
+    return bal
+
+
+def test_as_of_matches_full_replay_with_checkpoints(ledger):
+    conn = _seed(ledger)
+    for i in range(50):
+        _trade(conn, i, f"2024-01-02 00:{i:02d}:00", "buy" if i % 3 else "sell", 0.01, 100 + i,
+               fee=0.0001 if i % 5 == 0 else 0.5, fee_inst="BTC-USD" if i % 5 == 0 else "USD")
+    conn.execute("INSERT INTO transfer(id,ts,from_account_id,to_account_id,instrument_id,qty) "
+                 "VALUES('x1','2024-01-02 00:30:30','trading','cold','BTC-USD',0.25)")
+    conn.execute("INSERT INTO income(id,ts,account_id,instrument_id,kind,qty,fmv_usd) "
+                 "VALUES('i1','2024-01-02 00:40:30','trading','USD','interest',3.0,3.0)")
+    proj = BalanceProjector(conn, every=8)
+    assert proj.refresh() == 6  # 2 seed rows + 52 events
+
+    for t in ("2024-01-02 00:05:00", "2024-01-02 00:33:00", "2024-01-02 00:49:00"):
+        want = _brute(conn, t)
+        if t > "2024-01-02 00:30:30":
+            want["BTC-USD"] -= 0.25
+        if t > "2024-01-02 00:40:30":
+            want["USD"] += 3.0
+        assert proj.as_of(t) == pytest.approx(want)
+    assert proj.as_of("2023-12-31") == {}
+    assert proj.as_of("2024-01-01 00:00:00") == {"USD": 1000.0, "BTC-USD": 1.0}
+
+
+def test_backdated_event_invalidates_checkpoints(ledger):
+    conn = _seed(ledger)
+    for i in range(20):
+        _trade(conn, i, f"2024-02-01 00:{i:02d}:00", "buy", 0.1, 10)
+    proj = BalanceProjector(conn, every=5)
+    proj.refresh()
+    assert proj.refresh() == 0  # nothing new
+    _trade(conn, 99, "2024-01-15 00:00:00", "sell", 1.0, 50)
+    assert proj.refresh() == 4
+    assert proj.as_of() == pytest.approx({"USD": 1000.0 - 20.0 + 50.0, "BTC-USD": 1.0 + 2.0 - 1.0})
+
+
+def test_later_set_balances_resets_only_its_instruments(ledger):
+    conn = _seed(ledger)
+    _trade(conn, 1, "2024-01-02 00:00:00", "buy", 0.5, 100)
+    proj = BalanceProjector(conn, every=2)
+    proj.refresh()
+    # second set_balances run: USD reconciled, ETH seeded at its own ts; BTC untouched
+    conn.execute("INSERT INTO balance_snapshot VALUES('2024-01-03 00:00:00','trading','USD',500.0)")
+    conn.execute("INSERT INTO balance_snapshot VALUES('2024-01-03 00:00:05','trading','ETH-USD',2.0)")
+    _trade(conn, 2, "2024-01-03 00:00:00", "buy", 0.1, 100)  # same ts as the reset: included in it
+    _trade(conn, 3, "2024-01-04 00:00:00", "sell", 0.5, 200)
+    proj.refresh()
+    assert proj.as_of("2024-01-02 12:00:00") == pytest.approx({"USD": 950.0, "BTC-USD": 1.5})
+    assert proj.as_of() == pytest.approx({"USD": 600.0, "BTC-USD": 1.1, "ETH-USD": 2.0})
+
+    # a back-dated reset invalidates the checkpoints built past it
+    conn.execute("INSERT INTO balance_snapshot VALUES('2024-01-02 06:00:00','trading','BTC-USD',3.0)")
+    assert proj.refresh() > 0
+    assert proj.as_of() == pytest.approx({"USD": 600.0, "BTC-USD": 2.6, "ETH-USD": 2.0})
@@ -0,0 +1,86 @@
+import numpy as np
+
+from libs.covariance import CovarianceCache, EwmaCov, portfolio_vol
+from libs.price_daily import ensure_price_daily
+
+SYMS = ["BTC-USD", "ETH-USD"]
+
+
+def _db(price_db, closes):
+    conn = price_db("symbol", "INTEGER")
+    ensure_price_daily(conn)
+    _add(conn, closes, 0)
+    return conn
+
+
+def _add(conn, closes, first_day):
+    t0 = 1_704_067_200 + 3600
+    for i, row in enumerate(closes):
+        for s, px in zip(SYMS, row):
+            conn.execute("INSERT OR REPLACE INTO price(ts, symbol, px) VALUES (?,?,?)", (t0 + (first_day + i) * 86400, s, float(px)))
+    conn.commit()
+
+
+def _closes(n, seed=0):
+    rng = np.random.default_rng(seed)
+    common = rng.normal(0, 0.03, n)
+    rets = np.column_stack([common + rng.normal(0, 0.01, n), 1.3 * common + rng.normal(0, 0.01, n)])
+    return 100 * np.cumprod(1 + rets, axis=0)
+
+
+def test_rolling_full_covariance_and_incremental_refresh(price_db, tmp_path):
+    px = _closes(80)
+    conn = _db(price_db, px[:60])
+    cache = CovarianceCache(tmp_path / "cov.json", SYMS, window=30).refresh(conn)
+    rets = px[1:60] / px[:59] - 1
+    ref = np.cov(rets[-30:], rowvar=False)
+    assert np.allclose(cache.cov(), ref)
+
+    w = {"BTC-USD": 0.6, "ETH-USD": 0.4}
+    full = cache.portfolio_vol(w)
+    diag = np.sqrt((0.36 * ref[0, 0] + 0.16 * ref[1, 1]) * 365)
+    assert abs(full - portfolio_vol(ref, [0.6, 0.4])) < 1e-12 and full > diag  # correlated legs
+
+    # 20 more days arrive: a fresh object resumes from the file and reads only the new closes
+    _add(conn, px[60:], 60)
+    again = CovarianceCache(tmp_path / "cov.json", SYMS, window=30).refresh(conn)
+    assert np.allclose(again.cov(), np.cov((px[1:] / px[:-1] - 1)[-30:], rowvar=False))
+
+
+def test_ewma_matches_batch_and_today_stays_provisional(price_db, tmp_path):
+    px = _closes(50, seed=1)
+    conn = _db(price_db, px[:40])
+    CovarianceCache(tmp_path / "ewma.json", SYMS, method="ewma").refresh(conn)
+    _add(conn, px[40:], 40)
+    inc = CovarianceCache(tmp_path / "ewma.json", SYMS, method="ewma").refresh(conn)
+
+    batch = EwmaCov(2)
+    for r in px[1:] / px[:-1] - 1:
+        batch.update(r)
+    assert np.allclose(inc.cov(), batch.cov())
+
+    # a later tick moves today's close; the next refresh picks it up instead of a stale value
+    _add(conn, [px[-1] * 1.1], 49)
+    moved = CovarianceCache(tmp_path / "ewma.json", SYMS, method="ewma").refresh(conn)
+    assert moved.last_date == inc.last_date
+    assert not np.allclose(moved.cov(), inc.cov())
+
+
+def test_closes_written_behind_the_last_day_rebuild_the_estimate(price_db, tmp_path):
+    px = _closes(40, seed=2)
+    conn = _db(price_db, px[:30])
+    conn.execute("DELETE FROM price WHERE symbol='ETH-USD' AND ts=?", (1_704_067_200 + 3600 + 10 * 86400,))
+    conn.commit()  # day 10 lacks an ETH close, so dense() drops it
+    CovarianceCache(tmp_path / "cov.json", SYMS, method="ewma").refresh(conn)
+
+    _add(conn, px[10:11], 10)  # the missing close arrives late, then a backfilled edit further back
+    _add(conn, px[5:6] * 1.05, 5)
+    _add(conn, px[30:], 30)
+    got = CovarianceCache(tmp_path / "cov.json", SYMS, method="ewma").refresh(conn)
+
+    want = px.copy()
+    want[5] *= 1.05
+    batch = EwmaCov(2)
+    for r in want[1:] / want[:-1] - 1:
+        batch.update(r)
+    assert np.allclose(got.cov(), batch.cov())
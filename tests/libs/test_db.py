@@ -0,0 +1,98 @@
+import os
+import sqlite3
+import threading
+
+from libs.db import ConnectionManager
+
+
+def _make_db(path, px):
+    con = sqlite3.connect(path)
+    con.execute("CREATE TABLE price (ts INTEGER, symbol TEXT, px REAL)")
+    con.execute("INSERT INTO price VALUES (1, 'BTC-USD', ?)", (px,))
+    con.commit()
+    con.close()
+
+
+def test_readers_are_per_thread_and_reused(tmp_path):
+    _make_db(tmp_path / "l.db", 1.0)
+    mgr = ConnectionManager(tmp_path / "l.db")
+    seen = {}
+
+    def work(k):
+        a, b = mgr.reader(), mgr.reader()
+        assert a is b
+        seen[k] = id(a)
+
+    threads = [threading.Thread(target=work, args=(k,)) for k in range(3)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(set(seen.values())) == 3
+    assert (mgr.reader_hits, mgr.reader_misses) == (3, 3)
+    assert mgr.reader().execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+
+
+def test_writer_commits_rolls_back_and_checkpoints(tmp_path):
+    path = tmp_path / "l.db"
+    _make_db(path, 1.0)
+    mgr = ConnectionManager(path)
+    with mgr.writer() as con:
+        con.execute("INSERT INTO price VALUES (2, 'BTC-USD', 2.0)")
+    try:
+        with mgr.writer() as con:
+            con.execute("INSERT INTO price VALUES (3, 'BTC-USD', 3.0)")
+            raise ValueError("boom")
+    except ValueError:
+        pass
+    assert mgr.reader().execute("SELECT COUNT(*) FROM price").fetchone()[0] == 2
+    assert mgr.writer_waits == 2
+
+    mgr.checkpoint()
+    assert os.path.getsize(str(path) + "-wal") == 0
+    # the .db file alone now carries both rows
+    con = sqlite3.connect(f"file:{path}?mode=ro&immutable=1", uri=True)
+    assert con.execute("SELECT COUNT(*) FROM price").fetchone()[0] == 2
+
+
+def test_replace_file_reopens_readers(tmp_path):
+    path = tmp_path / "l.db"
+    _make_db(path, 1.0)
+    mgr = ConnectionManager(path)
+    assert mgr.reader().execute("SELECT px FROM price").fetchone()[0] == 1.0
+    _make_db(tmp_path / "new.db", 5.0)
+    mgr.replace_file(tmp_path / "new.db")
+    assert mgr.reader().execute("SELECT px FROM price").fetchone()[0] == 5.0
+    assert mgr.stats()["generation"] == 1
+
+
+def test_replace_file_leaves_other_threads_queries_running(tmp_path):
+    path = tmp_path / "l.db"
+    _make_db(path, 1.0)
+    mgr = ConnectionManager(path)
+    with mgr.writer() as con:
+        con.executemany("INSERT INTO price VALUES (?, 'BTC-USD', 1.0)", [(i,) for i in range(2, 500)])
+    started, swapped, out = threading.Event(), threading.Event(), {}
+
+    def slow_reader():
+        cur = mgr.reader().execute("SELECT px FROM price")
+        first = cur.fetchmany(10)
+        started.set()
+        swapped.wait(5)
+        out["rest"] = len(first) + len(cur.fetchall())  # same old-file snapshot, handle still open
+        out["after"] = mgr.reader().execute("SELECT px FROM price").fetchall()
+
+    t = threading.Thread(target=slow_reader)
+    t.start()
+    started.wait(5)
+    _make_db(tmp_path / "new.db", 5.0)
+    mgr.replace_file(tmp_path / "new.db")
+    with mgr.writer() as con:  # the new file gets its own WAL
+        con.execute("INSERT INTO price VALUES (2, 'BTC-USD', 6.0)")
+    swapped.set()
+    t.join()
+    assert out["rest"] == 499
+    assert [r[0] for r in out["after"]] == [5.0, 6.0]
+    # the old handle was closed by its own thread without disturbing the new WAL
+    assert [r[0] for r in mgr.reader().execute("SELECT px FROM price ORDER BY ts")] == [5.0, 6.0]
+    assert mgr.stats()["open_connections"] == 3
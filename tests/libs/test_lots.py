@@ -0,0 +1,57 @@
+import pytest
+
+from libs.lots import Fill, LotEngine, LotError
+
+def _buy(ts, qty, px, **kw):
+    return Fill("acct", "BTC-USD", "buy", qty, px, ts, **kw)
+
+
+def _sell(ts, qty, px, **kw):
+    return Fill("acct", "BTC-USD", "sell", qty, px, ts, trade_id="t" + ts, **kw)
+
+
+@pytest.mark.parametrize("method,expect", [
+    ("FIFO", [100.0, 300.0]),
+    ("LIFO", [200.0, 300.0]),
+    ("HIFO", [300.0, 200.0]),
+])
+def test_methods_match_in_order_and_persist(ledger, method, expect):
+    conn = ledger
+    eng = LotEngine(conn, method)
+    eng.apply([_buy("2024-01-01", 1, 100), _buy("2024-01-02", 1, 300), _buy("2024-01-03", 1, 200)])
+    conn.commit()
+    res = LotEngine(conn, method).apply([_sell("2024-02-01", 1.5, 400, fee_usd=30)])[0]
+    conn.commit()
+    opened = dict(conn.execute("SELECT id, open_px FROM lot").fetchall())
+    assert [opened[lid] for lid, *_ in res.matched] == expect
+    assert [q for _, q, _, _ in res.matched] == [1.0, 0.5]
+    # fee comes off proceeds pro rata: 20/unit
+    assert res.realized == pytest.approx((380 - expect[0]) * 1 + (380 - expect[1]) * 0.5)
+    left = conn.execute("SELECT SUM(remaining_qty) FROM lot").fetchone()[0]
+    assert left == pytest.approx(1.5)
+    assert conn.execute("SELECT COUNT(*) FROM lot WHERE remaining_qty = 0").fetchone()[0] == 1
+    assert conn.execute("SELECT SUM(qty) FROM lot_event").fetchone()[0] == pytest.approx(1.5)
+
+
+def test_batch_spec_id_and_short_sale_rolls_back_books(ledger):
+    conn = ledger
+    eng = LotEngine(conn, "HIFO")
+    a, b = eng.apply([_buy("2024-01-01", 1, 100), _buy("2024-01-02", 1, 500)])
+    # spec-ID overrides HIFO; a lot opened and closed in the same batch is inserted closed
+    out = eng.apply([_sell("2024-01-03", 0.25, 600, lot_ids=[a.lot_id]),
+                     _buy("2024-01-04", 2, 50), _sell("2024-01-05", 1.0, 600)])
+    conn.commit()
+    assert out[0].matched[0][0] == a.lot_id
+    assert out[2].matched[0][:2] == (b.lot_id, 1.0)
+    rem = dict(conn.execute("SELECT open_px, remaining_qty FROM lot").fetchall())
+    assert rem == {100.0: 0.75, 500.0: 0.0, 50.0: 2.0}
+
+    with pytest.raises(LotError, match="Not enough"):
+        eng.apply([_sell("2024-01-06", 1.0, 600), _sell("2024-01-07", 5.0, 600)])
+    conn.rollback()
+    # nothing was written and the engine reloads its books from the table
+    got = eng.apply([_sell("2024-01-08", 2.75, 600)])[0].matched
+    assert [(lid, q) for lid, q, _, _ in got] == [(a.lot_id, 0.75), (out[1].lot_id, 2.0)]
+    plan = " ".join(r[-1] for r in conn.execute(
+        "EXPLAIN QUERY PLAN SELECT id FROM lot WHERE account_id='acct' AND instrument_id='BTC-USD' AND remaining_qty > 0"))
+    assert "idx_lot_open" in plan
@@ -0,0 +1,135 @@
+import sqlite3
+import threading
+import time
+
+import pytest
+
+from libs.nav import NavCache, max_drawdown, nav_cache_path, nav_series
+
+DAY = 86400
+T0 = 1704067200  # 2024-01-01 00:00:00 UTC
+
+
+def _ts(t):
+    return time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(t))
+
+
+def _snap(conn, t, inst, qty):
+    conn.execute("INSERT INTO balance_snapshot VALUES(?,?,?,?)", (_ts(t), "trading", inst, qty))
+
+
+def _px(conn, t, inst, px):
+    conn.execute("INSERT INTO price(ts,instrument_id,px,source) VALUES(?,?,?,'x')", (_ts(t), inst, px))
+
+
+def _brute(conn, close):
+    """NAV as of `close` with correlated latest-<= lookups."""
+    nav = 0.0
+    for (inst,) in conn.execute("SELECT DISTINCT instrument_id FROM balance_snapshot"):
+        q = conn.execute("SELECT qty FROM balance_snapshot WHERE instrument_id=? AND ts<? ORDER BY ts DESC LIMIT 1",
+                         (inst, _ts(close))).fetchone()
+        if not q:
+            continue
+        p = 1.0 if inst == "USD" else conn.execute(
+            "SELECT px FROM price WHERE instrument_id=? AND ts<? ORDER BY ts DESC LIMIT 1", (inst, _ts(close))).fetchone()[0]
+        nav += q[0] * p
+    return nav
+
+
+def _fill(conn, days):
+    _px(conn, T0 - 3600, "BTC-USD", 100.0)  # quote before the first snapshot
+    _snap(conn, T0 + 60, "USD", 1000.0)
+    _snap(conn, T0 + 60, "BTC-USD", 1.0)
+    for d in range(days):
+        for h in range(0, 24, 6):
+            _px(conn, T0 + d * DAY + h * 3600 + 1, "BTC-USD", 100.0 + d * 3 - h)
+        if d % 4 == 2:  # a trade: holdings change mid-day
+            _snap(conn, T0 + d * DAY + 7 * 3600, "USD", 1000.0 - 50 * d)
+            _snap(conn, T0 + d * DAY + 7 * 3600, "BTC-USD", 1.0 + 0.5 * d)
+
+
+@pytest.mark.parametrize("step", [3600, DAY])
+def test_series_matches_correlated_lookups(ledger, step):
+    conn = ledger
+    _fill(conn, 10)
+    now = T0 + 9 * DAY + 5
+    pts = nav_series(conn, step=step, now=now)
+    assert pts[0][0] == T0
+    assert len(pts) == (9 * DAY) // step + 1
+    for t, v in pts:  # the open bucket holds everything written so far
+        assert v == pytest.approx(_brute(conn, t + step))
+
+
+def test_cache_extends_incrementally_and_matches_full(ledger, tmp_path):
+    conn = ledger
+    _fill(conn, 6)
+    path = tmp_path / "nav.json"
+    c = NavCache(path, step=DAY).refresh(conn, now=T0 + 3 * DAY + 10)
+    assert [t for t, _ in c.points] == [T0, T0 + DAY, T0 + 2 * DAY]
+    for t, px in [(T0 + 6 * DAY + 1, 200.0), (T0 + 7 * DAY + 1, 150.0)]:
+        _px(conn, t, "BTC-USD", px)
+    _snap(conn, T0 + 6 * DAY + 2, "ETH-USD", 2.0)
+    _px(conn, T0 + 2 * DAY, "ETH-USD", 10.0)  # quoted before the cursor, held after it
+
+    c2 = NavCache(path, step=DAY).refresh(conn, now=T0 + 8 * DAY + 10)
+    full = nav_series(conn, step=DAY, now=T0 + 8 * DAY + 10)
+    assert c2.series() == pytest.approx(full)
+    assert max_drawdown([v for _, v in full]) < 0
+
+
+def test_cache_rebuilds_buckets_behind_the_cursor_when_rows_are_backdated(ledger, tmp_path):
+    conn = ledger
+    _snap(conn, T0 + 60, "BTC-USD", 1.0)
+    for d, px in [(0, 100.0), (4, 500.0), (5, 600.0)]:
+        _px(conn, T0 + d * DAY + 120, "BTC-USD", px)
+    now = T0 + 5 * DAY + 10
+    path = tmp_path / "nav.json"
+    assert [v for _, v in NavCache(path, step=DAY).refresh(conn, now=now).points] == [100.0] * 4 + [500.0]
+
+    for d, px in [(1, 200.0), (2, 300.0), (3, 400.0)]:  # closes backfilled after the first refresh
+        _px(conn, T0 + d * DAY + 120, "BTC-USD", px)
+    c = NavCache(path, step=DAY).refresh(conn, now=now)
+    assert [v for _, v in c.points] == [100.0, 200.0, 300.0, 400.0, 500.0]
+    assert c.series() == pytest.approx(nav_series(conn, step=DAY, now=now))
+
+    _snap(conn, T0 + 2 * DAY + 60, "BTC-USD", 2.0)  # a late snapshot moves holdings from day 2 on
+    c = NavCache(path, step=DAY).refresh(conn, now=now)
+    assert [v for _, v in c.points] == [100.0, 200.0, 600.0, 800.0, 1000.0]
+    assert c.series() == pytest.approx(nav_series(conn, step=DAY, now=now))
+
+
+def test_shared_cache_refreshes_serialize_and_path_follows_the_db(ledger, tmp_path, monkeypatch):
+    db = tmp_path / "ledger.db"
+    src = ledger
+    _fill(src, 8)
+    src.commit()
+    disk = sqlite3.connect(db)
+    src.backup(disk)
+    disk.close()
+    monkeypatch.setenv("CRYPTOOPS_DB", str(db))
+    path = nav_cache_path("trading", "daily")
+    assert path == tmp_path / "ledger.db.nav.trading.daily.json"
+    assert nav_cache_path("trading", "daily", tmp_path / "other.db") != path
+
+    cache = NavCache(path, step=DAY)
+    now = T0 + 7 * DAY + 10
+    want = nav_series(src, step=DAY, now=now)
+    errors = []
+
+    def work():
+        conn = sqlite3.connect(db)
+        try:
+            for _ in range(5):
+                assert cache.refresh(conn, now=now).series() == pytest.approx(want)
+        except Exception as e:
+            errors.append(e)
+        finally:
+            conn.close()
+
+    threads = [threading.Thread(target=work) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert not errors
+    assert NavCache(path, step=DAY).refresh(sqlite3.connect(db), now=now).series() == pytest.approx(want)
@@ -0,0 +1,61 @@
+import sqlite3
+
+import numpy as np
+
+from libs.price_daily import daily_closes, ensure_price_daily, load_daily_matrix
+
+
+def test_backfill_then_trigger_keeps_last_of_day(price_db):
+    con = price_db()
+    con.executemany("INSERT INTO price(ts,instrument_id,px) VALUES(?,?,?)", [
+        ("2025-01-01 09:00:00", "BTC-USD", 100.0),
+        ("2025-01-01 23:00:00", "BTC-USD", 101.0),
+        ("2025-01-02 12:00:00", "BTC-USD", 102.0),
+        ("2025-01-02 12:00:00", "ETH-USD", 10.0),
+    ])
+    assert ensure_price_daily(con) is True
+    assert ensure_price_daily(con) is False
+    assert daily_closes(con, "BTC-USD", 5) == [("2025-01-01", 101.0), ("2025-01-02", 102.0)]
+
+    # a later tick replaces the close; a late-arriving earlier tick does not
+    con.execute("INSERT INTO price(ts,instrument_id,px) VALUES('2025-01-02 18:00:00','BTC-USD',105.0)")
+    con.execute("INSERT INTO price(ts,instrument_id,px) VALUES('2025-01-02 06:00:00','BTC-USD',90.0)")
+    con.execute("INSERT INTO price(ts,instrument_id,px) VALUES('2025-01-03 00:00:01','BTC-USD',106.0)")
+    assert daily_closes(con, "BTC-USD", 2) == [("2025-01-02", 105.0), ("2025-01-03", 106.0)]
+
+    m = load_daily_matrix(con, ["BTC-USD", "ETH-USD"])
+    assert m.dates == ["2025-01-01", "2025-01-02", "2025-01-03"]
+    assert np.isnan(m.px[0, 1]) and np.isnan(m.px[2, 1])
+    assert m.dense().rows() == [("2025-01-02", {"BTC-USD": 105.0, "ETH-USD": 10.0})]
+    assert m.series("BTC-USD", 2) == (["2025-01-02", "2025-01-03"], [105.0, 106.0])
+
+
+def test_integer_ts_and_symbol_column(price_db):
+    con = price_db("symbol", "INTEGER")
+    ensure_price_daily(con)
+    day = 1735689600  # 2025-01-01 00:00:00 UTC
+    con.executemany("INSERT INTO price(ts,symbol,px) VALUES(?,?,?)",
+                    [(day + 60, "SOL-USD", 1.0), (day + 3600, "SOL-USD", 2.0), (day + 86400, "SOL-USD", 3.0)])
+    assert daily_closes(con, "SOL-USD", 10) == [("2025-01-01", 2.0), ("2025-01-02", 3.0)]
+
+
+def test_loaders_read_raw_ticks_without_building_the_table(price_db, tmp_path):
+    path = tmp_path / "ro.db"
+    con = price_db(path=path)
+    con.executemany("INSERT INTO price(ts,instrument_id,px) VALUES(?,?,?)", [
+        ("2025-01-01 09:00:00", "BTC-USD", 100.0), ("2025-01-01 23:00:00", "BTC-USD", 101.0),
+        ("2025-01-02 12:00:00", "BTC-USD", 102.0), ("2025-01-02 12:00:00", "ETH-USD", 10.0),
+    ])
+    con.commit()
+
+    ro = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    assert daily_closes(ro, "BTC-USD", 5) == [("2025-01-01", 101.0), ("2025-01-02", 102.0)]
+    m = load_daily_matrix(ro, ["BTC-USD", "ETH-USD"], since="2025-01-02")
+    assert m.rows() == [("2025-01-02", {"BTC-USD": 102.0, "ETH-USD": 10.0})]
+    assert ro.execute("SELECT COUNT(*) FROM sqlite_master WHERE name='price_daily'").fetchone()[0] == 0
+
+    rw = sqlite3.connect(path)
+    assert ensure_price_daily(rw) is True
+    rw.close()
+    assert daily_closes(ro, "BTC-USD", 1) == [("2025-01-02", 102.0)]
+    assert load_daily_matrix(ro, ["BTC-USD", "ETH-USD"], since="2025-01-02").rows() == m.rows()
@@ -0,0 +1,101 @@
+import numpy as np
+
+from libs.price_daily import load_daily_matrix
+from libs.price_store import PriceStore, load_daily
+
+
+def _flavour(text_ts):
+    return ("instrument_id", "TEXT") if text_ts else ("symbol", "INTEGER")
+
+
+def _insert(conn, text_ts, rows):
+    col = "instrument_id" if text_ts else "symbol"
+    for ts, sym, px in rows:
+        v = np.datetime_as_string(np.datetime64(ts, "s")).replace("T", " ") if text_ts else ts
+        conn.execute(f"INSERT INTO price(ts, {col}, px) VALUES (?,?,?)", (v, sym, px))
+    conn.commit()
+
+
+def _ticks(start, n, step, sym, seed):
+    rng = np.random.default_rng(seed)
+    return [(start + i * step, sym, float(x)) for i, x in enumerate(rng.uniform(10, 20, n))]
+
+
+def test_daily_matrix_matches_price_daily_for_both_schemas(price_db, tmp_path):
+    for text_ts in (True, False):
+        conn = price_db(*_flavour(text_ts))
+        t0 = 1_704_067_200  # 2024-01-01
+        _insert(conn, text_ts, _ticks(t0, 400, 6 * 3600 + 17, "BTC-USD", 1) + _ticks(t0 + 86400 * 3, 300, 5 * 3600, "ETH-USD", 2))
+        store = PriceStore(tmp_path / ("text" if text_ts else "int"))
+        store.sync(conn)
+        ref = load_daily_matrix(conn, ["BTC-USD", "ETH-USD"])
+        got = store.daily_matrix(["BTC-USD", "ETH-USD"])
+        assert got.dates == ref.dates
+        assert np.array_equal(got.px, ref.px, equal_nan=True)
+        since = ref.dates[10]
+        assert store.daily_matrix(["ETH-USD"], since).dates == load_daily_matrix(conn, ["ETH-USD"], since).dates
+
+
+def test_incremental_sync_rewrites_only_touched_months(price_db, tmp_path):
+    conn = price_db("symbol", "INTEGER")
+    t0 = 1_704_067_200
+    _insert(conn, False, _ticks(t0, 24 * 90, 3600, "BTC-USD", 3))  # Jan..Mar 2024
+    store = PriceStore(tmp_path)
+    assert store.sync(conn) == {"BTC-USD": 24 * 90}
+    parts = store.partitions("BTC-USD")
+    assert [p.stem for p in parts] == ["2024-01", "2024-02", "2024-03"]
+    before = {p.stem: p.stat().st_mtime_ns for p in parts}
+
+    _insert(conn, False, _ticks(t0 + 24 * 90 * 3600, 48, 3600, "BTC-USD", 4))
+    assert store.sync(conn) == {"BTC-USD": 31 * 24 + 24}  # March and April, rewritten whole
+    after = {p.stem: p.stat().st_mtime_ns for p in store.partitions("BTC-USD")}
+    assert after["2024-01"] == before["2024-01"] and after["2024-02"] == before["2024-02"]
+
+    jan = store.ticks("BTC-USD", t0, t0 + 86400)
+    assert isinstance(jan.base, np.memmap) or isinstance(jan, np.memmap)
+    assert len(jan) == 24 and len(store.ticks("BTC-USD")) == 24 * 92
+
+
+def test_sync_picks_up_backdated_rows_upserts_and_deletes(price_db, tmp_path):
+    conn = price_db()
+    t0 = 1_704_067_200
+    _insert(conn, True, _ticks(t0, 24 * 60, 3600, "BTC-USD", 5))  # Jan..Feb 2024
+    store = PriceStore(tmp_path)
+    store.sync(conn)
+    feb = store.partitions("BTC-USD")[1].stat().st_mtime_ns
+
+    # a backfilled close older than everything exported, and an upsert of an existing tick
+    conn.execute("INSERT INTO price(ts, instrument_id, px, source) VALUES ('2023-12-31 23:59:59','BTC-USD',9.5,'coinbase_hist')")
+    conn.execute("INSERT OR REPLACE INTO price(ts, instrument_id, px, source) VALUES ('2024-01-05 00:00:00','BTC-USD',99.0,'coinbase_hist')")
+    conn.commit()
+    assert store.sync(conn) == {"BTC-USD": 1 + 31 * 24}
+    assert [p.stem for p in store.partitions("BTC-USD")] == ["2023-12", "2024-01", "2024-02"]
+    assert store.partitions("BTC-USD")[2].stat().st_mtime_ns == feb
+
+    conn.execute("UPDATE price SET px = 1.0 WHERE ts = '2024-02-01 00:00:00'")
+    conn.execute("DELETE FROM price WHERE ts < '2024-01-01'")
+    conn.commit()
+    assert store.sync(conn) == {"BTC-USD": 29 * 24}
+    assert store.sync(conn) == {"BTC-USD": 0}
+    ref = load_daily_matrix(conn, ["BTC-USD"])
+    got = store.daily_matrix(["BTC-USD"])
+    assert got.dates == ref.dates and np.array_equal(got.px, ref.px)
+    assert store.ticks("BTC-USD", t0 + 4 * 86400, t0 + 4 * 86400 + 1)["px"].tolist() == [99.0]
+
+
+def test_load_daily_skips_the_signature_scan_while_the_ledger_is_unchanged(price_db, tmp_path):
+    conn = price_db("symbol", "INTEGER", tmp_path / "ledger.db")
+    t0 = 1_704_067_200
+    _insert(conn, False, _ticks(t0, 24 * 40, 3600, "BTC-USD", 5))
+    root = tmp_path / "store"
+    first = load_daily(conn, ["BTC-USD"], store=root)
+
+    sql = []
+    conn.set_trace_callback(sql.append)
+    again = load_daily(conn, ["BTC-USD"], store=root)
+    assert again.dates == first.dates and np.array_equal(again.px, first.px)
+    assert not [q for q in sql if "GROUP BY" in q]
+
+    _insert(conn, False, [(t0 + 24 * 40 * 3600, "BTC-USD", 99.0)])  # a new day
+    assert len(load_daily(conn, ["BTC-USD"], store=root).dates) == len(first.dates) + 1
+    assert [q for q in sql if "GROUP BY" in q]
@@ -0,0 +1,32 @@
+from libs.prices import PriceSnapshotCache, latest_prices, latest_quotes, symbol_column
+
+
+def _seed(con):
+    symcol = symbol_column(con)
+    con.execute("PRAGMA journal_mode=WAL")
+    rows = [("2025-01-0%d 00:00:00" % d, s, px * d) for d in (1, 3, 2) for s, px in (("BTC-USD", 100.0), ("ETH-USD", 10.0))]
+    con.executemany(f"INSERT INTO price(ts,{symcol},px) VALUES(?,?,?)", rows)
+    con.commit()
+    return con
+
+
+def test_latest_quotes_one_statement_both_schemas(price_db, tmp_path):
+    for symcol in ("instrument_id", "symbol"):
+        con = _seed(price_db(symcol, "TEXT", tmp_path / f"{symcol}.db"))
+        q = latest_quotes(con, ["BTC-USD", "ETH-USD", "SOL-USD"])
+        assert q == {"BTC-USD": ("2025-01-03 00:00:00", 300.0), "ETH-USD": ("2025-01-03 00:00:00", 30.0)}
+        assert latest_prices(con, []) == {}
+
+
+def test_cache_reuses_until_db_changes(price_db, tmp_path):
+    path = tmp_path / "ledger.db"
+    con = _seed(price_db(path=path))
+    cache = PriceSnapshotCache()
+    assert cache.prices(path, ["BTC-USD"]) == {"BTC-USD": 300.0}
+    assert cache.prices(path, ["BTC-USD"]) == {"BTC-USD": 300.0}
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    con.execute("INSERT INTO price(ts,instrument_id,px) VALUES('2025-01-04 00:00:00','BTC-USD',400.0)")
+    con.commit()
+    assert cache.prices(path, ["BTC-USD", "ETH-USD"]) == {"BTC-USD": 400.0, "ETH-USD": 30.0}
+    assert cache.misses == 2
@@ -0,0 +1,110 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from libs.spot_prices import CircuitBreaker, RequestsTransport, SpotPriceFetcher
+
+
+class _Stub(BaseHTTPRequestHandler):
+    calls = {}
+    slow = {}
+
+    def do_GET(self):
+        pair = self.path.split("/")[3]
+        _Stub.calls[pair] = _Stub.calls.get(pair, 0) + 1
+        time.sleep(_Stub.slow.get(pair, 0.0))
+        if pair in ("BAD-USD", "GONE-USD"):
+            self.send_response(500 if pair == "BAD-USD" else 404)
+            self.end_headers()
+            return
+        body = json.dumps({"data": {"amount": str(100 + len(pair))}}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def stub():
+    _Stub.calls, _Stub.slow = {}, {}
+    srv = ThreadingHTTPServer(("127.0.0.1", 0), _Stub)
+    t = threading.Thread(target=srv.serve_forever, daemon=True)
+    t.start()
+    yield f"http://127.0.0.1:{srv.server_address[1]}/v2/prices/{{pair}}/spot"
+    srv.shutdown()
+
+
+def test_concurrent_fetch_bounded_by_deadline_and_cached(stub):
+    _Stub.slow = {"BTC-USD": 0.3, "ETH-USD": 0.3, "SOL-USD": 0.3, "LINK-USD": 1.0}
+    f = SpotPriceFetcher(RequestsTransport(), url=stub, ttl=60)
+    t0 = time.perf_counter()
+    out = f.fetch(["BTC-USD", "ETH-USD", "SOL-USD", "LINK-USD"], deadline=0.8)
+    took = time.perf_counter() - t0
+    assert out == {"BTC-USD": 107.0, "ETH-USD": 107.0, "SOL-USD": 107.0}
+    assert took < 0.8 + 0.3  # one deadline, not 0.3 * 3 + 1.0
+
+    time.sleep(0.6)  # the straggler finishes in the background and lands in the cache
+    out = f.fetch(["BTC-USD", "LINK-USD"], deadline=0.8)
+    assert out == {"BTC-USD": 107.0, "LINK-USD": 108.0}
+    assert _Stub.calls["BTC-USD"] == 1 and f.hits == 2
+
+
+def test_breaker_skips_failing_host_until_cooldown(stub):
+    now = [0.0]
+    f = SpotPriceFetcher(RequestsTransport(), url=stub, ttl=0,
+                         breaker=CircuitBreaker(threshold=2, cooldown=30, clock=lambda: now[0]))
+    for _ in range(2):
+        assert f.fetch(["BAD-USD"], deadline=1) == {}
+    assert f.fetch(["BAD-USD", "BTC-USD"], deadline=1) == {}  # same host erroring 5xx: open for all pairs
+    assert _Stub.calls == {"BAD-USD": 2} and f.skipped == 2
+
+    now[0] = 31.0  # half-open probe succeeds and closes the breaker
+    assert f.fetch(["BTC-USD"], deadline=1) == {"BTC-USD": 107.0}
+    assert not f.breaker.is_open("127.0.0.1:" + stub.split(":")[2].split("/")[0])
+
+
+def test_client_errors_do_not_trip_the_breaker(stub):
+    f = SpotPriceFetcher(RequestsTransport(), url=stub, ttl=0,
+                         breaker=CircuitBreaker(threshold=2, cooldown=30, clock=lambda: 0.0))
+    for _ in range(3):  # an unknown / delisted pair answers 404 every time
+        assert f.fetch(["GONE-USD", "BTC-USD"], deadline=1) == {"BTC-USD": 107.0}
+    assert _Stub.calls == {"GONE-USD": 3, "BTC-USD": 3} and f.skipped == 0
+
+    f.fetch(["BAD-USD"], deadline=1)  # one 5xx, then a 404: the host answered, count resets
+    f.fetch(["GONE-USD"], deadline=1)
+    f.fetch(["BAD-USD"], deadline=1)
+    assert f.fetch(["BTC-USD"], deadline=1) == {"BTC-USD": 107.0}
+
+
+def test_afetch_awaits_one_deadline_without_blocking_the_loop(stub):
+    import asyncio
+
+    _Stub.slow = {"BTC-USD": 0.2, "LINK-USD": 1.0}
+    f = SpotPriceFetcher(RequestsTransport(), url=stub, ttl=60)
+
+    async def main():
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.01)
+                ticks += 1
+
+        t = asyncio.create_task(ticker())
+        out = await f.afetch(["BTC-USD", "LINK-USD"], deadline=0.5)
+        t.cancel()
+        return out, ticks
+
+    out, ticks = asyncio.run(main())
+    assert out == {"BTC-USD": 107.0}
+    assert ticks > 20  # the loop kept running while the requests were in flight
+    time.sleep(0.7)
+    assert f.fetch(["LINK-USD"], deadline=0.1) == {"LINK-USD": 108.0}  # straggler cached
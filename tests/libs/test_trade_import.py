@@ -0,0 +1,52 @@
+import json
+
+import pytest
+
+from libs.lots import LotError
+from libs.trade_import import import_text
+
+def _fund(conn):
+    conn.execute("INSERT INTO balance_snapshot VALUES('2024-01-01 00:00:00.000000','trading','USD',10000)")
+    conn.commit()
+    return conn
+
+
+def _counts(conn):
+    return [conn.execute(f'SELECT COUNT(*) FROM {t}').fetchone()[0]
+            for t in ('"order"', "trade", "lot", "lot_event", "balance_snapshot")]
+
+
+def test_ndjson_replay_is_one_snapshot_and_idempotent(ledger):
+    conn = _fund(ledger)
+    recs = [  # /apply_paper shape: epoch ts, usd, px_eff, extra metadata
+        {"ts": 1704153600, "run_id": "r1", "symbol": "BTC-USD", "side": "buy", "qty": 0.1, "usd": 4000, "px_eff": 40000},
+        {"ts": 1704153600, "run_id": "r1", "symbol": "ETH-USD", "side": "buy", "qty": 1.0, "usd": 2000},
+        {"ts": 1704240000, "run_id": "r2", "symbol": "BTC-USD", "side": "sell", "qty": 0.05, "px": 50000, "fee": 5},
+    ]
+    text = "\n".join(json.dumps(r) for r in recs) + "\n"
+    stats = import_text(conn, text)
+    assert stats["fills"] == 3 and stats["realized"] == pytest.approx(0.05 * 50000 - 5 - 0.05 * 40000)
+    assert stats["balances"] == pytest.approx({"trading:BTC-USD": 0.05, "trading:ETH-USD": 1.0,
+                                               "trading:USD": 10000 - 4000 - 2000 + 2500 - 5})
+    snaps = conn.execute("SELECT COUNT(DISTINCT ts) FROM balance_snapshot").fetchone()[0]
+    assert snaps == 2  # the seed + one consolidated snapshot
+    before = _counts(conn)
+    again = import_text(conn, text)
+    assert (again["fills"], again["skipped"]) == (0, 3) and _counts(conn) == before
+
+
+def test_csv_with_repeated_slices_and_rollback_on_short_sale(ledger):
+    conn = _fund(ledger)
+    csv_text = ("symbol,side,qty,px,fee,fee_asset\n"
+                "BTC-USD,buy,0.01,40000,0.0001,BTC\n"
+                "BTC-USD,buy,0.01,40000,0.0001,BTC\n")
+    stats = import_text(conn, csv_text)
+    assert stats["fills"] == 2  # identical rows are distinct fills
+    lots = conn.execute("SELECT open_qty FROM lot").fetchall()
+    assert [q for (q,) in lots] == pytest.approx([0.0099, 0.0099])
+    assert stats["balances"]["trading:BTC-USD"] == pytest.approx(0.0198)
+
+    before = _counts(conn)
+    with pytest.raises(LotError):
+        import_text(conn, "symbol,side,qty,px\nETH-USD,buy,1,2000\nBTC-USD,sell,1,50000\n")
+    assert _counts(conn) == before
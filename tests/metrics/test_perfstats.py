@@ -0,0 +1,38 @@
+import json
+import math
+import statistics
+
+from apps.infra.perfstats import PerfStats
+
+NAVS = [100.0, 102.0, 99.0, 101.5, 97.0, 98.0, 104.0, 103.0]
+
+
+def test_matches_batch_formulas():
+    st = PerfStats.from_series(NAVS)
+    rets = [b / a - 1.0 for a, b in zip(NAVS, NAVS[1:])]
+    mu, sd = statistics.mean(rets), statistics.stdev(rets)
+    assert math.isclose(st.vol_ann(), sd * math.sqrt(365.0))
+    assert math.isclose(st.sharpe(), mu / sd * math.sqrt(365.0))
+    assert math.isclose(st.cagr(), (NAVS[-1] / NAVS[0]) ** (365.0 / len(rets)) - 1.0)
+    assert math.isclose(st.max_dd, 97.0 / 102.0 - 1.0)
+    assert st.max_dd_len == 4  # 99, 101.5, 97, 98 below the 102 peak
+    down = math.sqrt(sum(r * r for r in rets if r < 0) / len(rets))
+    assert math.isclose(st.sortino(), mu / down * math.sqrt(365.0))
+    assert math.isclose(st.calmar(), st.cagr() / abs(st.max_dd))
+
+
+def test_snapshot_restore_continues_stream():
+    whole = PerfStats.from_series(NAVS)
+    part = PerfStats.from_series(NAVS[:5])
+    resumed = PerfStats.restore(json.loads(json.dumps(part.snapshot())))
+    for v in NAVS[5:]:
+        resumed.push(v)
+    assert resumed.summary() == whole.summary()
+
+
+def test_elapsed_days_drive_cagr_when_timestamps_given():
+    st = PerfStats()
+    st.push(100.0, 0)
+    st.push(110.0, 10 * 86400)
+    assert st.days == 10
+    assert st.sharpe() is None  # a single return has no dispersion
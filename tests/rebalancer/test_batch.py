@@ -0,0 +1,52 @@
+import random
+import sqlite3
+
+from apps.rebalancer import batch
+from apps.rebalancer.main import _band_from_policy, _gen_actions, _load_policy_targets, _pairs
+
+
+def _prices():
+    return {p: 10.0 * (i + 1) + 0.37 for i, p in enumerate(_pairs(_load_policy_targets()))} | {"DOGE-USD": 0.2}
+
+
+def test_batch_matches_single_account_planner():
+    rng = random.Random(7)
+    prices = _prices()
+    syms = list(prices)
+    balances = {f"sleeve{i}": {"USD": rng.uniform(0, 5000),
+                               **{s: rng.uniform(0, 50) for s in rng.sample(syms, 3)}} for i in range(40)}
+    balances["empty"] = {}
+    out = batch.compute_batch(list(balances), override_prices=prices, balances=balances)
+    targets, band = _load_policy_targets(), _band_from_policy(0.01)
+    assert out["config"]["band"] == band
+    for acct, bal in balances.items():
+        want = _gen_actions(dict(bal, USD=bal.get("USD", 0.0)), prices, targets, band)
+        assert out["plans"][acct]["actions"] == want, acct
+    assert out["plans"]["empty"]["actions"] == [] and out["plans"]["empty"]["nav"] == 0.0
+
+
+def test_trading_account_uses_state_balances_like_plan(monkeypatch):
+    prices = _prices()
+    state = {"USD": 2500.0, "BTC-USD": 3.0}
+    monkeypatch.setattr(batch, "_load_balances", lambda: dict(state))
+    monkeypatch.setattr(batch, "ledger_balances", lambda accounts: {a: {"USD": 10.0} for a in accounts})
+    out = batch.compute_batch(["trading", "sleeve"], override_prices=prices)
+    assert out["plans"]["trading"]["balances"] == state
+    assert out["plans"]["sleeve"]["balances"] == {"USD": 10.0}
+    want = _gen_actions(dict(state), prices, _load_policy_targets(), _band_from_policy(0.01))
+    assert out["plans"]["trading"]["actions"] == want
+
+
+def test_ledger_balances_take_latest_row_per_instrument(tmp_path):
+    db = tmp_path / "ledger.db"
+    conn = sqlite3.connect(db)
+    conn.execute("CREATE TABLE balance_snapshot(ts TEXT, account_id TEXT, instrument_id TEXT, qty REAL)")
+    conn.executemany("INSERT INTO balance_snapshot VALUES(?,?,?,?)", [
+        ("2025-01-01", "a", "USD", 100.0), ("2025-01-02", "a", "USD", 40.0),
+        ("2025-01-01", "a", "BTC-USD", 1.0),  # not re-snapshotted on the 2nd
+        ("2025-01-03", "b", "ETH-USD", 2.0), ("2025-01-03", "c", "ETH-USD", 9.0),
+    ])
+    conn.commit()
+    conn.close()
+    got = batch.ledger_balances(["a", "b", "z"], str(db))
+    assert got == {"a": {"USD": 40.0, "BTC-USD": 1.0}, "b": {"USD": 0.0, "ETH-USD": 2.0}, "z": {"USD": 0.0}}
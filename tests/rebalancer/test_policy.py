@@ -0,0 +1,84 @@
+import json
+import os
+
+import pytest
+
+from apps.rebalancer.policy import CFG_PATH, Policy, PolicyError, PolicyStore, get_policy
+
+
+def _write(path, data, mtime_ns):
+    path.write_text(json.dumps(data), encoding="utf-8")
+    os.utime(path, ns=(mtime_ns, mtime_ns))
+
+
+def test_repo_policy_is_normalized():
+    pol = get_policy(CFG_PATH)
+    assert pol.pairs == ("BTC-USD", "ETH-USD", "LINK-USD", "SOL-USD")
+    assert set(pol.per_asset_cap_usd) == {"SOL-USD", "LINK-USD"}
+    assert pol.qty_step["BTC-USD"] == 1e-05
+    assert pol.band == 0.035
+    assert get_policy(CFG_PATH) is pol
+
+
+def test_reload_on_change_and_keep_last_good(tmp_path):
+    cfg = tmp_path / "policy.json"
+    _write(cfg, {"targets_trading": {"btc": 0.6, "eth": 0.4}, "bands_pct": 0.05}, 1_000_000_000)
+    first = get_policy(cfg)
+    assert dict(first.pair_targets) == {"BTC-USD": 0.6, "ETH-USD": 0.4}
+
+    # same bytes, new mtime: no re-parse
+    _write(cfg, {"targets_trading": {"btc": 0.6, "eth": 0.4}, "bands_pct": 0.05}, 2_000_000_000)
+    assert get_policy(cfg) is first
+
+    _write(cfg, {"targets_trading": {"BTC": 1.0}, "min_trade_usd": 500}, 3_000_000_000)
+    second = get_policy(cfg)
+    assert second.pairs == ("BTC-USD",) and second.min_trade_usd == 500.0
+
+    # invalid edit: the last good policy keeps being served
+    _write(cfg, {"targets_trading": {"BTC": -1}}, 4_000_000_000)
+    assert get_policy(cfg) is second
+
+
+def test_invalid_file_is_parsed_once_per_version(tmp_path, monkeypatch):
+    calls = []
+    parse = Policy.from_dict.__func__
+
+    def counting(cls, *a, **kw):
+        calls.append(1)
+        return parse(cls, *a, **kw)
+
+    monkeypatch.setattr(Policy, "from_dict", classmethod(counting))
+    cfg = tmp_path / "policy.json"
+    _write(cfg, {"targets_trading": {}}, 1_000_000_000)
+    store = PolicyStore(cfg)
+    for _ in range(3):
+        with pytest.raises(PolicyError, match="targets_trading"):
+            store.get()
+    assert len(calls) == 1
+
+    _write(cfg, {"targets_trading": {"BTC": 1.0}}, 2_000_000_000)
+    good = store.get()
+    _write(cfg, "not a policy", 3_000_000_000)
+    assert store.get() is good and store.get() is good
+    assert len(calls) == 3
+
+
+def test_validation_errors():
+    with pytest.raises(PolicyError):
+        Policy.from_dict({"targets_trading": {}})
+    with pytest.raises(PolicyError):
+        Policy.from_dict({"targets_trading": {"BTC": 1}, "band_dynamic": {"min": 0.1, "max": 0.05}})
+    pol = Policy.from_dict({"targets_trading": {"BTC": 1, "USD": 0}})
+    with pytest.raises(Exception):
+        pol.bands_pct = 0.1  # frozen
+    assert pol.replace(bands_pct=0.1).bands_pct == 0.1
+
+
+def test_policy_pickles_and_stays_read_only():
+    import pickle
+
+    pol = get_policy(CFG_PATH)
+    clone = pickle.loads(pickle.dumps(pol))
+    assert clone == pol and clone.qty_step["ETH-USD"] == pol.qty_step["ETH-USD"]
+    with pytest.raises(TypeError):
+        clone.pair_targets["BTC-USD"] = 1.0
@@ -0,0 +1,84 @@
+import importlib.util
+import json
+import math
+import os
+import sqlite3
+from pathlib import Path
+
+import numpy as np
+
+from libs.db import BASE_DIR
+from libs.price_daily import ensure_price_daily
+
+MAIN = BASE_DIR / "_share" / "crypto-ops-share" / "apps" / "rebalancer" / "main.py"
+SYMS = ["BTC-USD", "ETH-USD", "LINK-USD", "SOL-USD"]
+
+
+def _load():
+    spec = importlib.util.spec_from_file_location("share_rebalancer_main", MAIN)
+    mod = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(mod)
+    return mod
+
+
+def _ledger(path: Path, days: int = 45):
+    conn = sqlite3.connect(path)
+    conn.executescript((BASE_DIR / "schema" / "schema.sql").read_text(encoding="utf-8"))
+    ensure_price_daily(conn)
+    rng = np.random.default_rng(3)
+    px = np.array([60000.0, 3000.0, 15.0, 150.0])
+    for d in range(days):
+        px = px * (1 + rng.normal(0.002, 0.04, len(SYMS)))
+        day = np.datetime64("2025-01-01") + d
+        for s, p in zip(SYMS, px):
+            conn.execute("INSERT INTO price(ts, instrument_id, px, source) VALUES (?,?,?,?)",
+                         (f"{day} 23:00:00", s, float(p), "test"))
+    for s, q in zip(SYMS + ["USD"], [0.5, 4.0, 1000.0, 30.0, 60000.0]):
+        conn.execute("INSERT INTO balance_snapshot VALUES ('2025-01-01 00:00:00','trading',?,?)", (s, q))
+    conn.commit()
+    conn.close()
+
+
+def test_compute_actions_with_covariance_band(tmp_path, monkeypatch):
+    mod = _load()
+    cfg = json.loads(mod.CFG_PATH.read_text(encoding="utf-8"))
+    cfg["band_dynamic"].update(enabled=True, cov_method="ewma")
+    (tmp_path / "policy.json").write_text(json.dumps(cfg), encoding="utf-8")
+    _ledger(tmp_path / "ledger.db")
+    monkeypatch.setattr(mod, "CFG_PATH", tmp_path / "policy.json")
+    monkeypatch.setattr(mod, "COV_STATE", tmp_path / "cov.json")
+    monkeypatch.setattr(mod, "DB_PATH", str(tmp_path / "ledger.db"))
+
+    plan = mod.compute_actions("trading")
+    assert "error" not in plan, plan
+    dyn = cfg["band_dynamic"]
+    assert dyn["min"] <= plan["config"]["band"] <= dyn["max"]
+    saved = json.loads((tmp_path / "cov.json").read_text(encoding="utf-8"))
+    assert saved["method"] == "ewma" and saved["symbols"] == SYMS
+
+    # the band is base * portfolio vol / target vol, from the same cached covariance
+    vol = mod.portfolio_ann_vol(sqlite3.connect(tmp_path / "ledger.db"), SYMS, plan["weights"],
+                                dyn["lookback_days"], "ewma")
+    want = max(dyn["min"], min(dyn["max"], dyn["base"] * vol / dyn["target_ann_vol"]))
+    assert math.isclose(plan["config"]["band"], want)
+
+
+def test_compute_actions_reads_the_compiled_policy(tmp_path, monkeypatch):
+    mod = _load()
+    cfg = json.loads(mod.CFG_PATH.read_text(encoding="utf-8"))
+    cfg.update(min_trade_usd="1500", qty_step={"btc": 0.001})  # coerced and pair-keyed once
+    path = tmp_path / "policy.json"
+    path.write_text(json.dumps(cfg), encoding="utf-8")
+    _ledger(tmp_path / "ledger.db")
+    monkeypatch.setattr(mod, "CFG_PATH", path)
+    monkeypatch.setattr(mod, "COV_STATE", tmp_path / "cov.json")
+    monkeypatch.setattr(mod, "DB_PATH", str(tmp_path / "ledger.db"))
+
+    plan = mod.compute_actions("trading")
+    assert plan["config"]["min_trade_usd"] == 1500.0 and plan["config"]["qty_step"] == {"BTC-USD": 0.001}
+    assert mod.get_policy(path) is mod.get_policy(path)
+
+    cfg["min_trade_usd"] = 2500
+    path.write_text(json.dumps(cfg), encoding="utf-8")
+    os.utime(path, ns=(1, 1))
+    assert mod.compute_actions("trading")["config"]["min_trade_usd"] == 2500.0
@@ -0,0 +1,131 @@
+import math
+import random
+
+import numpy as np
+
+from apps.rebalancer.policy import CFG_PATH, Policy, get_policy
+from apps.research.engine import hold_navs, lookback_index, simulate
+
+
+def reference_loop(series, pairs, targets, cfg, usd, qty):
+    """The day-by-day loop backtest_rebal/compare_vs_hodl ran before the engine."""
+    band, mf = cfg.bands_pct, cfg.move_fraction
+    fee_bp, slp_bp = cfg.taker_fee_bps, cfg.slippage_bps
+    qstep, min_usd = cfg.qty_step, cfg.min_trade_usd
+    daily_cap, per_asset_caps = cfg.daily_turnover_cap_usd, cfg.per_asset_cap_usd
+    mom_en, look = cfg.momentum.enabled, cfg.momentum.lookback_days
+    tilt_max, tilt_strength = cfg.momentum.tilt_max_pct, cfg.momentum.tilt_strength
+
+    def eff_px(px, side):
+        adj = (fee_bp + slp_bp)/10000.0
+        return px*(1+adj) if side=="buy" else px*(1-adj)
+
+    def round_step(q, step):
+        if step<=0: return q
+        return math.floor(q/step)*step
+
+    def past_price(sym, i_now, days_back):
+        i_cut = max(0, i_now - days_back)
+        for j in range(i_cut, -1, -1):
+            px = series[j][1].get(sym)
+            if px: return px
+        return None
+
+    qty = dict(qty)
+    navs=[]
+    for i,(d,pxmap) in enumerate(series):
+        ttargets = targets.copy()
+        if mom_en and i>0:
+            tilted={}
+            for s in pairs:
+                past = past_price(s, i, look)
+                now  = pxmap[s]
+                base = ttargets[s]
+                if past and past>0:
+                    ret = now/past - 1.0
+                    tilt = max(-tilt_max, min(tilt_max, ret*tilt_strength))
+                    tilted[s] = max(0.0, base*(1+tilt))
+                else:
+                    tilted[s] = base
+            base_sum = sum(ttargets.values())
+            t_sum = sum(tilted.values())
+            if t_sum>0:
+                for s in pairs:
+                    ttargets[s] = tilted[s]*(base_sum/t_sum)
+        crypto_val = sum(qty[s]*pxmap[s] for s in pairs)
+        w = { s: (qty[s]*pxmap[s]/crypto_val) if crypto_val>0 else 0.0 for s in pairs }
+        actions=[]
+        for s in pairs:
+            drift = w[s] - ttargets[s]
+            if abs(drift) > band and crypto_val>0:
+                usd_mv = - drift*crypto_val*mf
+                side = "buy" if usd_mv>0 else "sell"
+                pxe = eff_px(pxmap[s], side)
+                qraw = abs(usd_mv)/pxe if pxe>0 else 0.0
+                qrd  = round_step(qraw, qstep.get(s,0.0))
+                usd_eff = qrd*pxe if side=="buy" else -qrd*pxe
+                if qrd>0 and abs(usd_eff)>=min_usd:
+                    actions.append({"s":s,"side":side,"qty":qrd,"usd":usd_eff,"pxe":pxe})
+        for a in actions:
+            cap = per_asset_caps.get(a["s"])
+            if cap and abs(a["usd"])>cap:
+                sc = cap/abs(a["usd"])
+                a["qty"]*=sc; a["usd"]*=sc
+        buys = [a for a in actions if a["usd"]>0]; sells = [a for a in actions if a["usd"]<0]
+        avail = usd + sum(-a["usd"] for a in sells)
+        need  = sum(a["usd"] for a in buys)
+        if need>avail and need>0:
+            sc = avail/need if avail>0 else 0.0
+            for a in buys:
+                a["qty"]*=sc; a["usd"]*=sc
+        tot = sum(abs(a["usd"]) for a in actions)
+        if tot>daily_cap and tot>0:
+            sc = daily_cap/tot
+            for a in actions:
+                a["qty"]*=sc; a["usd"]*=sc
+        actions = [a for a in actions if abs(a["usd"])>=min_usd]
+        for a in actions:
+            if a["side"]=="buy":
+                usd -= a["usd"]; qty[a["s"]] += a["qty"]
+            else:
+                usd += (-a["usd"]); qty[a["s"]] -= a["qty"]
+        navs.append(usd + sum(qty[s]*pxmap[s] for s in pairs))
+    return navs
+
+
+def _prices(days, pairs, seed):
+    rnd = random.Random(seed)
+    px = np.empty((days, len(pairs)))
+    level = [60000.0, 3000.0, 150.0, 15.0, 0.5][:len(pairs)]
+    for i in range(days):
+        level = [v * math.exp(rnd.gauss(0, 0.04)) for v in level]
+        px[i] = level
+    return px
+
+
+def test_engine_matches_reference_loop_bit_for_bit():
+    base = get_policy(CFG_PATH)
+    variants = [
+        base,
+        base.replace(bands_pct=0.01, move_fraction=0.5, min_trade_usd=100.0),
+        base.replace(momentum=base.momentum.__class__(enabled=False)),
+        base.replace(daily_turnover_cap_usd=5000.0, momentum=base.momentum.__class__(True, 7, 0.2, 3.0)),
+    ]
+    for k, pol in enumerate(variants):
+        targets = dict(pol.pair_targets)
+        pairs = sorted(targets)
+        px = _prices(400, pairs, seed=k)
+        series = [(str(i), dict(zip(pairs, row))) for i, row in enumerate(px.tolist())]
+        qty = {"BTC-USD": 2.0, "ETH-USD": 30.0, "LINK-USD": 0.0, "SOL-USD": 100.0}
+        ref = reference_loop(series, pairs, targets, pol, 20000.0, qty)
+        res = simulate(px, pairs, targets, pol, 20000.0, qty)
+        assert res.navs == ref
+        assert res.trades > 0
+
+
+def test_lookback_index_skips_zero_prices_and_hold_navs():
+    px = np.array([[1.0], [0.0], [3.0], [4.0]])
+    assert lookback_index(px, 1)[:, 0].tolist() == [0, 0, 0, 2]
+    pol = Policy.from_dict({"targets_trading": {"BTC": 1.0}})
+    assert hold_navs(px * 2, ["BTC-USD"], 1.0, {"BTC-USD": 0.5}) == [2.0, 1.0, 4.0, 5.0]
+    assert len(simulate(px, ["BTC-USD"], dict(pol.pair_targets), pol, 0.0, {}).navs) == 4
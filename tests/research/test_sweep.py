@@ -0,0 +1,68 @@
+import json
+
+import numpy as np
+
+from apps.rebalancer.policy import CFG_PATH, get_policy
+from apps.research.sweep import apply_params, evaluate, expand, run_sweep, write_csv
+
+
+def _setup():
+    pol = get_policy(CFG_PATH)
+    targets = dict(pol.pair_targets)
+    pairs = sorted(targets)
+    rng = np.random.default_rng(1)
+    px = np.exp(np.cumsum(rng.normal(0, 0.04, (300, len(pairs))), axis=0)) * [15, 60000, 150, 3000]
+    qty = {"BTC-USD": 1.0, "ETH-USD": 10.0, "LINK-USD": 500.0, "SOL-USD": 50.0}
+    return pol, targets, pairs, px, qty
+
+
+def test_apply_params_nested_and_profile():
+    pol = get_policy(CFG_PATH)
+    p = apply_params(pol, {"profile": "Aggressive", "momentum.lookback_days": 30, "move_fraction": 0.25})
+    assert p.bands_pct == 0.03 and p.momentum.tilt_strength == 1.3
+    assert p.momentum.lookback_days == 30 and p.move_fraction == 0.25
+    assert pol.move_fraction == 1.0  # base untouched
+
+
+def test_random_spec_is_reproducible():
+    spec = {"mode": "random", "samples": 5, "seed": 7,
+            "params": {"bands_pct": {"min": 0.01, "max": 0.05}, "momentum.lookback_days": {"min": 10, "max": 90, "int": True}}}
+    assert expand(spec) == expand(spec)
+    assert all(isinstance(p["momentum.lookback_days"], int) for p in expand(spec))
+
+
+def test_sweep_ranks_and_resumes_from_checkpoint(tmp_path):
+    pol, targets, pairs, px, qty = _setup()
+    ckpt = tmp_path / "ckpt.jsonl"
+    spec = {"params": {"bands_pct": [0.02, 0.05], "momentum.tilt_strength": [0.5, 1.5]}}
+    rows = run_sweep(spec, px, pairs, targets, pol, 10000.0, qty, checkpoint=ckpt, workers=2, chunk_size=1)
+    assert len(rows) == 4
+    sharpes = [r["sharpe"] for r in rows]
+    assert sharpes == sorted(sharpes, reverse=True)
+
+    # worker results equal a direct in-process evaluation
+    best = rows[0]
+    direct = evaluate(px, pairs, targets, apply_params(pol, best["params"]), 10000.0, qty)
+    assert {k: best[k] for k in direct} == direct
+
+    spec["params"]["bands_pct"].append(0.08)
+    rows = run_sweep(spec, px, pairs, targets, pol, 10000.0, qty, checkpoint=ckpt, workers=2)
+    assert len(rows) == 6
+    assert len(ckpt.read_text().splitlines()) == 7  # header + only the two new configs evaluated
+
+    out = tmp_path / "sweep.csv"
+    write_csv(rows, out)
+    lines = out.read_text().splitlines()
+    assert lines[0].startswith("rank,id,bands_pct,momentum.tilt_strength,sharpe") and len(lines) == 7
+    assert json.loads(ckpt.read_text().splitlines()[1])["id"]
+
+    # new prices (or a policy edit, other start balances, ...) invalidate the checkpoint
+    rows = run_sweep(spec, px * 1.01, pairs, targets, pol, 10000.0, qty, checkpoint=ckpt, workers=2)
+    assert len(rows) == 6 and len(ckpt.read_text().splitlines()) == 7
+    assert json.loads(ckpt.read_text().splitlines()[0])["fingerprint"]
+    run_sweep(spec, px * 1.01, pairs, targets, pol, 20000.0, qty, checkpoint=ckpt, workers=2,
+              context={"dates": ["2024-01-01", "2024-12-31"]})
+    before = ckpt.read_text()
+    run_sweep(spec, px * 1.01, pairs, targets, pol, 20000.0, qty, checkpoint=ckpt, workers=2,
+              context={"dates": ["2024-01-01", "2024-12-31"]})
+    assert ckpt.read_text() == before  # same inputs: everything resumed
@@ -4,7 +4,7 @@ Param(
   [int]$IntervalSec = 60
 )
 $root   = Split-Path $PSScriptRoot -Parent
-$record = Join-Path $root "win\record_trade.ps1"
+$import = Join-Path $root "win\import_trades.ps1"
 $health = Join-Path $root "win\health_checks.ps1"
 $fetch  = Join-Path $root "win\fetch_prices_coinbase.ps1"
 
@@ -21,13 +21,20 @@ for ($k=1; $k -le $Slices; $k++) {
   & $health
   if ($LASTEXITCODE -ne 0) { Write-Warning "Health failed on slice $k — stopping."; break }
 
-  foreach ($a in $planObj.actions) {
+  # one import (one process, one transaction) per slice
+  $ts    = [DateTimeOffset]::UtcNow.ToUnixTimeSeconds()
+  $fills = Join-Path $env:TEMP ("twap_slice_{0}_{1}.jsonl" -f $ts, $k)
+  $recs  = foreach ($a in $planObj.actions) {
     $qslice = [double]$a.qty / $Slices
     if ($qslice -le 0) { continue }
-    $sym  = [string]$a.symbol
-    $side = [string]$a.side
     $px   = [double]($(if ($a.psobject.Properties.Name -contains 'px_eff') { $a.px_eff } else { $a.px }))
-    & $record -symbol $sym -side $side -qty $qslice -px $px -fee 0 -feeAsset USD
+    [ordered]@{ ts = $ts; plan = (Split-Path $Plan -Leaf); slice = $k; symbol = [string]$a.symbol;
+                side = [string]$a.side; qty = $qslice; px = $px; fee = 0; fee_asset = "USD" } | ConvertTo-Json -Compress
+  }
+  if ($recs) {
+    Set-Content -Path $fills -Value $recs -Encoding utf8
+    & $import -Files $fills
+    Remove-Item $fills -ErrorAction SilentlyContinue
   }
 
   if ($k -lt $Slices) { Start-Sleep -Seconds $IntervalSec }
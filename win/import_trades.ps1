@@ -0,0 +1,8 @@
+Param(
+  [Parameter(Mandatory=$true)][string[]]$Files,
+  [string]$account = "trading",
+  [string]$method = "HIFO"
+)
+$root = Split-Path $PSScriptRoot -Parent
+$al = @("--account",$account,"--method",$method) + $Files
+& (Join-Path $root "win\_python.ps1") -Script "scripts\import_trades.py" -ArgList $al